@@ -0,0 +1,479 @@
+#!/usr/bin/python3
+"""
+Benchmarks of the readers, transformations, spectra processing, plotting and the
+serialisation of the backend on synthetic files (no network or campaign data needed).
+
+.. code-block:: bash
+
+    python benchmarks/run_benchmarks.py -o before.json
+    # ... change something ...
+    python benchmarks/run_benchmarks.py -o after.json --compare before.json
+
+Every benchmark is run once untimed (imports, caches, numba compilation; reported as
+``first``) and then ``--repeat`` times. Failing benchmarks are reported with their
+error instead of aborting the run, so results of commits that break a function can
+still be compared.
+
+"""
+
+import os
+import io
+import re
+import sys
+import copy
+import json
+import time
+import argparse
+import datetime
+import platform
+import tempfile
+import traceback
+import subprocess
+import contextlib
+import logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+import synthetic
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """register a benchmark
+
+    The decorated function does the untimed setup and returns the callable that is timed.
+    """
+    def decorator(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return decorator
+
+
+class Context:
+    """synthetic setup and the data shared between the benchmarks (read lazily)"""
+    def __init__(self, workdir, scale):
+        self.workdir = workdir
+        starttime = time.perf_counter()
+        self.setup = synthetic.generate(os.path.join(workdir, 'data'), scale=scale)
+        self.generate_seconds = time.perf_counter() - starttime
+        self.day = self.setup['day']
+        self._cache = {}
+
+    def cached(self, key, func):
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
+
+    @property
+    def larda(self):
+        import pyLARDA
+        return self.cached('larda', lambda: pyLARDA.LARDA(config_dir=self.setup['config_dir']).connect(
+            self.setup['campaign'], build_lists=True))
+
+    def interval(self, hours):
+        return [self.day, self.day + datetime.timedelta(hours=hours)]
+
+    def read(self, system, param, hours, *further):
+        return self.cached((system, param, hours) + tuple(map(str, further)),
+                           lambda: self.larda.read(system, param, self.interval(hours), *further))
+
+    @property
+    def spectra(self):
+        import pyLARDA.SpectraProcessing as SpectraProcessing
+        return self.cached('spectra', lambda: SpectraProcessing.load_spectra_rpgfmcw94(self.larda, self.interval(2)))
+
+
+# --- import time ----------------------------------------------------------------------------
+
+# must not be loaded by the import or a plain read (the plot functions import them on first use)
+HEAVY_MODULES = ['matplotlib', 'scipy', 'xarray', 'pandas', 'numba', 'requests', 'tqdm']
+
+
+def _fresh_interpreter(ctx, statement, forbidden=HEAVY_MODULES):
+    """run statement in a new python process (wall time includes the interpreter startup)"""
+    code = f"import sys\n{statement}\nprint('loaded:' + ','.join(m for m in {forbidden!r} if m in sys.modules))"
+    env = {**os.environ, 'PYTHONPATH': ROOT, 'LARDA_CONFIG_DIR': ctx.setup['config_dir']}
+
+    def call():
+        proc = subprocess.run([sys.executable, '-c', code], cwd=ctx.workdir, env=env,
+                              capture_output=True, text=True)
+        assert proc.returncode == 0, proc.stderr.strip().splitlines()[-1]
+        loaded = [l for l in proc.stdout.splitlines() if l.startswith('loaded:')][-1][7:]
+        assert not loaded, f'loads {loaded}'
+    return call
+
+
+@benchmark('import_pyLARDA')
+def bench_import(ctx):
+    return _fresh_interpreter(ctx, 'import pyLARDA')
+
+
+@benchmark('import_Transformations')
+def bench_import_transformations(ctx):
+    return _fresh_interpreter(ctx, 'import pyLARDA.Transformations')
+
+
+@benchmark('import_connect_read')
+def bench_import_read(ctx):
+    ctx.larda  # writes the connectordump
+    day = f'{ctx.day.year}, {ctx.day.month}, {ctx.day.day}'
+    return _fresh_interpreter(ctx, f"""import datetime, pyLARDA
+larda = pyLARDA.LARDA().connect('{ctx.setup['campaign']}', build_lists=False)
+larda.read('MIRA', 'Zg', [datetime.datetime({day}), datetime.datetime({day}, 12)], [0, 'max'])""")
+
+
+@benchmark('import_kernels_warmup')
+def bench_kernels_warmup(ctx):
+    """loading the compiled kernels, only the untimed first run compiles when the numba cache is empty"""
+    return _fresh_interpreter(ctx, 'import pyLARDA.compiled\npyLARDA.compiled.warmup()', forbidden=[])
+
+
+# --- file lists ---------------------------------------------------------------------------
+
+@benchmark('connect_build_lists')
+def bench_connect_build(ctx):
+    import pyLARDA
+    return lambda: pyLARDA.LARDA(config_dir=ctx.setup['config_dir']).connect(ctx.setup['campaign'], build_lists=True)
+
+
+@benchmark('connect_load_lists')
+def bench_connect_load(ctx):
+    import pyLARDA
+    ctx.larda
+    return lambda: pyLARDA.LARDA(config_dir=ctx.setup['config_dir']).connect(ctx.setup['campaign'], build_lists=False)
+
+
+@benchmark('build_filehandler_tree')
+def bench_filehandler_tree(ctx):
+    conn = ctx.larda.connectors['TREE']
+    return conn.build_filehandler
+
+
+@benchmark('build_filehandler_limrad94')
+def bench_filehandler_limrad94(ctx):
+    conn = ctx.larda.connectors['LIMRAD94']
+    return conn.build_filehandler
+
+
+# --- readers ------------------------------------------------------------------------------
+
+@benchmark('collect_mira_Zg')
+def bench_collect_mira(ctx):
+    return lambda: ctx.larda.read('MIRA', 'Zg', ctx.interval(24), [0, 'max'])
+
+
+@benchmark('collect_limrad94_Ze')
+def bench_collect_limrad94(ctx):
+    return lambda: ctx.larda.read('LIMRAD94', 'Ze', ctx.interval(2), [0, 'max'])
+
+
+@benchmark('collect_limrad94_VSpec')
+def bench_collect_limrad94_spec(ctx):
+    return lambda: ctx.larda.read('LIMRAD94', 'VSpec', ctx.interval(2), [0, 'max'])
+
+
+@benchmark('collect_peaktree_Z_0')
+def bench_collect_peaktree(ctx):
+    return lambda: ctx.larda.read('peakTree', 'Z_0', ctx.interval(24), [0, 'max'])
+
+
+@benchmark('collect_peaktree_tree')
+def bench_collect_peaktree_tree(ctx):
+    return lambda: ctx.larda.read('peakTree', 'tree', ctx.interval(6), [1000, 3000])
+
+
+@benchmark('collect_hatpro_lwp')
+def bench_collect_hatpro(ctx):
+    return lambda: ctx.larda.read('HATPRObinary', 'lwp', ctx.interval(24))
+
+
+# --- transformations ----------------------------------------------------------------------
+
+@benchmark('join')
+def bench_join(ctx):
+    import pyLARDA.Transformations as Transf
+    first = ctx.larda.read('MIRA', 'Zg', [ctx.day, ctx.day + datetime.timedelta(hours=5.9)], [0, 'max'])
+    second = ctx.larda.read('MIRA', 'Zg', [ctx.day + datetime.timedelta(hours=6), ctx.day + datetime.timedelta(hours=11.9)], [0, 'max'])
+    return lambda: Transf.join(first, second)
+
+
+@benchmark('interpolate2d')
+def bench_interpolate2d(ctx):
+    import pyLARDA.Transformations as Transf
+    mira = ctx.read('MIRA', 'Zg', 2, [0, 'max'])
+    limrad = ctx.read('LIMRAD94', 'Ze', 2, [0, 'max'])
+    return lambda: Transf.interpolate2d(mira, new_time=limrad['ts'], new_range=limrad['rg'])
+
+
+# --- spectra processing -------------------------------------------------------------------
+
+@benchmark('load_spectra_rpgfmcw94')
+def bench_load_spectra(ctx):
+    import pyLARDA.SpectraProcessing as SpectraProcessing
+    return lambda: SpectraProcessing.load_spectra_rpgfmcw94(ctx.larda, ctx.interval(2))
+
+
+@benchmark('noise_estimation')
+def bench_noise_estimation(ctx):
+    import pyLARDA.SpectraProcessing as SpectraProcessing
+    spectra = ctx.spectra
+    return lambda: SpectraProcessing.noise_estimation_uncompressed_data(
+        spectra['VHSpec'], no_av=spectra['no_av'], n_std=6.0, rg_offsets=spectra['rg_offsets'])
+
+
+@benchmark('despeckle2D')
+def bench_despeckle(ctx):
+    import pyLARDA.SpectraProcessing as SpectraProcessing
+    spectra = ctx.spectra
+    return lambda: SpectraProcessing.despeckle2D(spectra['VHSpec']['var'])
+
+
+@benchmark('spectra2moments')
+def bench_spectra2moments(ctx):
+    import pyLARDA.SpectraProcessing as SpectraProcessing
+    spectra = ctx.spectra
+    paraminfo = ctx.larda.connectors['LIMRAD94'].system_info['params']
+    return lambda: SpectraProcessing.spectra2moments(spectra, paraminfo)
+
+
+@benchmark('spectra2moments_chunked')
+def bench_spectra2moments_chunked(ctx):
+    """load_spectra_rpgfmcw94 and spectra2moments in chunks of 16 time steps"""
+    import pyLARDA.SpectraProcessing as SpectraProcessing
+    return lambda: SpectraProcessing.spectra2moments_chunked(ctx.larda, ctx.interval(2), chunk_size=16)
+
+
+@benchmark('dealiasing')
+def bench_dealiasing(ctx):
+    import pyLARDA.SpectraProcessing as SpectraProcessing
+    spectra = ctx.spectra
+    return lambda: SpectraProcessing.dealiasing(
+        spectra['VHSpec']['var'], spectra['vel'], spectra['SLv']['var'], spectra['rg_offsets'])
+
+
+@benchmark('spectra2polarimetry')
+def bench_spectra2polarimetry(ctx):
+    """SLDR, correlation coefficient, ZDR and PhiDP; the synthetic files have no horizontal channel, it is derived from VSpec"""
+    import pyLARDA.SpectraProcessing as SpectraProcessing
+    spectra = dict(ctx.spectra)
+    for key, factor in [('HSpec', 0.45), ('ReVHSpec', 0.05), ('ImVHSpec', 0.01)]:
+        spectra[key] = {**spectra['VHSpec'], 'var': spectra['VHSpec']['var'] * factor}
+    spectra['Hnoise'] = spectra['Vnoise']
+    paraminfo = ctx.larda.connectors['LIMRAD94'].system_info['params']
+    return lambda: SpectraProcessing.spectra2polarimetry(spectra, paraminfo, spectral=True)
+
+
+# --- plotting -----------------------------------------------------------------------------
+
+def _render(fig_ax):
+    import matplotlib.pyplot as plt
+    fig = fig_ax[0]
+    fig.savefig(io.BytesIO(), format='png', dpi=100)
+    plt.close(fig)
+
+
+@benchmark('plot_timeheight2')
+def bench_plot_timeheight(ctx):
+    import pyLARDA.Transformations as Transf
+    data = ctx.read('MIRA', 'Zg', 24, [0, 'max'])
+    return lambda: _render(Transf.plot_timeheight2(data, var_converter='lin2z'))
+
+
+@benchmark('plot_timeseries2')
+def bench_plot_timeseries(ctx):
+    import pyLARDA.Transformations as Transf
+    data = ctx.read('HATPRObinary', 'lwp', 24)
+    return lambda: _render(Transf.plot_timeseries2(data))
+
+
+@benchmark('plot_spectra')
+def bench_plot_spectra(ctx):
+    import pyLARDA.Transformations as Transf
+    spec = ctx.read('LIMRAD94', 'VSpec', 2, [0, 'max'])
+    single = Transf.slice_container(spec, value={'time': [spec['ts'][10]], 'range': [2000]})
+    return lambda: _render(Transf.plot_spectra(single, z_converter='lin2z'))
+
+
+# --- backend ------------------------------------------------------------------------------
+
+def _http_server(ctx):
+    """import the backend with its state (logs, admission, metrics) in the working directory"""
+    def load():
+        os.environ['LARDA_CONFIG_DIR'] = ctx.setup['config_dir']
+        os.environ['LARDA_METRICS_DIR'] = os.path.join(ctx.workdir, 'metrics')
+        os.environ['LARDA_ADMISSION_FILE'] = os.path.join(ctx.workdir, 'admission.json')
+        # no response cache, every request is read and serialised
+        os.environ['LARDA_RESPONSE_CACHE_MB'] = '0'
+        sys.path.insert(0, os.path.join(ROOT, 'http_server'))
+        cwd = os.getcwd()
+        os.chdir(ctx.workdir)
+        try:
+            import http_server
+        finally:
+            os.chdir(cwd)
+        return http_server
+    ctx.larda  # writes the connectordump the backend loads
+    return ctx.cached('http_server', load)
+
+
+@benchmark('http_serialise_json')
+def bench_serialise_json(ctx):
+    http_server = _http_server(ctx)
+    data = ctx.read('MIRA', 'Zg', 24, [0, 'max'])
+    return lambda: json.dumps(http_server.prepare_container(copy.deepcopy(data), None, None))
+
+
+@benchmark('http_serialise_msgpack')
+def bench_serialise_msgpack(ctx):
+    import msgpack
+    import pyLARDA.transfer as transfer
+    http_server = _http_server(ctx)
+    data = ctx.read('MIRA', 'Zg', 24, [0, 'max'])
+    codec = transfer.negotiate(','.join(transfer.available_codecs()))
+    return lambda: msgpack.packb(http_server.prepare_container(copy.deepcopy(data), codec, None))
+
+
+@benchmark('http_request_msgpack')
+def bench_http_request(ctx):
+    import pyLARDA.transfer as transfer
+    http_server = _http_server(ctx)
+    client = http_server.app.test_client()
+    ts = [(t - datetime.datetime(1970, 1, 1)).total_seconds() for t in ctx.interval(24)]
+    url = '/api/{}/MIRA/Zg?interval={:.0f}-{:.0f},0-max&rformat=msgpack&codecs={}'.format(
+        ctx.setup['campaign'], ts[0], ts[1], ','.join(transfer.available_codecs()))
+
+    def request():
+        resp = client.get(url)
+        assert resp.status_code == 200, f'status {resp.status_code} {resp.get_data()[:200]}'
+        return resp.get_data()
+    return request
+
+
+def run(ctx, func, repeat, quiet=True):
+    """setup and time one benchmark
+
+    Returns:
+        dict with ``first``, ``times``, ``min``, ``median`` (seconds) or ``error``
+    """
+    out = io.StringIO()
+    redirect = (contextlib.redirect_stdout(out), contextlib.redirect_stderr(out)) if quiet else ()
+    try:
+        with contextlib.ExitStack() as stack:
+            for r in redirect:
+                stack.enter_context(r)
+            call = func(ctx)
+            starttime = time.perf_counter()
+            call()
+            first = time.perf_counter() - starttime
+            times = []
+            for _ in range(repeat):
+                starttime = time.perf_counter()
+                call()
+                times.append(time.perf_counter() - starttime)
+    except Exception as e:
+        return {'error': f'{type(e).__name__}: {e}', 'traceback': traceback.format_exc()}
+    return {'first': first, 'times': times,
+            'min': min(times) if times else first,
+            'median': float(np.median(times)) if times else first}
+
+
+def meta(ctx, args):
+    def git(*cmd):
+        try:
+            return subprocess.run(['git', *cmd], cwd=ROOT, capture_output=True, text=True,
+                                  timeout=30).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ''
+    return {
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'date': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'scale': args.scale,
+        'repeat': args.repeat,
+        'generate_seconds': ctx.generate_seconds,
+        'synthetic_mb': ctx.setup['nbytes']/1024**2,
+        'tree_files': ctx.setup['n_tree_files'],
+    }
+
+
+def compare(new_run, old, threshold):
+    """table of the median times against an older result file"""
+    lines = ['{:<28s} {:>10s} {:>10s} {:>8s}'.format('benchmark', 'old [s]', 'new [s]', 'ratio')]
+    if old['meta'].get('scale') != new_run['meta']['scale']:
+        lines.insert(0, 'note: the runs used a different --scale')
+    for name, new in new_run['results'].items():
+        prev = old['results'].get(name)
+        if prev is None or 'error' in prev or 'error' in new:
+            status = new.get('error', prev.get('error', '') if prev else 'new')
+            lines.append('{:<28s} {}'.format(name, status.splitlines()[0][:60]))
+            continue
+        ratio = new['median']/prev['median'] if prev['median'] > 0 else float('inf')
+        flag = 'slower' if ratio > 1 + threshold else ('faster' if ratio < 1 - threshold else '')
+        lines.append('{:<28s} {:10.4f} {:10.4f} {:8.2f} {}'.format(name, prev['median'], new['median'], ratio, flag))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', help='result json, default benchmark_<commit>.json')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark')
+    parser.add_argument('--scale', type=float, default=1.0, help='size of the synthetic data')
+    parser.add_argument('--only', help='regex, run only the matching benchmarks')
+    parser.add_argument('--compare', help='earlier result json to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change reported as slower/faster')
+    parser.add_argument('--workdir', help='directory for the synthetic data, default a temporary one')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the output of the benchmarked functions')
+    parser.add_argument('-l', '--list', action='store_true', help='list the benchmarks')
+    args = parser.parse_args(argv)
+
+    selected = [(n, f) for n, f in BENCHMARKS if not args.only or re.search(args.only, n)]
+    if args.list:
+        print('\n'.join(n for n, _ in selected))
+        return 0
+
+    logging.basicConfig(level=logging.INFO)
+    if not args.verbose:
+        # the backend sets its own log levels on import
+        logging.disable(logging.WARNING)
+
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir or stack.enter_context(tempfile.TemporaryDirectory(prefix='larda_bench_'))
+        ctx = Context(workdir, args.scale)
+        print(f'synthetic data {ctx.setup["nbytes"]/1024**2:.0f} MB in {ctx.generate_seconds:.1f}s at {workdir}')
+
+        results = {}
+        for name, func in selected:
+            results[name] = run(ctx, func, args.repeat, quiet=not args.verbose)
+            r = results[name]
+            if 'error' in r:
+                print(f'{name:<28s} failed {r["error"].splitlines()[0][:80]}')
+                if args.verbose:
+                    print(r['traceback'])
+            else:
+                print(f'{name:<28s} {r["median"]:9.4f}s  (min {r["min"]:.4f}s, first {r["first"]:.4f}s)')
+        info = meta(ctx, args)
+
+    output = args.output or 'benchmark_{}.json'.format(info['commit'][:8] or 'nogit')
+    new_run = {'meta': info, 'results': results}
+    with open(output, 'w') as f:
+        json.dump(new_run, f, indent=1)
+    print(f'results written to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(new_run, json.load(f), args.threshold))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
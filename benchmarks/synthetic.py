@@ -0,0 +1,417 @@
+#!/usr/bin/python3
+"""
+Generator of synthetic measurement files and a matching larda configuration.
+
+The files follow the layout of the real instruments closely enough to go through
+the regular readers:
+
+- LIMRAD94 (RPG-FMCW 94) LV0 and LV1 netCDF with 3 chirps, Doppler spectra of a
+  cloud layer above a range dependent noise floor, optionally with ghost echoes and
+  speckle (``artefacts=True``, for the tests of the filters)
+- MIRA mmclx netCDF (reflectivity, velocity, LDR)
+- peakTree netCDF (binary trees of up to 7 nodes per pixel)
+- HATPRO binary ``.LWP`` files
+- a nested ``YYYY/MM/DD`` tree of many (empty) files for building the filelists
+
+.. code-block:: python
+
+    import synthetic
+    setup = synthetic.generate('/tmp/larda_bench', scale=1.0)
+    larda = pyLARDA.LARDA(config_dir=setup['config_dir']).connect(setup['campaign'])
+
+``scale`` multiplies the number of profiles per file and the number of files in the
+nested tree, the range and velocity dimensions stay fixed.
+
+"""
+
+import os
+import shutil
+import datetime
+from pathlib import Path
+
+import numpy as np
+import netCDF4
+
+CAMPAIGN = 'synthetic'
+DAY = datetime.datetime(2019, 1, 1)
+
+# LIMRAD94 chirp table: range bins, first range, range resolution, Doppler bins, Nyquist velocity
+CHIRPS = [
+    {'n_rg': 60, 'rg0': 100., 'drg': 15., 'n_vel': 256, 'maxvel': 9.0, 'avgnum': 4096, 'fft': 512, 'inttime': 0.36},
+    {'n_rg': 80, 'rg0': 1000., 'drg': 30., 'n_vel': 128, 'maxvel': 6.0, 'avgnum': 2048, 'fft': 256, 'inttime': 0.9},
+    {'n_rg': 40, 'rg0': 3400., 'drg': 60., 'n_vel': 128, 'maxvel': 4.5, 'avgnum': 1024, 'fft': 256, 'inttime': 0.7},
+]
+
+SINCE2001 = datetime.datetime(2001, 1, 1)
+
+
+def _unix(dt):
+    return (dt - datetime.datetime(1970, 1, 1)).total_seconds()
+
+
+def cloud_layer(ts, rg):
+    """reflectivity [mm6/m3], mean velocity and width of a slowly moving cloud layer
+
+    Args:
+        ts: seconds of the day, shape (n_ts,)
+        rg: range, shape (n_rg,)
+
+    Returns:
+        Z, v, width with shape (n_ts, n_rg), Z is 0 outside of the cloud
+    """
+    base = 1200. + 400.*np.sin(2*np.pi*ts/21600.)
+    top = base + 1500. + 300.*np.cos(2*np.pi*ts/7200.)
+    rel = (rg[np.newaxis, :] - base[:, np.newaxis])/(top - base)[:, np.newaxis]
+    inside = (rel > 0) & (rel < 1)
+    z_db = -35. + 25.*np.sin(np.pi*np.clip(rel, 0, 1)) + 5.*np.sin(2*np.pi*ts/900.)[:, np.newaxis]
+    Z = np.where(inside, 10**(z_db/10.), 0.)
+    v = -0.4 - 1.2*(1 - np.clip(rel, 0, 1))
+    width = 0.15 + 0.2*(1 - np.clip(rel, 0, 1))
+    return Z, v, width
+
+
+def spectra_artefacts(spec, rg, vel, noise, signal, first_chirp, rng):
+    """add the features the LIMRAD94 spectra filters are looking for
+
+    Depending on the profile index modulo 12:
+
+    - 0: strong layer at 1.6-2.4 km and a weak curtain-like ghost echo in the first chirp
+    - 3: heavy rain below 400 m and weak ghost echoes near the Nyquist velocity of the upper chirps
+    - 5 to 11: noise removed (0 outside of the cloud), except for isolated speckle
+
+    Args:
+        spec: spectra of one chirp, shape (n_ts, n_rg, n_vel), modified in place
+        rg: range, shape (n_rg,)
+        vel: velocity bins, shape (n_vel,)
+        noise: noise power within the spectrum, shape (n_rg,)
+        signal: True where the cloud layer is, shape (n_ts, n_rg)
+        first_chirp (bool): the chirp is the lowest one
+        rng: numpy random generator
+    """
+    kind = np.arange(spec.shape[0]) % 12
+    noise_bin = noise[:, np.newaxis]/vel.size
+
+    def peak(v, width):
+        return np.exp(-0.5*((vel - v)/width)**2)
+
+    layer = (rg > 1600.) & (rg < 2400.)
+    spec[np.ix_(kind == 0, layer)] += 30.*peak(-1.0, 0.3)/peak(-1.0, 0.3).sum()
+    if first_chirp:
+        curtain = (rg > 300.) & (rg < 900.)
+        spec[np.ix_(kind == 0, curtain)] += 10.*noise_bin[curtain]*peak(0.5, 0.5)
+
+    rain = rg < 400.
+    spec[np.ix_(kind == 3, rain)] += 100.*peak(-4.0, 0.6)/peak(-4.0, 0.6).sum()
+    if not first_chirp:
+        spec[kind == 3] += 10.*noise_bin*peak(vel[-1] - 0.5, 0.15)
+
+    removed = (kind >= 5)[:, np.newaxis] & ~signal
+    speckle = rng.random(signal.shape) < 0.03
+    spec[removed & ~speckle] = 0.
+
+
+def write_limrad94(directory, begin, n_ts, rng, artefacts=False):
+    """one hour of LIMRAD94 LV0 (spectra) and LV1 (moments)
+
+    Args:
+        artefacts (bool, optional): add ghost echoes and speckle to the spectra, see :func:`spectra_artefacts`.
+            All chirps get the Doppler length and Nyquist velocity of the first one, the ghost echo filter
+            near the Nyquist velocity does not reach the data of chirps interpolated to a wider velocity range.
+
+    Returns:
+        list of the two filenames
+    """
+    chirps = [dict(c, n_vel=CHIRPS[0]['n_vel'], maxvel=CHIRPS[0]['maxvel']) for c in CHIRPS] if artefacts else CHIRPS
+    fname = begin.strftime('%y%m%d_%H%M%S') + '_P05_ZEN'
+    ts = np.linspace(0, 3600, n_ts, endpoint=False)
+    sod = ts + (begin - begin.replace(hour=0, minute=0, second=0)).total_seconds()
+    time_2001 = (begin - SINCE2001).total_seconds() + ts
+
+    files = []
+    for level in ['LV0', 'LV1']:
+        f = os.path.join(directory, f'{fname}.{level}.NC')
+        with netCDF4.Dataset(f, 'w', format='NETCDF4') as ncD:
+            ncD.createDimension('Time', n_ts)
+            ncD.createDimension('Chirp', len(CHIRPS))
+            _var(ncD, 'Time', 'i4', ('Time',), np.floor(time_2001), 'sec')
+            _var(ncD, 'Timems', 'i4', ('Time',), np.round((time_2001 % 1)*1000), 'msec')
+            for name, key, dtype in [('MaxVel', 'maxvel', 'f4'), ('DoppLen', 'n_vel', 'i4'),
+                                     ('AvgNum', 'avgnum', 'i4'), ('ChirpFFTSize', 'fft', 'i4'),
+                                     ('SeqIntTime', 'inttime', 'f4'), ('RangeRes', 'drg', 'f4')]:
+                _var(ncD, name, dtype, ('Chirp',), [c[key] for c in chirps], '-')
+
+            for ic, chirp in enumerate(chirps):
+                rg = chirp['rg0'] + chirp['drg']*np.arange(chirp['n_rg'])
+                ncD.createDimension(f'C{ic+1}Range', chirp['n_rg'])
+                _var(ncD, f'C{ic+1}Range', 'f4', (f'C{ic+1}Range',), rg, 'm')
+                dims = ('Time', f'C{ic+1}Range')
+
+                Z, v, width = cloud_layer(sod, rg)
+                # noise power within the spectrum, increasing with range
+                noise = 10**(-6.5)*(rg/1000.)**2
+                noise2d = np.broadcast_to(noise, Z.shape)
+
+                if level == 'LV1':
+                    cloud = Z > 0
+                    fill = lambda a: np.where(cloud, a, -999.)
+                    _var(ncD, f'C{ic+1}ZE', 'f4', dims, fill(Z), 'mm^6/m^3')
+                    _var(ncD, f'C{ic+1}MeanVel', 'f4', dims, fill(v), 'm/s')
+                    _var(ncD, f'C{ic+1}SpecWidth', 'f4', dims, fill(width), 'm/s')
+                    _var(ncD, f'C{ic+1}Skew', 'f4', dims, fill(rng.normal(0, 0.2, Z.shape)), '-')
+                    _var(ncD, f'C{ic+1}Kurt', 'f4', dims, fill(3 + rng.normal(0, 0.3, Z.shape)), '-')
+                    _var(ncD, f'C{ic+1}SLv', 'f4', dims, noise2d*3/chirp['n_vel'], 'mm^6/m^3')
+                    continue
+
+                ncD.createDimension(f'C{ic+1}Vel', chirp['n_vel'])
+                dv = 2*chirp['maxvel']/chirp['n_vel']
+                vel = np.linspace(-chirp['maxvel'] + 0.5*dv, chirp['maxvel'] - 0.5*dv, chirp['n_vel'])
+                gauss = np.exp(-0.5*((vel[np.newaxis, np.newaxis, :] - v[:, :, np.newaxis])/width[:, :, np.newaxis])**2)
+                gauss /= gauss.sum(axis=2, keepdims=True)
+                # averaged noise fluctuates with the number of spectral averages
+                k = chirp['avgnum']/chirp['n_vel']
+                spec = noise[np.newaxis, :, np.newaxis]/chirp['n_vel']*rng.gamma(k, 1/k, size=gauss.shape) \
+                    + Z[:, :, np.newaxis]*gauss
+                if artefacts:
+                    spectra_artefacts(spec, rg, vel, noise, Z > 0, ic == 0, rng)
+                _var(ncD, f'C{ic+1}VSpec', 'f4', dims + (f'C{ic+1}Vel',), spec, 'mm^6/m^3')
+                _var(ncD, f'C{ic+1}VNoisePow', 'f4', dims, noise2d, 'mm^6/m^3')
+        files.append(f)
+    return files
+
+
+def write_mira(directory, begin, n_ts, rng, hours=6):
+    """mmclx file with Zg, VELg and LDRg"""
+    f = os.path.join(directory, begin.strftime('%Y%m%d_%H%M') + '.mmclx')
+    ts = np.linspace(0, hours*3600, n_ts, endpoint=False)
+    sod = ts + (begin - begin.replace(hour=0, minute=0)).total_seconds()
+    unix = _unix(begin) + ts
+    rg = 150. + 30.*np.arange(400)
+    Z, v, width = cloud_layer(sod, rg)
+    cloud = Z > 0
+    with netCDF4.Dataset(f, 'w', format='NETCDF4') as ncD:
+        ncD.createDimension('time', n_ts)
+        ncD.createDimension('range', rg.size)
+        _var(ncD, 'time', 'i4', ('time',), np.floor(unix), 'seconds since 1970-01-01 00:00:00 UTC')
+        _var(ncD, 'microsec', 'i4', ('time',), np.round((unix % 1)*1e6), 'microseconds')
+        _var(ncD, 'range', 'f4', ('range',), rg, 'm')
+        _var(ncD, 'Zg', 'f4', ('time', 'range'), np.where(cloud, Z*rng.lognormal(0, 0.1, Z.shape), np.nan),
+             'Z', yrange=[-50., 20.])
+        _var(ncD, 'VELg', 'f4', ('time', 'range'), np.where(cloud, v + rng.normal(0, 0.05, Z.shape), np.nan),
+             'm/s', yrange=[-4., 4.])
+        _var(ncD, 'RMSg', 'f4', ('time', 'range'), np.where(cloud, width, np.nan), 'm/s', yrange=[0., 2.])
+        _var(ncD, 'LDRg', 'f4', ('time', 'range'), np.where(cloud, 10**(rng.normal(-25, 3, Z.shape)/10.), np.nan),
+             '', yrange=[-30., 0.])
+    return f
+
+
+def write_peaktree(directory, begin, n_ts, rng, hours=6, n_nodes=7):
+    """peakTree file, the nodes of a pixel form a binary tree (children of k at 2k+1, 2k+2)"""
+    f = os.path.join(directory, begin.strftime('%Y%m%d_%H%M') + '_peakTree.nc4')
+    ts = np.linspace(0, hours*3600, n_ts, endpoint=False)
+    sod = ts + (begin - begin.replace(hour=0, minute=0)).total_seconds()
+    rg = 150. + 30.*np.arange(200)
+    Z, v, width = cloud_layer(sod, rg)
+    shape = Z.shape + (n_nodes,)
+
+    # number of nodes 1, 3, 5 or 7 inside the cloud
+    no_nodes = np.where(Z > 0, 2*rng.integers(0, 4, Z.shape) + 1, 0)
+    node = np.arange(n_nodes)[np.newaxis, np.newaxis, :]
+    avail = node < no_nodes[:, :, np.newaxis]
+    parent = np.where(node == 0, -1, (node - 1)//2)
+    fields = {
+        'parent': parent + 0*no_nodes[:, :, np.newaxis],
+        'Z': 10*np.log10(np.maximum(Z, 1e-10))[:, :, np.newaxis] - 3*np.log2(node + 1),
+        'v': v[:, :, np.newaxis] + rng.normal(0, 0.3, shape),
+        'width': width[:, :, np.newaxis]/(1 + node*0.3),
+        'skew': rng.normal(0, 0.3, shape),
+        'threshold': np.full(shape, -40.) + node,
+        'prominence': rng.uniform(0, 10, shape),
+        'bound_l': np.full(shape, 100) + node,
+        'bound_r': np.full(shape, 150) - node,
+        'LDR': rng.normal(-25, 3, shape),
+        'ldrmax': rng.normal(-20, 3, shape),
+    }
+    with netCDF4.Dataset(f, 'w', format='NETCDF4') as ncD:
+        ncD.createDimension('time', n_ts)
+        ncD.createDimension('range', rg.size)
+        ncD.createDimension('nodes', n_nodes)
+        _var(ncD, 'timestamp', 'f8', ('time',), _unix(begin) + ts, 's')
+        _var(ncD, 'range', 'f4', ('range',), rg, 'm')
+        _var(ncD, 'no_nodes', 'f4', ('time', 'range'), no_nodes, '', yrange=[0., 5.])
+        for name, values in fields.items():
+            _var(ncD, name, 'f4', ('time', 'range', 'nodes'), np.where(avail, values, -999.), '',
+                 yrange=[-40., 10.])
+    return f
+
+
+def write_hatpro_lwp(directory, day, n_ts, rng):
+    """HATPRO binary liquid water path file (``YYMMDD.LWP``, code 934501978)"""
+    f = os.path.join(directory, day.strftime('%y%m%d') + '.LWP')
+    ts = np.linspace(0, 86400, n_ts, endpoint=False)
+    lwp = np.clip(80*np.sin(2*np.pi*ts/21600.) + rng.normal(0, 10, n_ts), -5, None)
+    head = np.zeros(1, dtype=np.dtype([('code', np.uint32), ('n', np.uint32), ('min', np.float32),
+                                        ('max', np.float32), ('timref', np.int32), ('retr', np.int32)]))
+    head[0] = (934501978, n_ts, lwp.min(), lwp.max(), 1, 0)
+    data = np.zeros(n_ts, dtype=np.dtype([('mactime', np.int32), ('rf', 'u1'),
+                                          ('var', np.float32), ('var_a', np.float32)]))
+    data['mactime'] = (day - SINCE2001).total_seconds() + ts
+    data['var'] = lwp
+    data['var_a'] = 90.
+    with open(f, 'wb') as fh:
+        head.tofile(fh)
+        data.tofile(fh)
+    return f
+
+
+def write_tree(directory, n_files, per_day=24):
+    """nested ``YYYY/MM/DD`` tree of empty files, with a quicklook next to every data file"""
+    n_days = int(np.ceil(n_files/per_day))
+    count = 0
+    for i_day in range(n_days):
+        day = DAY + datetime.timedelta(days=i_day)
+        subdir = os.path.join(directory, day.strftime('%Y/%m/%d'))
+        os.makedirs(subdir, exist_ok=True)
+        for i in range(min(per_day, n_files - count)):
+            name = (day + datetime.timedelta(hours=24/per_day*i)).strftime('%Y%m%d_%H%M')
+            Path(subdir, name + '.mmclx').touch()
+            Path(subdir, name + '_quicklook.png').touch()
+            count += 1
+    return count
+
+
+def config(base, connectordump, last_day):
+    """campaigns.toml and params toml (the systems use the templates shipped with larda)"""
+    dateregex = '(?P<year>\\d{4})(?P<month>\\d{2})(?P<day>\\d{2})_(?P<hour>\\d{2})(?P<minute>\\d{2})'
+    campaigns = f"""[{CAMPAIGN}]
+    location = "Synthetic"
+    coordinates = [51.35, 12.43]
+    altitude = 125
+    mira_azi_zero = 0
+    duration = [["{DAY:%Y%m%d}", "{last_day:%Y%m%d}"]]
+    systems = ["LIMRAD94", "MIRA", "peakTree", "HATPRObinary", "TREE"]
+    cloudnet_stationname = 'synthetic'
+    info_text_loc = 'default'
+    param_config_file = 'params_{CAMPAIGN}.toml'
+    connectordump = '{connectordump}/'
+"""
+    params = f"""[LIMRAD94]
+  template = 'template_rpg94.toml'
+  [LIMRAD94.path.l0]
+    base_dir = '{base}/limrad94/'
+    matching_subdirs = '(\\d{{6}}_\\d{{6}}_P05_ZEN.LV0.NC)'
+    date_in_filename = '(?P<year>\\d{{2}})(?P<month>\\d{{2}})(?P<day>\\d{{2}})_(?P<hour>\\d{{2}})(?P<minute>\\d{{2}})(?P<second>\\d{{2}})'
+  [LIMRAD94.path.l1]
+    base_dir = '{base}/limrad94/'
+    matching_subdirs = '(\\d{{6}}_\\d{{6}}_P05_ZEN.LV1.NC)'
+    date_in_filename = '(?P<year>\\d{{2}})(?P<month>\\d{{2}})(?P<day>\\d{{2}})_(?P<hour>\\d{{2}})(?P<minute>\\d{{2}})(?P<second>\\d{{2}})'
+  [LIMRAD94.params.ChirpFFTSize]
+    variable_name = 'ChirpFFTSize'
+    ncreader = 'aux'
+    var_unit = '-'
+    var_lims = []
+  [LIMRAD94.params.SeqIntTime]
+    variable_name = 'SeqIntTime'
+    ncreader = 'aux'
+    var_unit = 's'
+    var_lims = []
+
+[MIRA]
+  template = 'template_mira.toml'
+  [MIRA.path.mmclx]
+    base_dir = '{base}/mira/'
+    matching_subdirs = '(\\d{{8}}_\\d{{4}}.mmclx)'
+    date_in_filename = '{dateregex}'
+
+[peakTree]
+  template = 'template_peakTree.toml'
+  [peakTree.path.nc4]
+    base_dir = '{base}/peaktree/'
+    matching_subdirs = '(\\d{{8}}_\\d{{4}}_peakTree.nc4)'
+    date_in_filename = '{dateregex}'
+
+[HATPRObinary]
+  template = 'template_hatpro_binary.toml'
+  [HATPRObinary.path.LWPbin]
+    base_dir = '{base}/hatpro/'
+    matching_subdirs = '(\\d{{6}}.LWP)'
+    date_in_filename = '(?P<year>\\d{{2}})(?P<month>\\d{{2}})(?P<day>\\d{{2}})'
+
+[TREE]
+  [TREE.path.mmclx]
+    base_dir = '{base}/tree/'
+    matching_subdirs = '(\\d{{4}}/\\d{{2}}/\\d{{2}}/\\d{{8}}_\\d{{4}}.mmclx)'
+    date_in_filename = '{dateregex}'
+  [TREE.generic]
+    time_variable = 'time'
+    range_variable = 'range'
+    colormap = 'jet'
+    which_path = 'mmclx'
+    time_conversion = 'unix'
+    range_conversion = 'none'
+    var_conversion = 'none'
+    ncreader = 'timeheight'
+    rg_unit = 'm'
+  [TREE.params.Zg]
+    variable_name = 'Zg'
+    var_unit = 'Z'
+    var_lims = [-50, 20]
+"""
+    return campaigns, params
+
+
+def generate(root, scale=1.0, seed=0, artefacts=False):
+    """write all synthetic files and the configuration below root
+
+    Args:
+        root: output directory (existing files are replaced)
+        scale (float, optional): multiplies the number of profiles and files
+        seed (int, optional): seed of the random numbers
+        artefacts (bool, optional): ghost echoes and speckle in the LIMRAD94 spectra
+
+    Returns:
+        dict with ``config_dir``, ``campaign``, ``day``, the number of files and the size in bytes
+    """
+    root = os.path.abspath(root)
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    rng = np.random.default_rng(seed)
+    dirs = {k: os.path.join(root, k) for k in ['limrad94', 'mira', 'peaktree', 'hatpro', 'tree', 'larda-cfg', 'connectordump']}
+    for d in dirs.values():
+        os.makedirs(d)
+
+    files = []
+    for hour in [0, 1]:
+        files += write_limrad94(dirs['limrad94'], DAY + datetime.timedelta(hours=hour),
+                                max(int(120*scale), 4), rng, artefacts=artefacts)
+    for hour in [0, 6, 12, 18]:
+        files.append(write_mira(dirs['mira'], DAY + datetime.timedelta(hours=hour),
+                                max(int(720*scale), 4), rng))
+        files.append(write_peaktree(dirs['peaktree'], DAY + datetime.timedelta(hours=hour),
+                                    max(int(120*scale), 4), rng))
+    files.append(write_hatpro_lwp(dirs['hatpro'], DAY, max(int(8640*scale), 4), rng))
+    n_tree = write_tree(dirs['tree'], max(int(5000*scale), 24))
+
+    last_day = DAY + datetime.timedelta(days=int(np.ceil(max(int(5000*scale), 24)/24)))
+    campaigns, params = config(root, dirs['connectordump'], last_day)
+    with open(os.path.join(dirs['larda-cfg'], 'campaigns.toml'), 'w') as f:
+        f.write(campaigns)
+    with open(os.path.join(dirs['larda-cfg'], f'params_{CAMPAIGN}.toml'), 'w') as f:
+        f.write(params)
+    # the templates are looked up next to the params file first
+    template_dir = Path(__file__).resolve().parents[1] / 'pyLARDA' / 'template_params'
+    for template in template_dir.glob('*.toml'):
+        shutil.copy(template, dirs['larda-cfg'])
+
+    return {'config_dir': dirs['larda-cfg'], 'campaign': CAMPAIGN, 'day': DAY,
+            'n_files': len(files), 'n_tree_files': n_tree,
+            'nbytes': sum(os.path.getsize(f) for f in files)}
+
+
+def _var(ncD, name, dtype, dims, values, units, yrange=None):
+    var = ncD.createVariable(name, dtype, dims)
+    var[:] = values
+    var.Units = units
+    var.units = units
+    if yrange is not None:
+        var.yrange = yrange
+    return var
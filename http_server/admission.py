@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+"""
+Memory budget shared by all gunicorn workers.
+
+Each request reserves its estimated memory in a small json file (guarded by
+``fcntl.flock``) before reading. If the budget is exhausted, the request waits
+until other requests have finished or gives up after a timeout.
+Reservations of workers that died are dropped.
+
+"""
+
+import os
+import json
+import time
+import fcntl
+import threading
+import itertools
+import contextlib
+import logging
+
+import pyLARDA.helpers as h
+
+logger = logging.getLogger(__name__)
+
+
+def default_budget():
+    """half of the physical memory"""
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2
+
+
+class MemoryBudget:
+    """memory budget across processes
+
+    Args:
+        budget (int): bytes available for all concurrent requests
+        state_file: file holding the reservations
+        timeout (float, optional): seconds to wait for free memory
+    """
+    def __init__(self, budget, state_file, timeout=30):
+        self.budget = budget
+        self.state_file = state_file
+        self.timeout = timeout
+        self._counter = itertools.count()
+
+    @contextlib.contextmanager
+    def _locked_state(self):
+        with open(self.state_file, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                try:
+                    state = json.loads(content) if content else {}
+                except json.JSONDecodeError:
+                    # e.g. a worker killed while writing, the reservations are lost anyway
+                    logger.warning('unreadable memory budget state %s, starting empty', self.state_file)
+                    state = {}
+                # drop reservations of dead workers
+                state = {k: v for k, v in state.items() if h.pid_alive(int(k.split('-')[0]))}
+                yield state
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+                # written before the lock is released
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def in_use(self):
+        with self._locked_state() as state:
+            return sum(state.values())
+
+    def _try_reserve(self, key, nbytes):
+        with self._locked_state() as state:
+            used = sum(state.values())
+            # a single request is always admitted, otherwise it would never run
+            if used == 0 or used + nbytes <= self.budget:
+                state[key] = nbytes
+                return True
+        return False
+
+    def _release(self, key):
+        with self._locked_state() as state:
+            state.pop(key, None)
+
+    @contextlib.contextmanager
+    def reserve(self, nbytes):
+        """reserve memory for the duration of the with block
+
+        Yields:
+            True if the reservation was granted, False after the timeout
+        """
+        key = f"{os.getpid()}-{threading.get_ident()}-{next(self._counter)}"
+        waited = 0.
+        granted = self._try_reserve(key, nbytes)
+        while not granted and waited < self.timeout:
+            time.sleep(0.2)
+            waited += 0.2
+            granted = self._try_reserve(key, nbytes)
+        if waited > 0:
+            logger.info(f"waited {waited:.1f}s for {nbytes/1024**2:.0f}MB, granted {granted}")
+        try:
+            yield granted
+        finally:
+            if granted:
+                self._release(key)
@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+"""
+Asynchronous (ASGI) entry point for the larda backend.
+
+The routes are the same as in ``http_server.py``, the Flask views are called
+with a WSGI environ built from the ASGI scope. Data requests (reading files) run in
+a bounded pool of reader processes (netCDF4/HDF5 is not thread safe), the metadata
+and availability requests in a few threads of this process, so they stay fast while
+large reads are running, and a campaign that is (re)connected does not block the
+event loop.
+
+Run with e.g. ``uvicorn asgi_server:app --port 7979`` (``LARDA_ASGI_READERS`` sets the
+number of reader processes, default 4).
+
+"""
+
+import sys, os
+import io
+import asyncio
+import multiprocessing
+import concurrent.futures
+
+from werkzeug.exceptions import HTTPException
+
+import http_server
+
+flask_app = http_server.app
+
+# served by the threads of this process, all other endpoints go to the reader pool
+INLINE_ENDPOINTS = ['api_entry', 'get_campaign_info', 'get_descript', 'get_tile_info', 'get_metrics']
+
+# get_larda of the metadata requests may connect or reindex a campaign (stat/mmap on NFS)
+metadata_threads = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.environ.get('LARDA_ASGI_METADATA_THREADS', 4)))
+
+# forked, so that the readers inherit the preloaded campaigns
+readers = concurrent.futures.ProcessPoolExecutor(
+    max_workers=int(os.environ.get('LARDA_ASGI_READERS', 4)),
+    mp_context=multiprocessing.get_context('fork'))
+
+
+def build_environ(scope):
+    """WSGI environ of an ASGI http scope"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def call_wsgi(environ, body):
+    """run the flask app (in the event loop or in a reader process)
+
+    Args:
+        environ (dict): environ without the streams (to be picklable)
+        body (bytes): request body
+
+    Returns:
+        status, headers, body
+    """
+    environ = {**environ, 'wsgi.input': io.BytesIO(body), 'wsgi.errors': sys.stderr}
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    result = flask_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
+
+
+def endpoint_of(scope):
+    adapter = flask_app.url_map.bind('localhost')
+    try:
+        endpoint, _ = adapter.match(scope['path'], method=scope['method'])
+    except HTTPException:
+        # 404/405 are answered by flask right away
+        return None
+    return endpoint
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if os.environ.get('LARDA_PRELOAD', '0') == '1' and not http_server._larda_cache:
+                    # before the first reader is forked
+                    http_server.preload_campaigns()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                readers.shutdown(wait=False)
+                metadata_threads.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+    environ = build_environ(scope)
+    endpoint = endpoint_of(scope)
+    if endpoint is None:
+        status, headers, content = call_wsgi(environ, body)
+    elif endpoint in INLINE_ENDPOINTS:
+        status, headers, content = await asyncio.get_running_loop().run_in_executor(
+            metadata_threads, call_wsgi, environ, body)
+    else:
+        status, headers, content = await asyncio.get_running_loop().run_in_executor(
+            readers, call_wsgi, environ, body)
+
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers],
+    })
+    await send({'type': 'http.response.body', 'body': content})
@@ -4,3 +4,7 @@ accesslog = 'gunicorn_access.log'
 workers = 6
 keepalive = 15
 timeout = 600
+# import the app (and with LARDA_PRELOAD=1 the campaign indexes) once in the master,
+# the workers share the memory copy-on-write
+preload_app = True
+raw_env = ['LARDA_PRELOAD=1']
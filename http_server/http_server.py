@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
 import sys, os
+import threading
 # just needed to find pyLARDA from this location
 sys.path.append('../')
 
@@ -13,9 +14,14 @@ import msgpack #try the messagepack binary format
 
 import pyLARDA
 import pyLARDA.helpers as h
-from flask import Flask, jsonify, request, Response, send_file, redirect
+import pyLARDA.TilePyramid as TilePyramid
+import response_cache
+import admission
+import metrics
+import tempfile
+from flask import Flask, jsonify, request, Response, send_file, redirect, g
 from flask_cors import CORS
-#from flask_compress import Compress
+import pyLARDA.transfer as transfer
 import traceback
 
 import numpy as np
@@ -26,11 +32,44 @@ import logging.handlers
 app = Flask(__name__, static_url_path='', static_folder='public')
 CORS(app)
 
-#COMPRESS_MIMETYPES = ['application/json']
-#COMPRESS_LEVEL = 18
-#Compress(app)
+try:
+    # the msgpack responses are compressed per array (see pyLARDA.transfer)
+    from flask_compress import Compress
+    app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/plain']
+    Compress(app)
+except ImportError:
+    pass
 
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
+# response cache per worker, the spill directory is shared between the workers
+app.config['RESPONSE_CACHE_MB'] = int(os.environ.get('LARDA_RESPONSE_CACHE_MB', 256))
+app.config['RESPONSE_CACHE_DIR'] = os.environ.get('LARDA_RESPONSE_CACHE_DIR', None)
+app.config['RESPONSE_CACHE_DISK_MB'] = int(os.environ.get('LARDA_RESPONSE_CACHE_DISK_MB', 2048))
+
+# requests estimated larger than this are rejected (or averaged in time if the client asks for decimate=auto)
+app.config['MAX_REQUEST_MB'] = int(os.environ.get('LARDA_MAX_REQUEST_MB', 4096))
+# 'reject' or 'decimate'
+app.config['OVERSIZE_REQUESTS'] = os.environ.get('LARDA_OVERSIZE_REQUESTS', 'reject')
+# memory for all concurrent requests of all workers
+app.config['MEMORY_BUDGET_MB'] = int(os.environ.get('LARDA_MEMORY_BUDGET_MB', admission.default_budget()//1024**2))
+app.config['ADMISSION_TIMEOUT'] = float(os.environ.get('LARDA_ADMISSION_TIMEOUT', 30))
+# memory reserved per estimated byte, for the conversion of the response (python lists are much larger)
+app.config['JSON_MEMORY_FACTOR'] = float(os.environ.get('LARDA_JSON_MEMORY_FACTOR', 6))
+app.config['CODEC_MEMORY_FACTOR'] = float(os.environ.get('LARDA_CODEC_MEMORY_FACTOR', 2))
+
+memory_budget = admission.MemoryBudget(
+    app.config['MEMORY_BUDGET_MB']*1024**2,
+    os.environ.get('LARDA_ADMISSION_FILE', os.path.join(tempfile.gettempdir(), 'larda_admission.json')),
+    timeout=app.config['ADMISSION_TIMEOUT'])
+
+resp_cache = response_cache.ResponseCache(
+    app.config['RESPONSE_CACHE_MB']*1024**2,
+    spill_dir=app.config['RESPONSE_CACHE_DIR'],
+    max_spill_bytes=app.config['RESPONSE_CACHE_DISK_MB']*1024**2)
+
+# per worker dumps, merged at /metrics
+request_metrics = metrics.Metrics(
+    os.environ.get('LARDA_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'larda_metrics')))
 
 app.logger.setLevel(logging.DEBUG)
 log_larda = logging.getLogger('pyLARDA')
@@ -67,6 +106,106 @@ else:
     log_larda.addHandler(fh)
 
 
+_larda_cache = {}
+_larda_locks = {}
+_larda_locks_lock = threading.Lock()
+
+def connectordump_stamp(larda, campaign_name):
+    """modification times of the connector jsons of a campaign (updated by ListCollector)"""
+    campdir = os.path.join(larda.camp.info_dict['connectordump'], campaign_name)
+    try:
+        return sorted((e.name, e.stat().st_mtime) for e in os.scandir(campdir) if e.name.endswith('.json'))
+    except OSError:
+        return None
+
+
+def get_larda(campaign_name):
+    """larda connected to the campaign, shared between requests
+
+    The filelists are loaded as memory-mapped index and reloaded when the connector
+    jsons change. With ``preload_app`` in gunicorn, :py:func:`preload_campaigns` fills the
+    cache in the master, the workers then share it copy-on-write.
+    """
+    if campaign_name in _larda_cache:
+        larda, stamp = _larda_cache[campaign_name]
+        if connectordump_stamp(larda, campaign_name) == stamp:
+            return larda
+    # threads of the ASGI server: connect each campaign only once, without blocking the others
+    with _larda_locks_lock:
+        lock = _larda_locks.setdefault(campaign_name, threading.Lock())
+    with lock:
+        if campaign_name in _larda_cache:
+            larda, stamp = _larda_cache[campaign_name]
+            if connectordump_stamp(larda, campaign_name) == stamp:
+                return larda
+            app.logger.info("connectordump of {} changed, reconnecting".format(campaign_name))
+        larda = pyLARDA.LARDA().connect(campaign_name, build_lists=False, mmap_index=True)
+        _larda_cache[campaign_name] = (larda, connectordump_stamp(larda, campaign_name))
+    return larda
+
+
+_tile_dir_cache = {}
+
+def get_tile_dir(campaign_name):
+    """tile directory of a campaign, resolved once from the campaigns.toml"""
+    if campaign_name not in _tile_dir_cache:
+        larda = pyLARDA.LARDA()
+        larda.camp.assign_campaign(campaign_name)
+        _tile_dir_cache[campaign_name] = TilePyramid.get_tile_dir(larda.camp.info_dict, campaign_name)
+    return _tile_dir_cache[campaign_name]
+
+
+def unknown_tile_request(campaign_name, system, param):
+    """404 response if the campaign, system or parameter of a ``/tiles`` url is not configured, otherwise None
+
+    The names are part of the path of the tile files, so only configured ones are accepted.
+    """
+    if campaign_name not in _larda_cache and campaign_name not in pyLARDA.LARDA().campaign_list:
+        return Response(json.dumps(f"unknown campaign {campaign_name}"), status=404, mimetype='application/json')
+    larda = get_larda(campaign_name)
+    if system not in larda.connectors or param not in larda.connectors[system].system_info['params']:
+        return Response(json.dumps(f"unknown parameter {system} {param}"), status=404, mimetype='application/json')
+    return None
+
+
+def preload_campaigns():
+    """connect all campaigns once (called in the gunicorn master with preload_app)"""
+    starttime = time.time()
+    for campaign_name in pyLARDA.LARDA().campaign_list:
+        try:
+            get_larda(campaign_name)
+        except Exception as e:
+            app.logger.warning("preloading {} failed: {}".format(campaign_name, e))
+    app.logger.info("{:5.3f}s preloaded {} campaigns".format(time.time() - starttime, len(_larda_cache)))
+
+
+if os.environ.get('LARDA_PRELOAD', '0') == '1':
+    preload_campaigns()
+
+# compile (or load from the numba cache) the spectra kernels before forking the workers
+if os.environ.get('LARDA_WARMUP', '0') == '1':
+    import pyLARDA.compiled
+    pyLARDA.compiled.warmup()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(resp):
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    request_metrics.inc('larda_requests_total', route=route, status=str(resp.status_code))
+    if 'request_start' in g:
+        request_metrics.observe('larda_request_duration_seconds',
+                                time.perf_counter() - g.request_start, route=route)
+    if resp.content_length:
+        request_metrics.inc('larda_response_bytes_total', resp.content_length, route=route)
+    request_metrics.dump()
+    return resp
+
+
 @app.errorhandler(500)
 def page_not_found(error):
     exc_info = sys.exc_info()
@@ -92,6 +231,17 @@ def explorer(camp):
     return resp
     #return redirect('/larda3/data_avail')
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """request counts, latencies per route and stage, cache usage and worker memory
+
+    Returns:
+        Prometheus text format
+    """
+    request_metrics.set_gauge('larda_response_cache_bytes', resp_cache.stats()['bytes'])
+    return Response(request_metrics.render(), status=200, mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/api/', methods=['GET'])
 def api_entry():
     """
@@ -100,7 +250,9 @@ def api_entry():
         campaign list
     """
     larda = pyLARDA.LARDA()
-    return jsonify(campaign_list=larda.campaign_list)
+    resp = jsonify(campaign_list=larda.campaign_list)
+    resp.add_etag()
+    return resp.make_conditional(request)
 
 
 @app.route('/api/<campaign_name>/', methods=['GET'])
@@ -113,7 +265,7 @@ def get_campaign_info(campaign_name):
     campaign_info = {}
     app.logger.info("got request get_campaign_info {} ".format(campaign_name))
     starttime = time.time()
-    larda=pyLARDA.LARDA().connect(campaign_name, build_lists=False)
+    larda = get_larda(campaign_name)
     app.logger.debug("{:5.3f}s load larda".format(time.time() - starttime))
 
     starttime = time.time()
@@ -121,18 +273,52 @@ def get_campaign_info(campaign_name):
     #print("Parameters in stock: ",[(k, larda.connectors[k].params_list) for k in larda.connectors.keys()])
     campaign_info['info_text'] = larda.camp.INFO_TEXT
     
-    campaign_info['connectors'] = {system:conn.get_as_plain_dict() for system, conn in larda.connectors.items()}
+    # since=<timestamp> only returns the days that changed, summary=1 adds first/last timestamp per day
+    since = float(request.args['since']) if 'since' in request.args else None
+    summary = request.args.get('summary', '0') in ['1', 'true']
+    campaign_info['connectors'] = {system:conn.get_as_plain_dict(since=since, summary=summary)
+                                   for system, conn in larda.connectors.items()}
     app.logger.debug("{:5.3f}s assemble response".format(time.time() - starttime))
 
-    return jsonify(**campaign_info)
+    resp = jsonify(**campaign_info)
+    # allows clients with a cache to revalidate
+    resp.add_etag()
+    return resp.make_conditional(request)
 
 
 @app.route('/api/<campaign_name>/<system>/<param>', methods=['GET'])
 def get_param(campaign_name, system, param):
     """ """
     app.logger.info("got request get_param {} {} {}".format(campaign_name, system, param))
+    return read_response(campaign_name, system, [param])
+
+
+@app.route('/api/<campaign_name>/<system>', methods=['GET'])
+def get_params(campaign_name, system):
+    """several parameters of one system in one response ``?params=a,b,c&interval=...``
+
+    Returns:
+        ``{param: data_container, ...}``
+    """
+    app.logger.info("got request get_params {} {} {}".format(campaign_name, system, request.args.get('params')))
+    if not request.args.get('params'):
+        return Response(json.dumps("params=<param1>,<param2>,... required"), status=400, mimetype='application/json')
+    params = list(dict.fromkeys(request.args['params'].split(',')))
+    return read_response(campaign_name, system, params, batch=True)
+
+
+def read_response(campaign_name, system, params, batch=False):
+    """plan, read (or take from the cache) and serialize a data request
+
+    Args:
+        campaign_name (str): campaign
+        system (str): system
+        params (list): parameters
+        batch (bool, optional): respond with a dict of containers instead of a single container
+    """
     starttime = time.time()
-    larda=pyLARDA.LARDA().connect(campaign_name, build_lists=False)
+    with request_metrics.stage('connect'):
+        larda = get_larda(campaign_name)
     app.logger.debug("{:5.3f}s load larda".format(time.time() - starttime))
 
     if "rformat" in request.args and request.args['rformat'] == 'bin':
@@ -141,28 +327,157 @@ def get_param(campaign_name, system, param):
         rformat = 'msgpack'
     else:
         rformat = 'json'
+    # binary arrays only for msgpack and if the client sent the codecs it supports
+    codec = transfer.negotiate(request.args.get('codecs')) if rformat == 'msgpack' else None
+    precision = request.args.get('precision', None)
+    if precision is not None and precision not in transfer.PRECISIONS:
+        return Response(json.dumps(f"precision has to be one of {transfer.PRECISIONS}"),
+                        status=400, mimetype='application/json')
     intervals = request.args.get('interval').split(',') 
     time_interval = [h.ts_to_dt(float(t)) for t in intervals[0].split('-')]
     further_slices = [[float(e) if e not in ['max'] else e for e in s.split('-')] for s in intervals[1:]]
     
     app.logger.warning('request.args {}'.format(dict(request.args)))
     app.logger.info("time request {}".format(time_interval))
+
+    key = response_cache.normalize_request(campaign_name, system, ','.join(params), args=dict(request.args))
+    try:
+        files = []
+        for param in params:
+            files += [f for f in larda.connectors[system].get_filelist(param, time_interval) if f not in files]
+        etag, last_modified = response_cache.fingerprint(files, key=key)
+    except (AssertionError, KeyError, OSError):
+        # no files, let larda.read raise the proper error
+        etag, last_modified = None, None
+    if etag is not None:
+        resp = conditional_response(Response(), etag, last_modified)
+        if resp.status_code == 304:
+            app.logger.debug("not modified {}".format(etag))
+            request_metrics.inc('larda_response_cache_total', result='not_modified')
+            return resp
+        cached = resp_cache.get(key, etag)
+        if cached is not None:
+            app.logger.debug("cache hit {} {}".format(key, resp_cache.stats()))
+            request_metrics.inc('larda_response_cache_total', result='hit')
+            return conditional_response(Response(cached[0], status=200, mimetype=cached[1]), etag, last_modified)
+        request_metrics.inc('larda_response_cache_total', result='miss')
+
+    read_args = {k: v for k, v in request.args.items() if k not in ['codecs', 'precision', 'decimate', 'params']}
+    if 'interp_rg_join' in read_args:
+        read_args['interp_rg_join'] = read_args['interp_rg_join'] in ['1', 'true', 'True']
+
+    # plan the request before reading anything
+    estimate = {'nbytes': 0, 'n_ts': None}
+    with request_metrics.stage('plan'):
+        for param in params:
+            try:
+                e = larda.connectors[system].estimate_size(param, time_interval)
+            except (AssertionError, KeyError):
+                # no files, let larda.read raise the proper error
+                continue
+            estimate = {'nbytes': estimate['nbytes'] + e['nbytes'],
+                        'n_ts': max(estimate['n_ts'] or 0, e['n_ts'] or 0) or None}
+    app.logger.info("estimated size {:.1f}MB {}".format(estimate['nbytes']/1024**2, estimate))
+    max_bytes = app.config['MAX_REQUEST_MB']*1024**2
+    bin_width = None
+    if estimate['nbytes'] > max_bytes:
+        decimate = request.args.get('decimate', 'auto' if app.config['OVERSIZE_REQUESTS'] == 'decimate' else None)
+        if decimate == 'auto' and estimate['n_ts'] and len(time_interval) == 2:
+            n_target = max(int(estimate['n_ts'] * max_bytes / estimate['nbytes']), 1)
+            bin_width = int(np.ceil((time_interval[1] - time_interval[0]).total_seconds() / n_target))
+            app.logger.info("request too large, averaging to {}s".format(bin_width))
+        else:
+            return Response(json.dumps({
+                'error': 'request too large',
+                'estimated_mb': round(estimate['nbytes']/1024**2), 'max_request_mb': app.config['MAX_REQUEST_MB'],
+                'hint': 'use a shorter interval, a range slice or decimate=auto (time-height parameters only)'}),
+                status=413, mimetype='application/json')
+
+    # the conversion for the response needs additional memory (python lists are much larger)
+    factor = app.config['CODEC_MEMORY_FACTOR'] if codec is not None else app.config['JSON_MEMORY_FACTOR']
+    reserve = int(min(estimate['nbytes'], max_bytes) * factor)
+    if reserve > memory_budget.budget:
+        # would never be admitted next to other requests and exceed the budget on its own
+        return Response(json.dumps({
+            'error': 'request exceeds the memory budget',
+            'reserve_mb': round(reserve/1024**2), 'memory_budget_mb': round(memory_budget.budget/1024**2),
+            'hint': 'use a shorter interval, a range slice, decimate=auto or a binary codec'}),
+            status=413, mimetype='application/json')
+    admission_start = time.perf_counter()
+    with memory_budget.reserve(reserve) as granted:
+        request_metrics.observe('larda_stage_duration_seconds', time.perf_counter() - admission_start,
+                                stage='admission')
+        if not granted:
+            resp = Response(json.dumps({'error': 'server busy, memory budget exhausted'}),
+                            status=503, mimetype='application/json')
+            resp.headers['Retry-After'] = '10'
+            return resp
+        resp = param_response(larda, system, params, time_interval, further_slices, read_args,
+                              rformat, codec, precision, bin_width=bin_width, batch=batch)
+
+    if etag is not None:
+        resp_cache.put(key, etag, resp.get_data(), resp.mimetype)
+        resp = conditional_response(resp, etag, last_modified)
+    #for some reason the manual response is faster...
+    #return jsonify(data_container)
+    return resp
+
+
+def param_response(larda, system, params, time_interval, further_slices, read_args,
+                   rformat, codec, precision, bin_width=None, batch=False):
+    """read the data and serialize it into the response
+
+    Args:
+        bin_width (optional): average time-height data file by file to this resolution
+        batch (bool, optional): respond with ``{param: data_container}``
+    """
     starttime = time.time()
-    data_container = larda.read(system, param, time_interval, *further_slices, **dict(request.args))
+    with request_metrics.stage('read'):
+        if bin_width is not None:
+            containers = {param: larda.connectors[system].collect_averaged(
+                              param, time_interval, *further_slices, bin_width=bin_width)
+                          for param in params}
+        elif batch:
+            containers = larda.read_many(system, params, time_interval, *further_slices, **read_args)
+        else:
+            containers = {params[0]: larda.read(system, params[0], time_interval, *further_slices, **read_args)}
     app.logger.debug("{:5.3f}s read data".format(time.time() - starttime))
     starttime = time.time()
+    with request_metrics.stage('convert'):
+        for data_container in containers.values():
+            prepare_container(data_container, codec, precision)
+    app.logger.debug("{:5.3f}s convert data".format(time.time() - starttime))
+
+    starttime = time.time()
+    payload = containers if batch else containers[params[0]]
+    with request_metrics.stage('serialise'):
+        if rformat == 'msgpack':
+            resp = Response(msgpack.packb(payload), status=200, mimetype='application/msgpack')
+            if codec is not None:
+                resp.headers['X-Larda-Codec'] = codec
+        elif rformat == 'json':
+            resp = Response(json.dumps(payload), status=200, mimetype='application/json')
+    app.logger.debug("{:5.3f}s dumps {} {}".format(time.time() - starttime, rformat, codec))
+
+    return resp
+
+
+def prepare_container(data_container, codec, precision):
+    """make a data container serializable (lists or encoded arrays), in place"""
     #for k in data_container.keys():
     #    app.logger.warning(f'{k} {type(data_container[k])}')
-    for k in ['ts', 'rg', 'vel', 'var', 'mask', 'vel_ch2', 'vel_ch3', 'aux']:
+    for k in ['ts', 'rg', 'vel', 'var', 'mask', 'vel_ch2', 'vel_ch3', 'aux', 'count']:
         if k in data_container and hasattr(data_container[k], 'tolist'):
             if data_container[k].dtype is not np.dtype('object'):
                 data_container[k][~np.isfinite(data_container[k])] = 0
-            data_container[k] = data_container[k].tolist()
+            if codec is None or data_container[k].dtype.kind not in 'biuf':
+                data_container[k] = data_container[k].tolist()
+    if codec is not None:
+        transfer.encode_container(data_container, codec, precision=precision)
         #if k in data_container:
         #    app.logger.warning(f'{k} {type(data_container[k])}')
     #for k in data_container.keys():
     #    app.logger.warning(f'{k} {type(data_container[k])}')
-    app.logger.debug("{:5.3f}s convert data".format(time.time() - starttime))
 
     #import io
     #test_datacont = {**data_container}
@@ -177,29 +492,29 @@ def get_param(campaign_name, system, param):
     #        test_datacont[k] = memfile.read().decode('latin-1')
     #resp = Response(json.dumps(test_datacont), status=200, mimetype='application/json')
 
-    starttime = time.time()
     #if rformat == 'bin':
     #    resp = Response(cbor.dumps(data_container), status=200, mimetype='application/cbor')
     if type(data_container['filename']) is list:
         data_container['filename'] = [str(f) for f in data_container['filename']]
     else:
         data_container['filename'] = str(data_container['filename'])
-    if rformat == 'msgpack':
-        resp = Response(msgpack.packb(data_container), status=200, mimetype='application/msgpack')
-    elif rformat == 'json':
-        resp = Response(json.dumps(data_container), status=200, mimetype='application/json')
-    app.logger.debug("{:5.3f}s dumps {}".format(time.time() - starttime, rformat))
+    return data_container
 
-    #for some reason the manual response is faster...
-    #return jsonify(data_container)
-    return resp
+
+def conditional_response(resp, etag, last_modified):
+    """add ETag/Last-Modified and turn into 304 if the client already has the current version"""
+    resp.set_etag(etag)
+    resp.last_modified = datetime.datetime.fromtimestamp(last_modified, tz=datetime.timezone.utc)
+    # clients have to revalidate, as new files might show up any time
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
 
 @app.route('/description/<campaign_name>/<system>/<parameter>', methods=['GET'])
 def get_descript(campaign_name, system, parameter):
     """ """
     app.logger.info("got request fori description {} {} {}".format(campaign_name, system, parameter))
 
-    larda=pyLARDA.LARDA().connect(campaign_name, build_lists=False)
+    larda = get_larda(campaign_name)
 
     #if "rformat" in request.args and request.args['rformat'] == 'bin':
     #    rformat = 'bin'
@@ -221,6 +536,51 @@ def get_descript(campaign_name, system, parameter):
 
     return resp
 
+@app.route('/tiles/<campaign_name>/<system>/<param>/', methods=['GET'])
+def get_tile_info(campaign_name, system, param):
+    """
+
+    Returns:
+        json object with levels and available tiles of the pyramid
+    """
+    app.logger.info("got request get_tile_info {} {} {}".format(campaign_name, system, param))
+    unknown = unknown_tile_request(campaign_name, system, param)
+    if unknown is not None:
+        return unknown
+    tile_dir = get_tile_dir(campaign_name)
+    info = TilePyramid.pyramid_info(tile_dir, system, param)
+    if not info:
+        return Response(json.dumps(f"no tiles for {system} {param}"), status=404, mimetype='application/json')
+    return jsonify(**info)
+
+
+@app.route('/tiles/<campaign_name>/<system>/<param>/<int:res>/<int(signed=True):idx>', methods=['GET'])
+def get_tile(campaign_name, system, param, res, idx):
+    """single precomputed tile, the time span is given by ``/tiles/<campaign_name>/<system>/<param>/``"""
+    app.logger.info("got request get_tile {} {} {} {} {}".format(campaign_name, system, param, res, idx))
+    rformat = 'msgpack' if request.args.get('rformat') == 'msgpack' else 'json'
+    unknown = unknown_tile_request(campaign_name, system, param)
+    if unknown is not None:
+        return unknown
+    tile_dir = get_tile_dir(campaign_name)
+    starttime = time.time()
+    data_container = TilePyramid.load_tile(tile_dir, system, param, res, idx)
+    if data_container is None:
+        return Response(json.dumps(f"no tile {res} {idx} for {system} {param}"), status=404, mimetype='application/json')
+    app.logger.debug("{:5.3f}s load tile".format(time.time() - starttime))
+
+    # same as /api: non-finite values are set to 0 (flagged by mask), NaN is no valid json
+    prepare_container(data_container, None, None)
+    data_container['filename'] = str(data_container['filename'])
+    if rformat == 'msgpack':
+        resp = Response(msgpack.packb(data_container), status=200, mimetype='application/msgpack')
+    else:
+        resp = Response(json.dumps(data_container), status=200, mimetype='application/json')
+    # tiles are only replaced when the pyramid is rebuilt
+    resp.headers['Cache-Control'] = 'public, max-age=300'
+    return resp
+
+
 @app.route('/peakTree')
 def peakTree():
     return app.send_static_file('peakTreeVis.html')
@@ -0,0 +1,220 @@
+#!/usr/bin/python3
+"""
+Request metrics of the backend in the Prometheus text format.
+
+Every process (gunicorn worker, ASGI reader) counts in memory and dumps its state
+to ``<metrics_dir>/<pid>.json`` (at most once per ``dump_interval``, a skipped write
+follows at the end of the interval). ``/metrics``
+merges the dumps of all living processes, so no external collector is needed.
+Counters of a restarted worker start again at zero, which Prometheus' ``rate()``
+handles as a counter reset.
+
+"""
+
+import os
+import json
+import time
+import resource
+import threading
+import contextlib
+import logging
+
+import pyLARDA.helpers as h
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+HELP = {
+    'larda_requests_total': ('counter', 'requests by route and status'),
+    'larda_request_duration_seconds': ('histogram', 'request latency by route'),
+    'larda_stage_duration_seconds': ('histogram', 'time spent per stage of the data requests'),
+    'larda_response_bytes_total': ('counter', 'response bytes by route (before transport compression)'),
+    'larda_response_cache_total': ('counter', 'response cache lookups by result'),
+    'larda_response_cache_bytes': ('gauge', 'bytes held in the in-memory response cache'),
+    'larda_worker_rss_bytes': ('gauge', 'resident memory of the worker'),
+    'larda_worker_max_rss_bytes': ('gauge', 'peak resident memory of the worker'),
+}
+
+
+def rss_bytes():
+    """current and peak resident memory of this process"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        rss = max_rss
+    return rss, max_rss
+
+
+class Metrics:
+    """counters, gauges and histograms of one process
+
+    Args:
+        metrics_dir: directory of the per process dumps (shared by the workers)
+        dump_interval (float, optional): minimum seconds between two dumps
+    """
+    def __init__(self, metrics_dir, dump_interval=1.):
+        self.metrics_dir = metrics_dir
+        self.dump_interval = dump_interval
+        os.makedirs(metrics_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._last_dump = 0.
+        # pending dump of a write skipped by the rate limit (threads do not survive a fork)
+        self._timer = None
+
+    def _check_fork(self):
+        # a forked worker must not report the counts of its parent
+        if os.getpid() != self.pid:
+            self._reset()
+
+    def inc(self, name, value=1, **labels):
+        """increase a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_fork()
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """set a gauge of this process"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_fork()
+            self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        """add a value to a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_fork()
+            if key not in self.histograms:
+                self.histograms[key] = {'buckets': [0]*len(LATENCY_BUCKETS), 'sum': 0., 'count': 0}
+            hist = self.histograms[key]
+            for i, le in enumerate(LATENCY_BUCKETS):
+                if value <= le:
+                    hist['buckets'][i] += 1
+                    break
+            hist['sum'] += value
+            hist['count'] += 1
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """time the with block as stage of a request"""
+        starttime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('larda_stage_duration_seconds', time.perf_counter() - starttime, stage=name)
+
+    def dump(self, force=False):
+        """write the state of this process
+
+        Rate limited unless forced, a skipped write is made up by a timer at the end of
+        the interval, so the last counts of a worker that goes idle are not lost.
+        """
+        now = time.time()
+        with self._lock:
+            self._check_fork()
+        if not force and now - self._last_dump < self.dump_interval:
+            with self._lock:
+                if self._timer is None:
+                    self._timer = threading.Timer(self._last_dump + self.dump_interval - now, self._delayed_dump)
+                    self._timer.daemon = True
+                    self._timer.start()
+            return
+        rss, max_rss = rss_bytes()
+        self.set_gauge('larda_worker_rss_bytes', rss)
+        self.set_gauge('larda_worker_max_rss_bytes', max_rss)
+        with self._lock:
+            self._last_dump = now
+            state = {
+                'counters': [[n, dict(l), v] for (n, l), v in self.counters.items()],
+                'gauges': [[n, dict(l), v] for (n, l), v in self.gauges.items()],
+                'histograms': [[n, dict(l), v] for (n, l), v in self.histograms.items()],
+            }
+        filename = os.path.join(self.metrics_dir, f'{self.pid}.json')
+        try:
+            with open(filename + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(filename + '.tmp', filename)
+        except OSError as e:
+            logger.warning(f'could not write metrics {filename}: {e}')
+
+    def _delayed_dump(self):
+        with self._lock:
+            self._timer = None
+        if os.getpid() == self.pid:
+            self.dump(force=True)
+
+    def collect(self):
+        """merge the dumps of all living processes
+
+        Returns:
+            counters, gauges (labelled with the pid), histograms
+        """
+        counters, gauges, histograms = {}, {}, {}
+        for entry in os.scandir(self.metrics_dir):
+            if not entry.name.endswith('.json'):
+                continue
+            pid = int(entry.name.split('.')[0])
+            if not h.pid_alive(pid):
+                with contextlib.suppress(OSError):
+                    os.remove(entry.path)
+                continue
+            try:
+                with open(entry.path) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for n, l, v in state['counters']:
+                key = (n, tuple(sorted(l.items())))
+                counters[key] = counters.get(key, 0) + v
+            for n, l, v in state['gauges']:
+                gauges[(n, tuple(sorted({**l, 'pid': str(pid)}.items())))] = v
+            for n, l, v in state['histograms']:
+                key = (n, tuple(sorted(l.items())))
+                if key not in histograms:
+                    histograms[key] = {'buckets': [0]*len(LATENCY_BUCKETS), 'sum': 0., 'count': 0}
+                histograms[key]['buckets'] = [a + b for a, b in zip(histograms[key]['buckets'], v['buckets'])]
+                histograms[key]['sum'] += v['sum']
+                histograms[key]['count'] += v['count']
+        return counters, gauges, histograms
+
+    def render(self):
+        """all processes in the Prometheus text exposition format"""
+        self.dump(force=True)
+        counters, gauges, histograms = self.collect()
+        lines = []
+        for name in sorted(set([k[0] for k in list(counters) + list(gauges) + list(histograms)])):
+            mtype, text = HELP.get(name, ('untyped', ''))
+            lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {mtype}')
+            for (n, labels), v in sorted({**counters, **gauges}.items()):
+                if n == name:
+                    lines.append(f'{name}{_format_labels(labels)} {v}')
+            for (n, labels), hist in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for le, c in zip(LATENCY_BUCKETS, hist['buckets']):
+                    cumulative += c
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", str(le)),))} {cumulative}')
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {hist["count"]}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {hist["sum"]}')
+                lines.append(f'{name}_count{_format_labels(labels)} {hist["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+"""
+Response cache for the larda backend.
+
+Responses are kept in memory (least recently used are evicted first) and
+optionally spilled to a directory, which is then shared between the gunicorn workers.
+An entry is only valid as long as the fingerprint (path, mtime, size of the
+underlying files) is unchanged.
+
+"""
+
+import os
+import json
+import hashlib
+import threading
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_request(*path, args=None):
+    """stable key of a request
+
+    Args:
+        *path: e.g. campaign, system, param
+        args (dict, optional): request arguments, the order does not matter
+
+    Returns:
+        hex digest
+    """
+    args = {} if args is None else args
+    key = json.dumps([list(path), sorted(args.items())])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def fingerprint(files, key=''):
+    """stat the files a response is built from
+
+    Args:
+        files: list of paths
+        key (str, optional): request key, so that different requests on the same files differ
+
+    Returns:
+        (etag, last_modified) with last_modified as unix timestamp
+    """
+    stats = []
+    for f in files:
+        st = os.stat(f)
+        stats.append((str(f), st.st_mtime, st.st_size))
+    last_modified = max([s[1] for s in stats]) if stats else 0
+    return hashlib.sha1(json.dumps([key, stats]).encode('utf-8')).hexdigest(), last_modified
+
+
+class ResponseCache:
+    """in-memory LRU cache of response bodies with optional disk spill
+
+    Args:
+        max_bytes (int): size limit of the in-memory part
+        spill_dir (str, optional): directory for entries evicted from memory
+        max_spill_bytes (int, optional): size limit of the spill directory
+        max_entry_bytes (int, optional): larger responses are not cached, default max_bytes/4
+    """
+    def __init__(self, max_bytes, spill_dir=None, max_spill_bytes=0, max_entry_bytes=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 4
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    def get(self, key, etag):
+        """cached (body, mimetype) if the etag still matches, else None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry['etag'] == etag:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry['body'], entry['mimetype']
+                self._drop(key)
+
+        # the spill directory is read outside of the lock
+        entry = self._load_spilled(key, etag)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self.put(key, etag, *entry)
+        return entry
+
+    def put(self, key, etag, body, mimetype):
+        if len(body) > self.max_entry_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = {'etag': etag, 'body': body, 'mimetype': mimetype}
+            self.nbytes += len(body)
+            evicted = []
+            while self.nbytes > self.max_bytes:
+                k, entry = self.entries.popitem(last=False)
+                self.nbytes -= len(entry['body'])
+                evicted.append((k, entry))
+        for k, entry in evicted:
+            self._spill(k, entry)
+
+    def _drop(self, key):
+        entry = self.entries.pop(key)
+        self.nbytes -= len(entry['body'])
+
+    def _spill_files(self, key):
+        base = os.path.join(self.spill_dir, key)
+        return base + '.body', base + '.json'
+
+    def _spill(self, key, entry):
+        if not self.spill_dir or len(entry['body']) > self.max_spill_bytes:
+            return
+        fbody, fmeta = self._spill_files(key)
+        try:
+            # write to tmp files first, another worker might read at the same time
+            with open(fbody + '.tmp', 'wb') as f:
+                f.write(entry['body'])
+            with open(fmeta + '.tmp', 'w') as f:
+                json.dump({'etag': entry['etag'], 'mimetype': entry['mimetype']}, f)
+            os.replace(fbody + '.tmp', fbody)
+            os.replace(fmeta + '.tmp', fmeta)
+        except OSError as e:
+            logger.warning(f'could not spill response cache entry {key}: {e}')
+            return
+        self._trim_spill_dir()
+
+    def _load_spilled(self, key, etag):
+        if not self.spill_dir:
+            return None
+        fbody, fmeta = self._spill_files(key)
+        try:
+            with open(fmeta) as f:
+                meta = json.load(f)
+            if meta['etag'] != etag:
+                return None
+            with open(fbody, 'rb') as f:
+                body = f.read()
+            os.utime(fbody)
+        except (OSError, ValueError):
+            return None
+        return body, meta['mimetype']
+
+    def _trim_spill_dir(self):
+        """remove the least recently used spilled entries above max_spill_bytes"""
+        files = []
+        for entry in os.scandir(self.spill_dir):
+            if entry.name.endswith('.body'):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, entry.path))
+        total = sum([f[1] for f in files])
+        for mtime, size, path in sorted(files):
+            if total <= self.max_spill_bytes:
+                break
+            for fname in [path, path[:-len('.body')] + '.json']:
+                try:
+                    os.remove(fname)
+                except OSError:
+                    pass
+            total -= size
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.nbytes,
+                    'hits': self.hits, 'misses': self.misses}
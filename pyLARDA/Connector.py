@@ -8,30 +8,33 @@ import datetime
 import calendar
 import pprint
 import functools
+import concurrent.futures
 import pprint as pprint2
 from pathlib import Path
 
 from typing import Callable
 
-import pyLARDA.NcReader as NcReader
-import pyLARDA.RPGReader as RPGReader
 import pyLARDA.ParameterInfo as ParameterInfo
 #import pyLARDA.DataBuffer as DataBuffer
 #import pyLARDA.MeteoReader as MeteoReader
 #import pyLARDA.Spec as Spec
-import pyLARDA.peakTree as peakTree
-import pyLARDA.trace_reader as trace_reader
 import pyLARDA.helpers as h
-import pyLARDA.Transformations as Transf
+Transf = h.lazy_import('pyLARDA.Transformations')
+import pyLARDA.remote_cache as remote_cache
+import pyLARDA.transfer as transfer
+import pyLARDA.FileIndex as FileIndex
+import pyLARDA.instrumentation as instrumentation
 
 import numpy as np
 from operator import itemgetter
 import collections
 import json
-import requests, msgpack
-from tqdm import tqdm
+import msgpack
 #import cbor2
 
+# only needed for remote data
+requests = h.lazy_import('requests')
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -81,40 +84,57 @@ def convert_to_datestring(datepattern, f):
 def setupreader(paraminfo) -> Callable:
     """obtain the reader from the paraminfo
 
+    the reader modules are imported on first use of their ``ncreader``
     """
 
     if paraminfo["ncreader"] == 'timeheight_limrad94':
+        import pyLARDA.NcReader as NcReader
         reader = NcReader.timeheightreader_rpgfmcw(paraminfo)
     elif paraminfo["ncreader"] in ['spec_rpg94binary', 'timeheight_rpg94binary', 'time_rpg94binary']:
+        import pyLARDA.RPGReader as RPGReader
         reader = RPGReader.rpgfmcw_binary(paraminfo)
     elif paraminfo["ncreader"] in ['time_hatprobinary', 'timeheight_hatprobinary']:
+        import pyLARDA.RPGReader as RPGReader
         reader = RPGReader.hatpro_binary(paraminfo)
     elif paraminfo["ncreader"] == 'spec_limrad94':
+        import pyLARDA.NcReader as NcReader
         reader = NcReader.specreader_rpgfmcw(paraminfo)
     elif paraminfo["ncreader"] == 'spec_rpgpy':
+        import pyLARDA.NcReader as NcReader
         reader = NcReader.specreader_rpgpy(paraminfo)
     elif paraminfo["ncreader"] == 'spec_kazr':
+        import pyLARDA.NcReader as NcReader
         reader = NcReader.specreader_kazr(paraminfo)
     elif paraminfo["ncreader"] in ['aux', 'aux_all_ts', 'aux_ts_slice']:
+        import pyLARDA.NcReader as NcReader
         reader = NcReader.auxreader(paraminfo)
     elif paraminfo["ncreader"] in ['scan_timeheight', 'scan_time']:
+        import pyLARDA.NcReader as NcReader
         reader = NcReader.scanreader_mira(paraminfo) 
     elif paraminfo['ncreader'] == 'peakTree':
+        import pyLARDA.peakTree as peakTree
         reader = peakTree.peakTree_reader(paraminfo)
     elif paraminfo['ncreader'] == 'trace':
+        import pyLARDA.trace_reader as trace_reader
         reader = trace_reader.trace_reader(paraminfo)
     elif paraminfo['ncreader'] == 'trace2':
+        import pyLARDA.trace_reader as trace_reader
         reader = trace_reader.trace_reader2(paraminfo)
     elif paraminfo["ncreader"] == 'pollyraw':
+        import pyLARDA.NcReader as NcReader
         reader = NcReader.reader_pollyraw(paraminfo)
     elif paraminfo["ncreader"] == 'mrrpro_spec':
+        import pyLARDA.NcReader as NcReader
         paraminfo.update({"ncreader": "spec", "compute_velbins":"mrrpro"})
         reader = NcReader.reader(paraminfo)
     elif paraminfo["ncreader"] == "wyoming_sounding_txt":
+        import pyLARDA.NcReader as NcReader
         reader = NcReader.reader_wyoming_sounding(paraminfo)
     elif paraminfo["ncreader"] == 'psd':
+        import pyLARDA.NcReader as NcReader
         reader = NcReader.psd_reader(paraminfo)
     else:
+        import pyLARDA.NcReader as NcReader
         reader = NcReader.reader(paraminfo)
 
     return reader
@@ -209,43 +229,179 @@ class Connector_remote:
         system (str): system identifier
         plain_dict (dict): connector meta info
         uri (str): address of the remote source
+        session (requests.Session, optional): shared session (connection pool)
+        cache (RemoteCache, optional): local disk cache, see :py:mod:`pyLARDA.remote_cache`
     """
-    def __init__(self, camp_name, system, plain_dict, uri):
+    def __init__(self, camp_name, system, plain_dict, uri, session=None, cache=None):
         self.camp_name = camp_name
         self.system = system
         self.params_list = list(plain_dict['params'].keys())
         print(self.system, self.params_list)
         self.plain_dict = plain_dict
         self.uri = uri
+        self.session = session if session is not None else requests.Session()
+        self.cache = cache
+
+    def split_interval(self, param, time_interval, n_chunks) -> list:
+        """split a time interval into at most n_chunks sub-intervals at day boundaries
+
+        Only days with files (``avail`` in the plain_dict) are considered, so that
+        every sub-interval contains data.
+
+        Args:
+            param (str) identifying the parameter
+            time_interval: list of begin and end datetime
+            n_chunks (int): maximum number of sub-intervals
+
+        Returns:
+            list of time intervals
+        """
+        if len(time_interval) < 2 or n_chunks < 2:
+            return [time_interval]
+        begin, end = time_interval
+        which_path = self.plain_dict['params'][param]
+        days = sorted([datetime.datetime.strptime(d, '%Y%m%d') for d in self.plain_dict['avail'][which_path].keys()])
+        # the day of the begin is always part of the first chunk
+        days = [d for d in days if begin < d < end]
+        if len(days) == 0:
+            return [time_interval]
+        n_chunks = min(n_chunks, len(days) + 1)
+        # first day with data of each chunk (after the first one)
+        splits = [days[int(round(i*len(days)/(n_chunks-1)))] for i in range(n_chunks-1)]
+        splits = sorted(set(splits))
+        bounds = [begin] + splits + [end]
+        return [[b, e] for b, e in zip(bounds[:-1], bounds[1:])]
 
     def collect(self, param, time_interval, *further_intervals, **kwargs) -> dict:
         """collect the data from a parameter for the given intervals
 
+        Longer time intervals are split at day boundaries and fetched concurrently.
+
         Args:
             param (str) identifying the parameter
             time_interval: list of begin and end datetime
             *further_intervals: range, velocity, ...
             **interp_rg_join: interpolate range during join
+            **n_parallel (int): maximum number of concurrent requests, default 4
+            **precision (str): lossy transfer of the variable, ``'float16'`` or ``'int16'``
 
         Returns:
             data_container
         """
+        n_parallel = kwargs.pop('n_parallel') if 'n_parallel' in kwargs else 4
+        intervals = self.split_interval(param, time_interval, n_parallel)
+        if len(intervals) == 1:
+            return self.fetch(param, time_interval, *further_intervals, **kwargs)
+
+        logger.info("fetching {} in {} parallel requests".format(param, len(intervals)))
+        from tqdm import tqdm
+        pbar = tqdm(unit="B", unit_divisor=1024, unit_scale=True)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(intervals)) as executor:
+            futures = [executor.submit(instrumentation.in_context(self.fetch), param, interval,
+                                       *further_intervals, pbar=pbar, **kwargs)
+                       for interval in intervals]
+            datalist = [f.result() for f in futures]
+        pbar.close()
+
+        # the profile at a chunk boundary might be delivered twice
+        for i in range(1, len(datalist)):
+            ts = np.atleast_1d(datalist[i]['ts'])
+            overlap = np.searchsorted(ts, np.atleast_1d(datalist[i-1]['ts'])[-1], side='right')
+            if overlap == ts.shape[0]:
+                datalist[i] = None
+            elif overlap > 0:
+                datalist[i] = Transf.slice_container(datalist[i], index={'time': [overlap, ts.shape[0]]})
+        datalist = [d for d in datalist if d is not None]
+        return functools.reduce(Transf.join, datalist)
+
+    def collect_many(self, params, time_interval, *further_intervals, **kwargs) -> dict:
+        """collect several parameters of the system with one request
+
+        Falls back to one :py:meth:`collect` per parameter for backends
+        without the batch endpoint.
+
+        Args:
+            params (list): parameters
+            time_interval: list of begin and end datetime
+            *further_intervals: range, velocity, ...
+            **precision (str): lossy transfer of the variable, ``'float16'`` or ``'int16'``
+
+        Returns:
+            dict ``{param: data_container}``
+        """
+        kwargs.pop('n_parallel', None)
+        try:
+            return self.fetch(params, time_interval, *further_intervals, **kwargs)
+        except ConnectionError as e:
+            if '404' not in str(e):
+                raise
+            logger.warning("backend without batch endpoint, fetching the parameters one by one")
+            return {param: self.collect(param, time_interval, *further_intervals, **kwargs) for param in params}
+
+    def fetch(self, param, time_interval, *further_intervals, pbar=None, **kwargs) -> dict:
+        """fetch the data of a parameter with a single request
+
+        Args:
+            param (str) identifying the parameter, or a list of parameters for the batch endpoint
+            time_interval: list of begin and end datetime
+            *further_intervals: range, velocity, ...
+            pbar (optional): shared tqdm progress bar
+
+        Returns:
+            data_container (``{param: data_container}`` for a list of parameters)
+        """
         resp_format = 'msgpack'
         interval = ["-".join([str(h.dt_to_ts(dt)) for dt in time_interval])]
         interval += ["-".join([str(i) for i in pair]) for pair in further_intervals]
         stream = True if resp_format == "msgpack" else False
-        params = {"interval": ','.join(interval), 'rformat': resp_format}
+        params = {"interval": ','.join(interval), 'rformat': resp_format,
+                  'codecs': ','.join(transfer.available_codecs())}
         params.update(kwargs)
-        resp = requests.get(self.uri + '/api/{}/{}/{}'.format(self.camp_name, self.system, param),
-                            params=params, stream=stream)
+        batch = isinstance(param, (list, tuple))
+        if batch:
+            params['params'] = ','.join(param)
+            url = self.uri + '/api/{}/{}'.format(self.camp_name, self.system)
+        else:
+            url = self.uri + '/api/{}/{}/{}'.format(self.camp_name, self.system, param)
+
+        headers = {}
+        entry = None
+        if self.cache is not None:
+            key = remote_cache.make_key(url, **params)
+            entry = self.cache.get(key)
+            if entry is not None and entry[2]:
+                logger.info("loaded {} {} from cache".format(self.system, param))
+                return entry[0]
+            if entry is not None and entry[1]:
+                headers['If-None-Match'] = entry[1]
+        try:
+            with instrumentation.span('request'):
+                resp = self.session.get(url, params=params, stream=stream, headers=headers)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            # offline: any cached entry is better than nothing, with or without ETag
+            if entry is None:
+                raise
+            logger.warning("backend not reachable ({}), using cached {} {}".format(e, self.system, param))
+            return entry[0]
         logger.debug("fetching data from: {}".format(resp.url))
+        if resp.status_code == 304 and headers:
+            logger.info("cached {} {} still valid".format(self.system, param))
+            self.cache.revalidated(key)
+            return entry[0]
         if resp_format == "msgpack":
             block_size = 1024
-            pbar = tqdm(unit="B", total=(int(resp.headers.get('content-length', 0))//block_size)*block_size, unit_divisor=1024, unit_scale=True)
+            own_pbar = pbar is None
+            if own_pbar:
+                from tqdm import tqdm
+                pbar = tqdm(unit="B", total=(int(resp.headers.get('content-length', 0))//block_size)*block_size, unit_divisor=1024, unit_scale=True)
             content = bytearray()
-            for data in resp.iter_content(block_size):
-                content.extend(data)
-                pbar.update(len(data))
+            with instrumentation.span('download') as download_span:
+                for data in resp.iter_content(block_size):
+                    content.extend(data)
+                    pbar.update(len(data))
+                download_span.add_bytes(len(content))
+            if own_pbar:
+                pbar.close()
         
         if resp.status_code != 200:
             if resp_format == "msgpack":
@@ -255,31 +411,34 @@ class Connector_remote:
                 print(resp.json())
             raise ConnectionError("bad status code of response {}".format(resp.status_code))
 
-        starttime = time.time()
         # if resp_format == 'bin':
         #     data_container = cbor2.loads(resp.content)
-        if resp_format == 'msgpack':
-            logger.info("msgpack version {}".format(msgpack.version))
-            if msgpack.version[0] < 1:
-                data_container = msgpack.loads(content, encoding='utf-8')
-            else:
-                data_container = msgpack.loads(content, strict_map_key=False)
-        elif resp_format == 'json':
-            data_container = resp.json()
-
-        #print("{:5.3f}s decode data".format(time.time() - starttime))
-        starttime = time.time()
-        for k in ['ts', 'rg', 'vel', 'var', 'mask', 'vel_ch2', 'vel_ch3', 'aux']:
-            if k in data_container and type(data_container[k]) == list:
-                data_container[k] = np.array(data_container[k])
+        with instrumentation.span('decode'):
+            if resp_format == 'msgpack':
+                logger.info("msgpack version {}".format(msgpack.version))
+                if msgpack.version[0] < 1:
+                    data_container = msgpack.loads(content, encoding='utf-8')
+                else:
+                    data_container = msgpack.loads(content, strict_map_key=False)
+            elif resp_format == 'json':
+                data_container = resp.json()
+
+        with instrumentation.span('convert'):
+            # arrays are binary encoded by newer backends, lists by older ones
+            for container in (data_container.values() if batch else [data_container]):
+                transfer.decode_container(container)
+                for k in ['ts', 'rg', 'vel', 'var', 'mask', 'vel_ch2', 'vel_ch3', 'aux', 'count']:
+                    if k in container and type(container[k]) == list:
+                        container[k] = np.array(container[k])
         logger.info("loaded data container from remote: {}".format(data_container.keys()))
-        #print("{:5.3f}s converted to np arrays".format(time.time() - starttime))
+        if self.cache is not None and resp.headers.get('ETag'):
+            self.cache.put(key, resp.headers['ETag'], data_container)
         return data_container
 
 
     def description(self, param):
         """get the description str"""
-        resp = requests.get(self.uri + '/description/{}/{}/{}'.format(self.camp_name, self.system, param))
+        resp = self.session.get(self.uri + '/description/{}/{}/{}'.format(self.camp_name, self.system, param))
         if resp.status_code != 200:
             raise ConnectionError("bad status code of response {}".format(resp.status_code))
 
@@ -293,6 +452,39 @@ class Connector_remote:
         return self.plain_dict
 
 
+def availability_summary(filehandler, previous=None, updated=None) -> dict:
+    """number of files, first and last timestamp per day of a filehandler
+
+    Args:
+        filehandler: dict (or :py:class:`pyLARDA.FileIndex.FileIndex`) of file lists
+        previous (dict, optional): older summary, days without change keep their timestamp
+        updated (float, optional): timestamp for new or changed days, default now
+
+    Returns:
+        dict ``{fileidentifier: {'YYYYMMDD': {'n': .., 'first': .., 'last': .., 'updated': ..}}}``
+    """
+    updated = time.time() if updated is None else updated
+    previous = {} if previous is None else previous
+    summary = {}
+    for key, flist in filehandler.items():
+        days = {}
+        for (f_b, f_e), _ in flist:
+            day = f_b[:8]
+            if day not in days:
+                days[day] = {'n': 0, 'first': f_b, 'last': f_e}
+            days[day]['n'] += 1
+            days[day]['first'] = min(days[day]['first'], f_b)
+            days[day]['last'] = max(days[day]['last'], f_e)
+        for day, v in days.items():
+            old = previous.get(key, {}).get(day)
+            if old is not None and all([old[k] == v[k] for k in ['n', 'first', 'last']]):
+                v['updated'] = old['updated']
+            else:
+                v['updated'] = updated
+        summary[key] = days
+    return summary
+
+
 def walk_str(pathinfo):
     """match the names and subdirs with regex using string
 
@@ -381,6 +573,7 @@ class Connector:
         self.valid_dates = valid_dates
         self.params_list = list(system_info["params"].keys())
         self.description_dir = description_dir
+        self.avail = None
         logger.info("params in this connector {} {}".format(self.system, self.params_list))
         logger.debug('connector.system_info {}'.format(system_info))
 
@@ -438,36 +631,67 @@ class Connector:
                 json.dump(self.filehandler, outfile, **pretty)
                 logger.info('saved connector to {}/{}/{}'.format(path,camp_name,savename))
 
-    def load_filehandler(self, path, camp_name):
-        """load the filehandler from the json file"""
+        # availability summary, days that changed since the last build get a new timestamp
+        availname = path+'/'+camp_name+'/connector_{}_avail.json'.format(self.system)
+        previous = None
+        if os.path.isfile(availname):
+            with open(availname) as f:
+                previous = json.load(f)['avail']
+        self.avail = availability_summary(self.filehandler, previous=previous)
+        with open(availname, 'w') as outfile:
+            json.dump({'source': FileIndex.source_stamp(path+'/'+camp_name+'/'+savename),
+                       'avail': self.avail}, outfile)
+
+    def load_filehandler(self, path, camp_name, mmap_index=False):
+        """load the filehandler from the json file
+
+        Args:
+            path: connectordump
+            camp_name: campaign name
+            mmap_index (bool, optional): use the compact memory-mapped :py:class:`pyLARDA.FileIndex.FileIndex`
+                (built next to the json, if outdated)
+        """
         filename = "connector_{}.json".format(self.system)
         starttime = time.time()
-        with open(path+'/'+camp_name+'/'+filename) as json_data:
-                self.filehandler = json.load(json_data)
+        if mmap_index:
+            self.filehandler = FileIndex.load_or_build(
+                path+'/'+camp_name+'/'+filename, path+'/'+camp_name+'/index_{}'.format(self.system))
+        else:
+            with open(path+'/'+camp_name+'/'+filename) as json_data:
+                    self.filehandler = json.load(json_data)
         logger.info("read in json filehandler {}: {}".format(self.system, time.time() - starttime))
 
+        # the availability summary is only valid for the json it was built with
+        availname = path+'/'+camp_name+'/connector_{}_avail.json'.format(self.system)
+        self.avail = None
+        if os.path.isfile(availname):
+            with open(availname) as f:
+                avail = json.load(f)
+            if avail['source'] == FileIndex.source_stamp(path+'/'+camp_name+'/'+filename):
+                self.avail = avail['avail']
 
-    def collect(self, param, time_interval, *further_intervals, **kwargs) -> dict:
-        """collect the data from a parameter for the given intervals
+
+    def select_files(self, param, time_interval) -> list:
+        """filehandler entries of a parameter covering the time interval
 
         Args:
             param (str) identifying the parameter
-            time_interval: list of begin and end datetime
-            *further_intervals: range, velocity, ...
-            **interp_rg_join: interpolate range during join
+            time_interval: list of begin and end datetime (or only begin)
 
         Returns:
-            data_container
+            list of ``[[begin_str, end_str], relpath]``
         """
-        
         paraminfo = self.system_info["params"][param]
-        if 'interp_rg_join' not in paraminfo:
-            # default value
-            paraminfo['interp_rg_join'] = False
-        if 'interp_rg_join' in kwargs:
-            paraminfo['interp_rg_join'] = kwargs['interp_rg_join']
-        base_dir = self.system_info['path'][paraminfo['which_path']]["base_dir"]
-        logger.debug("paraminfo at collect {}".format(paraminfo))
+        if isinstance(self.filehandler, FileIndex.FileIndex):
+            files = self.filehandler[paraminfo['which_path']]
+            if len(time_interval) == 2:
+                idx = files.select(*[dt.strftime(DATEstrfmt) for dt in time_interval])
+                assert len(idx) > 0, "no files available"
+            elif len(time_interval) == 1:
+                idx = files.select(time_interval[0].strftime(DATEstrfmt))
+                assert len(idx) == 1, "flist too long or too short: {}".format(len(idx))
+            return [files[i] for i in idx]
+
         if len(time_interval) == 2:
             begin, end = [dt.strftime(DATEstrfmt) for dt in time_interval]
             # cover all three cases: 1. file only covers first part
@@ -484,9 +708,110 @@ class Connector:
             assert len(flist) == 1, "flist too long or too short: {}".format(len(flist))
 
         #[print(e, (e[0][0] <= begin and e[0][1] > begin), (e[0][0] > begin and e[0][1] < end), (e[0][0] <= end and e[0][1] >= end)) for e in flist]
+        return flist
+
+
+    def get_filelist(self, param, time_interval) -> list:
+        """files of a parameter covering the time interval
+
+        Args:
+            param (str) identifying the parameter
+            time_interval: list of begin and end datetime (or only begin)
+
+        Returns:
+            list of file paths
+        """
+        paraminfo = self.system_info["params"][param]
+        base_dir = self.system_info['path'][paraminfo['which_path']]["base_dir"]
+        return [Path(base_dir + e[1]) for e in self.select_files(param, time_interval)]
+
+
+    def estimate_size(self, param, time_interval) -> dict:
+        """estimate the size of the data container before reading
+
+        The shape of the variable is taken from the header of the first file (netCDF only,
+        otherwise the file size is used) and scaled by the fraction of the files
+        covered by the time interval. Slices in range/velocity are not considered,
+        so the estimate is an upper bound.
+
+        Args:
+            param (str) identifying the parameter
+            time_interval: list of begin and end datetime (or only begin)
+
+        Returns:
+            dict with ``nbytes``, ``n_files``, ``n_ts`` (None if unknown) and ``method``
+        """
+        paraminfo = self.system_info["params"][param]
+        base_dir = self.system_info['path'][paraminfo['which_path']]["base_dir"]
+        flist = self.select_files(param, time_interval)
+
+        sample = base_dir + flist[0][1]
+        n_ts_file = None
+        try:
+            import netCDF4
+            with netCDF4.Dataset(sample) as ncD:
+                var = ncD.variables[paraminfo['variable_name']]
+                # values are usually converted to float64, plus the mask
+                per_file = var.size * (max(var.dtype.itemsize, 8) + 1)
+                if 'time_variable' in paraminfo:
+                    n_ts_file = ncD.variables[paraminfo['time_variable']].shape[0]
+            method = 'header'
+        except (OSError, KeyError, AttributeError, TypeError):
+            per_file = os.path.getsize(sample)
+            method = 'filesize'
+
+        if len(time_interval) == 1:
+            fraction = 1. / n_ts_file if n_ts_file else 1.
+        else:
+            fraction = 0.
+            for (f_b, f_e), _ in flist:
+                f_b = datetime.datetime.strptime(f_b, DATEstrfmt)
+                f_e = datetime.datetime.strptime(f_e, DATEstrfmt)
+                overlap = (min(f_e, time_interval[1]) - max(f_b, time_interval[0])).total_seconds()
+                fraction += min(max(overlap, 0.) / max((f_e - f_b).total_seconds(), 1.), 1.)
+            # at least one profile per file
+            fraction = max(fraction, 1. / n_ts_file if n_ts_file else 0.)
+
+        return {'nbytes': int(per_file * fraction), 'n_files': len(flist),
+                'n_ts': int(n_ts_file * fraction) if n_ts_file else None, 'method': method}
+
+
+    def _request_paraminfo(self, param, **kwargs) -> dict:
+        """copy of the paraminfo with the options of this request, the shared config stays unchanged"""
+        paraminfo = dict(self.system_info["params"][param])
+        if 'interp_rg_join' not in paraminfo:
+            # default value
+            paraminfo['interp_rg_join'] = False
+        if 'interp_rg_join' in kwargs:
+            paraminfo['interp_rg_join'] = kwargs['interp_rg_join']
+        return paraminfo
+
+
+    def collect(self, param, time_interval, *further_intervals, **kwargs) -> dict:
+        """collect the data from a parameter for the given intervals
+
+        Args:
+            param (str) identifying the parameter
+            time_interval: list of begin and end datetime
+            *further_intervals: range, velocity, ...
+            **interp_rg_join: interpolate range during join
+
+        Returns:
+            data_container
+        """
+        
+        paraminfo = self._request_paraminfo(param, **kwargs)
+        logger.debug("paraminfo at collect {}".format(paraminfo))
+        with instrumentation.span('discover'):
+            flist = self.get_filelist(param, time_interval)
 
         load_data = setupreader(paraminfo)
-        datalist = [load_data(Path(base_dir + e[1]), time_interval, *further_intervals) for e in flist]
+        datalist = []
+        for f in flist:
+            with instrumentation.span('file') as s:
+                datalist.append(load_data(f, time_interval, *further_intervals))
+                if datalist[-1] is not None:
+                    s.add_bytes(h.container_nbytes(datalist[-1]))
         # [print(e.keys) if e != None else print("NONE!") for e in datalist]
         # reader returns none, if it detects no data prior to begin
         # now these none values are filtered from the list
@@ -499,6 +824,95 @@ class Connector:
 
 
 
+    def collect_many(self, params, time_interval, *further_intervals, **kwargs) -> dict:
+        """collect several parameters of the system in one pass over the files
+
+        Parameters sharing a ``which_path`` are read file by file, so each file
+        is only located once and read while it is in the page cache.
+
+        Args:
+            params (list): parameters
+            time_interval: list of begin and end datetime
+            *further_intervals: range, velocity, ...
+            **interp_rg_join: interpolate range during join
+
+        Returns:
+            dict ``{param: data_container}``
+        """
+        groups, paraminfos = {}, {}
+        for param in params:
+            paraminfos[param] = self._request_paraminfo(param, **kwargs)
+            groups.setdefault(paraminfos[param]['which_path'], []).append(param)
+
+        datalists = {param: [] for param in params}
+        for which_path, group in groups.items():
+            with instrumentation.span('discover'):
+                flist = self.get_filelist(group[0], time_interval)
+            readers = {param: setupreader(paraminfos[param]) for param in group}
+            for f in flist:
+                for param in group:
+                    with instrumentation.span('file'):
+                        datalists[param].append(readers[param](f, time_interval, *further_intervals))
+
+        data = {}
+        for param in params:
+            assert len(datalists[param]) > 0, 'No data found for parameter: {}'.format(param)
+            # reader returns none, if it detects no data prior to begin
+            datalist = list(filter(lambda x: x != None, datalists[param]))
+            data[param] = functools.reduce(Transf.join, datalist)
+        return data
+
+
+    def collect_averaged(self, param, time_interval, *further_intervals, bin_width=60, **kwargs) -> dict:
+        """collect a time-height parameter averaged in time, file by file
+
+        Only one file is held in memory at once, so this also works for intervals
+        that would not fit into memory at full resolution.
+
+        Args:
+            param (str) identifying the parameter
+            time_interval: list of begin and end datetime
+            *further_intervals: range, velocity, ...
+            bin_width (float): averaging interval in seconds
+
+        Returns:
+            data_container with the additional key ``count``
+        """
+        paraminfo = self._request_paraminfo(param)
+        t0 = h.dt_to_ts(time_interval[0])
+        n_bins = max(int(np.ceil((h.dt_to_ts(time_interval[1]) - t0) / bin_width)), 1)
+
+        load_data = setupreader(paraminfo)
+        data, sums, counts, filenames = None, None, None, []
+        for f in self.get_filelist(param, time_interval):
+            part = load_data(f, time_interval, *further_intervals)
+            if part is None:
+                continue
+            assert part['dimlabel'] == ['time', 'range'], \
+                f"averaging only for time-height parameters, not {part['dimlabel']}"
+            if data is None:
+                data = part
+            elif part['rg'].shape != data['rg'].shape or not np.allclose(part['rg'], data['rg']):
+                part = Transf.interpolate2d(part, new_range=data['rg'])
+            averaged = Transf.average_time(part, bin_width, t0=t0, n_bins=n_bins)
+            if sums is None:
+                sums, counts = averaged['var'] * averaged['count'], averaged['count']
+            else:
+                sums += averaged['var'] * averaged['count']
+                counts += averaged['count']
+            filenames.append(part['filename'])
+        assert data is not None, 'No data found for parameter: {}'.format(param)
+
+        data = {**data}
+        data['ts'] = t0 + (np.arange(n_bins) + 0.5) * bin_width
+        data['var'] = np.where(counts > 0, sums / np.maximum(counts, 1), 0.)
+        data['mask'] = counts == 0
+        data['count'] = counts
+        data['filename'] = filenames
+        data['joints'] = []
+        return data
+
+
     def collect_path(self, param, time_interval, *further_intervals, **kwargs) -> dict:
         """"
         
@@ -543,21 +957,51 @@ class Connector:
         logger.warning(descr)
         return descr        
 
-    def get_as_plain_dict(self) -> dict:
+    def get_as_plain_dict(self, since=None, summary=False) -> dict:
         """put the most important information of the connector into a plain dict (for http tranfer)
 
+        Args:
+            since (float, optional): only days with changes after this unix timestamp
+            summary (bool, optional): include first and last timestamp per day
+
         Returns:
             connector information
 
             .. code::
 
                 {params: {param_name: fileidentifier, ...},
-                avail: {fileidentifier: {"YYYYMMDD": no_files, ...}, ...}
+                avail: {fileidentifier: {"YYYYMMDD": no_files, ...}, ...},
+                updated: timestamp of the last change,
+                # only with summary
+                avail_summary: {fileidentifier: {"YYYYMMDD": [no_files, first, last], ...}, ...}}
         """
-        return {
+        avail = self.get_avail()
+        if since is not None:
+            avail = {k: {day: v for day, v in days.items() if v['updated'] > since}
+                     for k, days in avail.items()}
+        plain = {
             'params': {e: self.system_info['params'][e]['which_path'] for e in self.params_list},
-            'avail': {k: self.files_per_day(k) for k in self.filehandler.keys()}
+            'avail': {k: {day: v['n'] for day, v in days.items()} for k, days in avail.items()},
+            'updated': max([v['updated'] for days in self.get_avail().values() for v in days.values()], default=0),
         }
+        if summary:
+            plain['avail_summary'] = {k: {day: [v['n'], v['first'], v['last']] for day, v in days.items()}
+                                      for k, days in avail.items()}
+        return plain
+
+    def get_avail(self) -> dict:
+        """availability summary, precomputed when the filehandler was built
+
+        Returns:
+            dict
+
+            .. code::
+
+                {fileidentifier: {'YYYYMMDD': {'n': no_files, 'first': begin, 'last': end, 'updated': ts}, ...}, ...}
+        """
+        if self.avail is None:
+            self.avail = availability_summary(self.filehandler)
+        return self.avail
 
     def files_per_day(self, which_path) -> dict:
         """replaces ``days_available`` and ``day_available``
@@ -569,7 +1013,12 @@ class Connector:
 
                 {'YYYYMMDD': no of files, ...}
         """
+        if self.avail is not None and which_path in self.avail:
+            return {day: v['n'] for day, v in self.avail[which_path].items()}
         fh = self.filehandler[which_path]
+        if isinstance(fh, FileIndex.IndexedFiles):
+            days, counts = np.unique(fh.begin.astype('S8'), return_counts=True)
+            return {d.decode(): int(c) for d, c in zip(days, counts)}
         groupedby_day = collections.defaultdict(list)
         for d, f in fh:
             groupedby_day[d[0][:8]] += [f]
@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+"""
+Compact, read-only representation of the connector filehandler.
+
+The filehandler ``{which_path: [[[begin, end], relpath], ...]}`` is stored as
+plain numpy arrays (fixed width date strings and one byte buffer for the paths)
+in ``<connectordump>/<campaign>/index_<system>/``. The arrays are memory-mapped
+when loaded, so the gunicorn workers share the pages instead of each holding
+millions of small python objects.
+
+The index behaves like the dict of lists it replaces (``index[which_path][i]``,
+iteration, ``len``, ``keys()``), and additionally offers a vectorized file selection.
+
+"""
+
+import os
+import json
+import shutil
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DATE_DTYPE = 'S15'
+
+
+class IndexedFiles:
+    """files of one ``which_path``, sorted by begin
+
+    Args:
+        begin (np.ndarray): begin date strings ``'%Y%m%d-%H%M%S'`` as bytes
+        end (np.ndarray): end date strings
+        paths (np.ndarray): uint8 buffer of all relative paths
+        offsets (np.ndarray): start of each path in the buffer (length n+1)
+    """
+    def __init__(self, begin, end, paths, offsets):
+        self.begin = begin
+        self.end = end
+        self.paths = paths
+        self.offsets = offsets
+
+    def __len__(self):
+        return self.begin.shape[0]
+
+    def path(self, i):
+        return self.paths[self.offsets[i]:self.offsets[i+1]].tobytes().decode('utf-8')
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('file index out of range')
+        return [[self.begin[i].decode(), self.end[i].decode()], self.path(i)]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def select(self, begin, end=None):
+        """indices of the files covering the interval (same rules as the list based selection)
+
+        Args:
+            begin (str): begin as ``'%Y%m%d-%H%M%S'``
+            end (str, optional): end, if None only the file containing begin
+
+        Returns:
+            array of indices
+        """
+        b = begin.encode()
+        if end is None:
+            hi = np.searchsorted(self.begin, b, side='right')
+            return np.nonzero(b < self.end[:hi])[0]
+        e = end.encode()
+        # files beginning after the end can not match
+        hi = np.searchsorted(self.begin, e, side='right')
+        fb, fe = self.begin[:hi], self.end[:hi]
+        match = ((fb <= b) & (b < fe)) | ((fb > b) & (fe < e)) | ((fb <= e) & (e <= fe))
+        return np.nonzero(match)[0]
+
+
+class FileIndex:
+    """dict-like container of :py:class:`IndexedFiles` per ``which_path``"""
+    def __init__(self, entries):
+        self.entries = entries
+
+    def __getitem__(self, key):
+        return self.entries[key]
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self):
+        return self.entries.keys()
+
+    def items(self):
+        return self.entries.items()
+
+    def to_plain(self):
+        """back to the json structure"""
+        return {k: list(v) for k, v in self.entries.items()}
+
+    @classmethod
+    def from_filehandler(cls, filehandler):
+        """convert the dict of lists from the connector"""
+        entries = {}
+        for key, flist in filehandler.items():
+            flist = sorted(flist, key=lambda e: e[0][0])
+            begin = np.array([e[0][0] for e in flist], dtype=DATE_DTYPE)
+            end = np.array([e[0][1] for e in flist], dtype=DATE_DTYPE)
+            encoded = [e[1].encode('utf-8') for e in flist]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(p) for p in encoded])
+            paths = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+            entries[key] = IndexedFiles(begin, end, paths, offsets)
+        return cls(entries)
+
+    def save(self, index_dir, source_stamp=None):
+        """write the arrays (atomically replacing an older index)
+
+        Args:
+            index_dir: directory of the index
+            source_stamp (optional): identifies the json the index was built from
+        """
+        tmp_dir = index_dir + '.tmp{}'.format(os.getpid())
+        os.makedirs(tmp_dir, exist_ok=True)
+        keys = list(self.entries.keys())
+        for i, key in enumerate(keys):
+            for name in ['begin', 'end', 'paths', 'offsets']:
+                np.save(os.path.join(tmp_dir, f'{i}.{name}.npy'), getattr(self.entries[key], name))
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({'keys': keys, 'source': source_stamp}, f)
+        old_dir = index_dir + '.old{}'.format(os.getpid())
+        if os.path.isdir(index_dir):
+            os.rename(index_dir, old_dir)
+        os.rename(tmp_dir, index_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    @classmethod
+    def load(cls, index_dir, mmap_mode='r'):
+        """load the index, memory-mapped by default"""
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        entries = {}
+        for i, key in enumerate(meta['keys']):
+            arrays = [np.load(os.path.join(index_dir, f'{i}.{name}.npy'), mmap_mode=mmap_mode)
+                      for name in ['begin', 'end', 'paths', 'offsets']]
+            entries[key] = IndexedFiles(*arrays)
+        return cls(entries)
+
+
+def source_stamp(json_file):
+    """modification time and size of the connector json"""
+    st = os.stat(json_file)
+    return [st.st_mtime, st.st_size]
+
+
+def load_or_build(json_file, index_dir):
+    """memory-mapped index of a connector json, rebuilt if the json changed
+
+    Args:
+        json_file: ``connector_<system>.json``
+        index_dir: directory of the index
+
+    Returns:
+        FileIndex
+    """
+    stamp = source_stamp(json_file)
+    try:
+        with open(os.path.join(index_dir, 'meta.json')) as f:
+            if json.load(f)['source'] == stamp:
+                return FileIndex.load(index_dir)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    with open(json_file) as f:
+        index = FileIndex.from_filehandler(json.load(f))
+    try:
+        index.save(index_dir, source_stamp=stamp)
+        return FileIndex.load(index_dir)
+    except OSError as e:
+        logger.warning(f'could not save file index {index_dir}: {e}')
+        return index
@@ -9,10 +9,12 @@ Try to use netcdf4-python
 import numpy as np
 import netCDF4
 import pyLARDA.helpers as h
+import pyLARDA.instrumentation as instrumentation
 from typing import List
 import logging
 import datetime
-import scipy
+
+scipy = h.lazy_import('scipy', 'scipy.interpolate')
 
 logger = logging.getLogger(__name__)
 
@@ -137,7 +139,9 @@ def reader(paraminfo):
         """function that converts the netCDF to the larda-data-format
         """
         logger.debug("filename at reader {}".format(f))
-        with netCDF4.Dataset(f, 'r') as ncD:
+        with instrumentation.span('open'):
+            ncD = netCDF4.Dataset(f, 'r')
+        with ncD:
 
             if 'auto_mask_scale' in paraminfo and paraminfo['auto_mask_scale'] == False:
                 ncD.set_auto_mask(False)
@@ -305,30 +309,35 @@ def reader(paraminfo):
                                    npw[slicer[0], np.newaxis] * (data['rg'][np.newaxis, :] / 5000.) ** 2
                 data['var'] = calibrated_noise
             else:
-                data['var'] = varconverter(var[:])[tuple(slicer)]
+                with instrumentation.span('variable') as s:
+                    raw = var[:]
+                    s.add_bytes(raw.nbytes)
+                with instrumentation.span('convert'):
+                    data['var'] = varconverter(raw)[tuple(slicer)]
 
                 #if paraminfo['compute_velbins'] == "mrrpro":
                 #    data['var'] = data['var'] * wl** 4 / (np.pi** 5) / 0.93 * 10**6
 
-            if "identifier_fill_value" in paraminfo.keys() and not "fill_value" in paraminfo.keys():
-                fill_value = var.getncattr(paraminfo['identifier_fill_value'])
-                mask = np.isclose(data['var'].data, fill_value)
-            elif "fill_value" in paraminfo.keys():
-                fill_value = paraminfo['fill_value']
-                mask = np.isclose(data['var'].data, fill_value)
-            else:
-                mask = ~np.isfinite(data['var'].data)
-            
-            #if isinstance(mask, np.ma.MaskedArray):
-            #    mask = mask.mask
-            assert not isinstance(mask, np.ma.MaskedArray), \
-               "mask array shall not be np.ma.MaskedArray, but of plain booltype"
-            data['mask'] = np.logical_or(mask, data['var'].mask)
+            with instrumentation.span('mask'):
+                if "identifier_fill_value" in paraminfo.keys() and not "fill_value" in paraminfo.keys():
+                    fill_value = var.getncattr(paraminfo['identifier_fill_value'])
+                    mask = np.isclose(data['var'].data, fill_value)
+                elif "fill_value" in paraminfo.keys():
+                    fill_value = paraminfo['fill_value']
+                    mask = np.isclose(data['var'].data, fill_value)
+                else:
+                    mask = ~np.isfinite(data['var'].data)
 
-            if isinstance(data['var'], np.ma.MaskedArray):
-                data['var'] = data['var'].data
-            assert not isinstance(data['var'], np.ma.MaskedArray), \
-               "var array shall not be np.ma.MaskedArray, but of plain booltype"
+                #if isinstance(mask, np.ma.MaskedArray):
+                #    mask = mask.mask
+                assert not isinstance(mask, np.ma.MaskedArray), \
+                   "mask array shall not be np.ma.MaskedArray, but of plain booltype"
+                data['mask'] = np.logical_or(mask, data['var'].mask)
+
+                if isinstance(data['var'], np.ma.MaskedArray):
+                    data['var'] = data['var'].data
+                assert not isinstance(data['var'], np.ma.MaskedArray), \
+                   "var array shall not be np.ma.MaskedArray, but of plain booltype"
 
             if paraminfo['ncreader'] == "pollynet_profile":
                 data['var'] = data['var'][np.newaxis, :]
@@ -688,28 +697,29 @@ def specreader_rpgfmcw(paraminfo):
                 raise NotImplemented("other means of getting the var dimension are not implemented yet")
             data['vel'] = vel_per_chirp[0]
 
-            # interpolate the variables here
+            # interpolate the variables here, only the selected time steps are read from the file
+            it_slicer, slicer = slicer[0], [slice(None)] + slicer[1:]
             if 'var_conversion' in paraminfo and paraminfo['var_conversion'] == 'keepNyquist':
                 # the interpolation is only done for the number of spectral lines, not the velocity itself
                 quot = [i/vel_dim_per_chirp[0] for i in vel_dim_per_chirp[1:]]
-                vars_interp = [vars_per_chirp[0]]
+                vars_interp = [vars_per_chirp[0][it_slicer]]
                 ich = 1
                 for var, vel in zip(vars_per_chirp[1:], vel_per_chirp[1:]):
                     data['vel_ch{}'.format(ich+1)] = vel_per_chirp[ich]
                     new_vel = np.linspace(vel[0], vel[-1], vel_dim_per_chirp[0])
-                    vars_interp.append(interp_only_3rd_dim(var[:] * quot[ich-1], vel, new_vel, kind='nearest'))
+                    vars_interp.append(interp_only_3rd_dim(var[it_slicer] * quot[ich-1], vel, new_vel, kind='nearest'))
                     ich += 1
             else:
-                vars_interp = [vars_per_chirp[0]] + \
-                              [interp_only_3rd_dim(var, vel, vel_per_chirp[0]) \
+                vars_interp = [vars_per_chirp[0][it_slicer]] + \
+                              [interp_only_3rd_dim(var[it_slicer], vel, vel_per_chirp[0]) \
                                for var, vel in zip(vars_per_chirp[1:], vel_per_chirp[1:])]
 
 
             var = np.hstack([v[:] for v in vars_interp])
             logger.debug('interpolated spectra from\n{}\n{} to\n{}'.format(
-                [v[:].shape for v in vars_per_chirp],
+                [v.shape for v in vars_per_chirp],
                 ['{:5.3f}'.format(vel[0]) for vel in vel_per_chirp],
-                [v[:].shape for v in vars_interp]))
+                [v.shape for v in vars_interp]))
             logger.info('var.shape interpolated spectra {}'.format(var.shape))
 
             if "identifier_fill_value" in paraminfo.keys() and not "fill_value" in paraminfo.keys():
@@ -1050,7 +1060,7 @@ def specreader_kazr(paraminfo):
         with netCDF4.Dataset(f, 'r') as ncD:
             ranges = ncD.variables[paraminfo['range_variable']]
             times = ncD.variables[paraminfo['time_variable']][:].astype(np.float64)
-            locator_mask = ncD.variables[paraminfo['mask_var']][:].astype(np.int)
+            locator_mask = ncD.variables[paraminfo['mask_var']][:].astype(int)
             if 'time_millisec_variable' in paraminfo.keys() and \
                     paraminfo['time_millisec_variable'] in ncD.variables:
                 subsec = ncD.variables[paraminfo['time_millisec_variable']][:] / 1.0e3
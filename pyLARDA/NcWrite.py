@@ -1,12 +1,15 @@
+import os
 import datetime
 from datetime import timezone
 import netCDF4
 import numpy as np
 import pyLARDA.helpers as h
 import time
-import git
 import xarray as xr
 
+# only needed for the commit ID of the exported files
+git = h.lazy_import('git')
+
 # resolution of python version is master
 class CalibratedSpectraXR(xr.Dataset):
 
@@ -89,6 +92,49 @@ def write_simple_nc(fname, data_cont):
 
 
 
+def append_simple_nc(fname, data_conts, create=False):
+    """append timeheight containers of the next time steps to a simple netcdf file
+
+    Same layout as :py:func:`write_simple_nc` with one variable per container, the file
+    is created with the first call and grows along the unlimited time axis.
+
+    Args:
+        fname: filename
+        data_conts: list of data_containers with the same ``ts`` and ``rg``
+        create (bool, optional): start a new file, an existing one is overwritten
+    """
+    first = data_conts[0]
+    mode = 'w' if create or not os.path.isfile(fname) else 'a'
+    with netCDF4.Dataset(fname, mode=mode, format='NETCDF4_CLASSIC') as ncfile:
+        if mode == 'w':
+            ncfile.createDimension('time', None)
+            ncfile.createDimension('range', len(first['rg']))
+
+            unix = ncfile.createVariable('unix', np.float64, ('time',))
+            unix.units = 'timestamp'
+            unix.long_name = 'unix_timestamp'
+
+            rg = ncfile.createVariable('range', np.float32, ('range',))
+            rg.units = 'm'
+            rg.long_name = 'range'
+            rg[:] = first['rg']
+
+            for data_cont in data_conts:
+                var_str = f"{data_cont['system']}_{data_cont['name']}"
+                v = ncfile.createVariable(var_str, np.float32, ('time', 'range'), fill_value=-999)
+                v.units = data_cont['var_unit']
+                v.var_lims = data_cont['var_lims']
+                v.long_name = f"{data_cont['system']} {data_cont['name']}"
+
+        it_b = len(ncfile.dimensions['time'])
+        it_e = it_b + len(first['ts'])
+        ncfile['unix'][it_b:it_e] = first['ts']
+        for data_cont in data_conts:
+            var = np.array(data_cont['var'], dtype=np.float32)
+            var[data_cont['mask']] = -999
+            ncfile[f"{data_cont['system']}_{data_cont['name']}"][it_b:it_e, :] = var
+
+
 def export_spectra2nc(data, larda_git_path='', system='', path='', **kwargs):
     """
     This routine generates an hourly NetCDF4 file for the RPG 94 GHz FMCW radar 'LIMRAD94'.
@@ -916,12 +962,12 @@ def rpg_radar2nc_old(data, path, **kwargs):
         nc_add_variable(ds, val=data['MaxVel']['var'][0], dimension=('chirp',),
                         var_name='DoppMax', type=np.float32, long_name='Unambiguous Doppler velocity (+/-)', unit='m/s')
 
-        range_offsets = np.ones(no_chirps, dtype=np.int)
+        range_offsets = np.ones(no_chirps, dtype=int)
         for iC in range(no_chirps - 1):
             range_offsets[iC + 1] = range_offsets[iC] + data['C' + str(iC + 1) + 'Range']['var'][0].shape
 
         nc_add_variable(ds, val=range_offsets, dimension=('chirp',),
-                        var_name='range_offsets', type=np.int,
+                        var_name='range_offsets', type=int,
                         long_name='chirp sequences start index array in altitude layer array', unit='[-]')
 
     print('save calibrated to :: ', ds_name)
@@ -3,7 +3,7 @@
 import toml
 import numpy as np
 import pprint
-import collections
+import collections.abc
 import logging
 import re
 logger = logging.getLogger(__name__)
@@ -14,7 +14,7 @@ def deep_update(source, overrides):
     Only additions, no removal modify ``source`` in place.
     """
     for key, value in overrides.items():
-        if isinstance(value, collections.Mapping) and value:
+        if isinstance(value, collections.abc.Mapping) and value:
             returned = deep_update(source.get(key, {}), value)
             source[key] = returned
         else:
@@ -24,8 +24,6 @@ import pandas as pd
 import sys
 import time
 from itertools import product
-from numba import jit
-from tqdm.auto import tqdm
 import matplotlib.pyplot as plt
 from scipy.interpolate import CubicSpline
 from scipy.signal import correlate
@@ -36,9 +34,18 @@ warnings.simplefilter("ignore", UserWarning)
 sys.path.append('../../larda/')
 
 from pyLARDA.helpers import z2lin, argnearest, lin2z, ts_to_dt, dt_to_ts
+import pyLARDA.instrumentation as instrumentation
+import pyLARDA.compiled as compiled
+from pyLARDA.spec2mom_limrad94 import estimate_noise_hs74_cube, despeckle
 
 logger = logging.getLogger(__name__)
 
+# peak memory of iter_moments_rpgfmcw94 in multiples of the (float32) spectra of a chunk
+CHUNK_MEMORY_FACTOR = 8
+CHUNK_MEMORY_FACTOR_DEALIASING = 18
+# spectral lines per block of time steps in spectra2polarimetry
+POLARIMETRY_BLOCK_SIZE = 2**22
+
 
 def replace_fill_value(data, newfill):
     """
@@ -70,7 +77,7 @@ def get_chirp_from_range(rg_offsets, i_rg):
         if i_rg <= ioff: return i
 
 
-@jit(nopython=True, fastmath=True)
+@compiled.jit(fastmath=True, warmup=lambda: [(s, 1.0, 6.0) for s in compiled.example_spectra()])
 def estimate_noise_hs74(spectrum, navg=1, std_div=6.0, nnoise_min=1):
     """REFERENCE TO ARM PYART GITHUB REPO: https://github.com/ARM-DOE/pyart/blob/master/pyart/util/hildebrand_sekhon.py
 
@@ -133,7 +140,8 @@ def estimate_noise_hs74(spectrum, navg=1, std_div=6.0, nnoise_min=1):
     return mean, threshold, var, nnoise
 
 
-@jit(nopython=True, fastmath=True)
+@compiled.jit(fastmath=True, warmup=lambda: [(s, np.float32(1e-2)) for s in compiled.example_spectra()] +
+                                           [(s, np.float32(1e-2), 128) for s in compiled.example_spectra()])
 def find_peak_edges(signal, threshold=-1, imaxima=-1):
     """Returns the indices of left and right edge of the main signal peak in a Doppler spectra.
 
@@ -162,7 +170,54 @@ def find_peak_edges(signal, threshold=-1, imaxima=-1):
     return threshold, [index_left, index_right]
 
 
-@jit(nopython=True, fastmath=True)
+@compiled.jit(parallel=True,
+              warmup=lambda: [(np.stack([s] * 4).reshape(2, 2, -1), np.full((2, 2), 1e-2, dtype=np.float32), np.zeros((2, 2), dtype=np.bool_))
+                              for s in compiled.example_spectra()])
+def find_peak_edges_cube(spectra, threshold, skip):
+    """Indices of left and right edge of the main peak of all spectra of a cube, as :py:func:`find_peak_edges`,
+    the time steps are processed in parallel.
+
+    Args:
+        spectra (numpy.array): 3D Doppler spectra (time, range, velocity)
+        threshold (numpy.array): 2D (time, range) noise threshold, negative to use the minimum of the spectrum
+        skip (numpy.array): 2D boolean (time, range), pixels without signal
+
+    Returns:
+        edges (numpy.array): 3D integer (time, range, 2) with [index_left, index_right], 0 for the skipped pixels
+
+    Note:
+        Compiled without fastmath, a NaN threshold gives an empty peak (index_left == index_right + 1).
+    """
+    n_ts, n_rg, n_vel = spectra.shape
+    edges = np.zeros((n_ts, n_rg, 2), dtype=np.int64)
+
+    for iT in compiled.prange(n_ts):
+        for iR in range(n_rg):
+            if skip[iT, iR]:
+                continue
+            signal = spectra[iT, iR, :]
+            thresh = threshold[iT, iR]
+            if thresh < 0: thresh = np.min(signal)
+            imaxima = np.argmax(signal)
+            index_left, index_right = 0, n_vel
+
+            for ispec in range(imaxima, n_vel):
+                if signal[ispec] > thresh: continue
+                index_right = ispec
+                break
+
+            for ispec in range(imaxima, -1, -1):
+                if signal[ispec] > thresh: continue
+                index_left = ispec + 1
+                break
+
+            edges[iT, iR, 0] = index_left
+            edges[iT, iR, 1] = index_right
+
+    return edges
+
+
+@compiled.jit(fastmath=True, warmup=lambda: [(s, np.linspace(-9., 9., s.size), 0.07) for s in compiled.example_spectra()])
 def radar_moment_calculation(signal, vel_bins, DoppRes):
     """
     Calculation of radar moments: reflectivity, mean Doppler velocity, spectral width,
@@ -203,33 +258,50 @@ def radar_moment_calculation(signal, vel_bins, DoppRes):
     return Ze_lin, VEL, sw, skew, kurt
 
 
-@jit(nopython=True, fastmath=True)
-def despeckle(mask, min_percentage):
-    """Remove small patches (speckle) from any given mask by checking 5x5 box
-    around each pixel, more than half of the points in the box need to be 1
-    to keep the 1 at current pixel
+def _example_moment_cubes():
+    """warmup arguments of radar_moments_cube: 2x2 spectra cube of two chirps"""
+    return [(np.stack([s] * 4).reshape(2, 2, -1), np.full((2, 2, 2), [10, 200]), np.stack([np.linspace(-9., 9., s.size)] * 2),
+             np.array([0.07, 0.07]), np.array([0, 1, 2]), np.zeros((2, 2), dtype=np.bool_)) for s in compiled.example_spectra()]
+
+
+@compiled.jit(parallel=True, fastmath=True, warmup=_example_moment_cubes)
+def radar_moments_cube(spectra, edges, vel, DoppRes, rg_offsets, skip):
+    """Radar moments of all spectra of a cube between their integration boundaries,
+    the time steps are processed in parallel.
 
     Args:
-        mask (numpy.array, integer): 2D mask where 1 = an invalid/fill value and 0 = a data point (time, height)
-        min_percentage (float): minimum percentage of neighbours that need to be signal above noise
+        spectra (numpy.array): 3D Doppler spectra (time, range, velocity) in linear units
+        edges (numpy.array): 3D integer (time, range, 2), the moments use spectra[iT, iR, lb:rb]
+        vel (numpy.array): 2D velocity bins (chirp, velocity)
+        DoppRes (numpy.array): Doppler resolution per chirp
+        rg_offsets (numpy.array): range indices where the chirps start, last entry is the number of range gates
+        skip (numpy.array): 2D boolean (time, range), pixels without moments
 
     Returns:
-        mask ... speckle-filtered matrix of 0 and 1 that represents (cloud) mask [height x time]
-
+        3D array (5, time, range) with Ze_lin, VEL, sw, skew and kurt as in :py:func:`radar_moment_calculation`,
+        NaN where skipped or outside of the chirps
     """
+    n_ts, n_rg, _ = spectra.shape
+    moments = np.full((5, n_ts, n_rg), np.nan)
 
-    WSIZE = 5  # 5x5 window
-    n_bins = WSIZE * WSIZE
-    min_bins = int(min_percentage / 100 * n_bins)
-    shift = int(WSIZE / 2)
-    n_ts, n_rg = mask.shape
+    chirp = np.full(n_rg, -1, dtype=np.int64)
+    for ic in range(len(rg_offsets) - 1):
+        chirp[rg_offsets[ic]:rg_offsets[ic + 1]] = ic
 
-    for iT in range(n_ts - WSIZE):
-        for iR in range(n_rg - WSIZE):
-            if mask[iT, iR] and np.sum(mask[iT:iT + WSIZE, iR:iR + WSIZE]) > min_bins:
-                mask[iT + shift, iR + shift] = True
+    for iT in compiled.prange(n_ts):
+        for iR in range(n_rg):
+            ic = chirp[iR]
+            if ic < 0 or skip[iT, iR]:
+                continue
+            lb, rb = edges[iT, iR, 0], edges[iT, iR, 1]
+            Ze_lin, VEL, sw, skew, kurt = radar_moment_calculation(spectra[iT, iR, lb:rb], vel[ic, lb:rb], DoppRes[ic])
+            moments[0, iT, iR] = Ze_lin
+            moments[1, iT, iR] = VEL
+            moments[2, iT, iR] = sw
+            moments[3, iT, iR] = skew
+            moments[4, iT, iR] = kurt
 
-    return mask
+    return moments
 
 
 def make_container_from_spectra(spectra_all_chirps, values, paraminfo, invalid_mask, varname=''):
@@ -264,6 +336,7 @@ def make_container_from_spectra(spectra_all_chirps, values, paraminfo, invalid_m
     return container
 
 
+@instrumentation.timed('load_spectra')
 def load_spectra_rpgfmcw94(larda, time_span, rpg_radar='LIMRAD94', **kwargs):
     """
     This routine will generate a list of larda containers including spectra of the RPG-FMCW 94GHz radar.
@@ -285,6 +358,8 @@ def load_spectra_rpgfmcw94(larda, time_span, rpg_radar='LIMRAD94', **kwargs):
             -   signal (2d ndarray): Boolean array, a value is True if no signal was detected.
             -   bounds (3d ndarrax): Dimensions [n_time, n_range, 2] containing the integration boundaries.
 
+        **add_horizontal_channel (bool): also load HSpec, ReVHSpec, ImVHSpec and HNoisePow, for :py:func:`spectra2polarimetry`
+
     Returns:
         container (list): list of larda data container
 
@@ -308,28 +383,7 @@ def load_spectra_rpgfmcw94(larda, time_span, rpg_radar='LIMRAD94', **kwargs):
     add_horizontal_channel = True if 'add_horizontal_channel' in kwargs and kwargs['add_horizontal_channel'] else False
     estimate_noise = True if std_above_mean_noise > 0.0 else False
 
-    AvgNum_in = larda.read(rpg_radar, "AvgNum", time_span)
-    DoppLen_in = larda.read(rpg_radar, "DoppLen", time_span)
-    MaxVel_in = larda.read(rpg_radar, "MaxVel", time_span)
-    ChirpFFTSize_in = larda.read(rpg_radar, "ChirpFFTSize", time_span)
-    SeqIntTime_in = larda.read(rpg_radar, "SeqIntTime", time_span)
-    data = {}
-
-    # depending on how much files are loaded, AvgNum and DoppLen are multidimensional list
-    if len(AvgNum_in['var'].shape) > 1:
-        AvgNum = AvgNum_in['var'][0]
-        DoppLen = DoppLen_in['var'][0]
-        ChirpFFTSize = ChirpFFTSize_in['var'][0]
-        DoppRes = np.divide(2.0 * MaxVel_in['var'][0], DoppLen_in['var'][0])
-        MaxVel = MaxVel_in['var'][0]
-        SeqIntTime = SeqIntTime_in['var'][0]
-    else:
-        AvgNum = AvgNum_in['var']
-        DoppLen = DoppLen_in['var']
-        ChirpFFTSize = ChirpFFTSize_in['var']
-        DoppRes = np.divide(2.0 * MaxVel_in['var'], DoppLen_in['var'])
-        MaxVel = MaxVel_in['var']
-        SeqIntTime = SeqIntTime_in['var']
+    data = chirp_settings(larda, rpg_radar, time_span)
 
     # initialize
     tstart = time.time()
@@ -337,36 +391,18 @@ def load_spectra_rpgfmcw94(larda, time_span, rpg_radar='LIMRAD94', **kwargs):
     if add_horizontal_channel:
         data['SLh'] = larda.read(rpg_radar, "SLh", time_span, [0, 'max'])
         data['HSpec'] = larda.read(rpg_radar, 'HSpec', time_span, [0, 'max'])
-        data['ReVHSpec'] = larda.read(rpg_radar, 'ImVHSpec', time_span, [0, 'max'])
-        data['ImVHSpec'] = larda.read(rpg_radar, 'ReVHSpec', time_span, [0, 'max'])
+        data['ReVHSpec'] = larda.read(rpg_radar, 'ReVHSpec', time_span, [0, 'max'])
+        data['ImVHSpec'] = larda.read(rpg_radar, 'ImVHSpec', time_span, [0, 'max'])
 
     data['VHSpec'] = larda.read(rpg_radar, 'VSpec', time_span, [0, 'max'])
     data['SLv'] = larda.read(rpg_radar, "SLv", time_span, [0, 'max'])
     data['mdv'] = larda.read(rpg_radar, 'VEL', time_span, [0, 'max'])
     data['NF'] = std_above_mean_noise
-    data['no_av'] = np.divide(AvgNum, DoppLen)
-    data['DoppRes'] = DoppRes
-    data['DoppLen'] = DoppLen
-    data['MaxVel'] = MaxVel
-    data['ChirpFFTSize'] = ChirpFFTSize
-    data['SeqIntTime'] = SeqIntTime
     data['n_ts'], data['n_rg'], data['n_vel'] = data['VHSpec']['var'].shape
-    data['n_ch'] = len(MaxVel)
-    data['rg_offsets'] = [0]
-    data['vel'] = []
     for var in ['C1Range', 'C2Range', 'C3Range']:
         logger.debug('loading variable from LV1 :: ' + var)
         data.update({var: larda.read(rpg_radar, var, time_span, [0, 'max'])})
 
-    for ic in range(len(AvgNum)):
-        nrange_ = larda.read(rpg_radar, f'C{ic + 1}Range', time_span)['var']
-        if len(nrange_.shape) == 1:
-            nrange_ = nrange_.size
-        else:
-            nrange_ = nrange_.shape[1]
-        data['rg_offsets'].append(data['rg_offsets'][ic] + nrange_)
-        data['vel'].append(np.linspace(-MaxVel[ic] + (0.5 * DoppRes[ic]), +MaxVel[ic] - (0.5 * DoppRes[ic]), np.max(DoppLen)))
-
     data['VHSpec']['rg_offsets'] = data['rg_offsets']
 
     logger.info(f'Loading spectra, elapsed time = {seconds_to_fstring(time.time() - tstart)} [min:sec]')
@@ -405,68 +441,140 @@ def load_spectra_rpgfmcw94(larda, time_span, rpg_radar='LIMRAD94', **kwargs):
     # read spectra and other variables
     if estimate_noise:
         tstart = time.time()
-        data['edges'] = np.full((data['n_ts'], data['n_rg'], 2), 0, dtype=int)
         try:
             data['Vnoise'] = larda.read(rpg_radar, 'VNoisePow', time_span, [0, 'max'])
-            if add_horizontal_channel: data['Hnoise'] = larda.read(rpg_radar, 'HNoisePow', time_span, [0, 'max'])
+        except KeyError:
+            logger.info('KeyError: Noise Power variable not found, calculate noise level...')
+        if add_horizontal_channel:
+            try:
+                data['Hnoise'] = larda.read(rpg_radar, 'HNoisePow', time_span, [0, 'max'])
+            except KeyError:
+                logger.info('KeyError: HNoisePow not found, no polarimetric products')
 
-            # initialize arrays
-            data['mean'] = np.full((data['n_ts'], data['n_rg']), -999.0)
-            data['variance'] = np.full((data['n_ts'], data['n_rg']), -999.0)
-            tmp = data['VHSpec']['var'].copy()
-            tmp[tmp <= 0.0] = np.nan
+        _noise_and_peak_edges(data, dealiasing_flag, vel_offsets=kwargs['dealiasing_vel'] if 'dealiasing_vel' in kwargs else None)
+        logger.info(f'Loading Noise Level, elapsed time = {seconds_to_fstring(time.time() - tstart)} [min:sec]')
 
-            # catch RuntimeWarning: All-NaN slice encountered
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                data['thresh'] = np.nanmin(tmp, axis=2)
-                data['var_max'] = np.nanmax(tmp, axis=2)
+    _remove_ghost_echos(data, ghost_echo_1, ghost_echo_2)
 
-            # find all-noise-spectra (aka. fill_value)
-            mask = np.all(data['VHSpec']['var'] == -999.0, axis=2)
-            data['thresh'][mask] = data['Vnoise']['var'][mask]
-            del tmp
+    if do_despeckle2D:
+        tstart = time.time()
+        data['dspkl_mask'] = despeckle2D(data['VHSpec']['var'])
+        data['VHSpec']['var'][data['dspkl_mask']], data['VHSpec']['mask'][data['dspkl_mask']] = -999.0, True
+        logger.info(f'Despeckle applied, elapsed time = {seconds_to_fstring(time.time() - tstart)} [min:sec]')
 
-        except KeyError:
-            logger.info('KeyError: Noise Power variable not found, calculate noise level...')
-            noise_est = noise_estimation_uncompressed_data(data['VHSpec'], no_av=data['no_av'], n_std=6.0, rg_offsets=data['rg_offsets'])
-            mask = ~noise_est['signal']
-            data['thresh'] = noise_est['threshold']
-            data['VHSpec']['var'][mask] = -999.0
-
-            # IGNORES: RuntimeWarning: invalid value encountered in less:
-            #                          masking = data['VHSpec']['var'][iT, iR, :] < data['thresh'][iT, iR]
-            with np.errstate(invalid='ignore'):
-                for iT, iR in product(range(data['n_ts']), range(data['n_rg'])):
-                    if mask[iT, iR]: continue
-                    masking = data['VHSpec']['var'][iT, iR, :] < data['thresh'][iT, iR]
-                    data['VHSpec']['var'][iT, iR, masking] = -999.0
-
-        if dealiasing_flag:
-            dealiased_spec, dealiased_mask, new_vel, new_bounds, _, _ = dealiasing(
-                data['VHSpec']['var'],
-                data['vel'],
-                data['SLv']['var'],
-                data['rg_offsets'],
-                vel_offsets=kwargs['dealiasing_vel'] if 'dealiasing_vel' in kwargs else None,
-                show_triple=False
-            )
-
-            data['VHSpec']['var'] = dealiased_spec
-            data['VHSpec']['mask'] = dealiased_mask
-            data['VHSpec']['vel'] = new_vel[0]  # copy to larda container
-            data['vel'] = new_vel  # copy all veloctiys
-            data['edges'] = new_bounds
+    return data
+
+
+def chirp_settings(larda, rpg_radar, time_span):
+    """chirp table of the RPG-FMCW 94GHz radar: averages, Doppler resolution, velocity bins and range offsets"""
+    AvgNum_in = larda.read(rpg_radar, "AvgNum", time_span)
+    DoppLen_in = larda.read(rpg_radar, "DoppLen", time_span)
+    MaxVel_in = larda.read(rpg_radar, "MaxVel", time_span)
+    ChirpFFTSize_in = larda.read(rpg_radar, "ChirpFFTSize", time_span)
+    SeqIntTime_in = larda.read(rpg_radar, "SeqIntTime", time_span)
+    data = {}
+
+    # depending on how much files are loaded, AvgNum and DoppLen are multidimensional list
+    if len(AvgNum_in['var'].shape) > 1:
+        AvgNum = AvgNum_in['var'][0]
+        DoppLen = DoppLen_in['var'][0]
+        ChirpFFTSize = ChirpFFTSize_in['var'][0]
+        DoppRes = np.divide(2.0 * MaxVel_in['var'][0], DoppLen_in['var'][0])
+        MaxVel = MaxVel_in['var'][0]
+        SeqIntTime = SeqIntTime_in['var'][0]
+    else:
+        AvgNum = AvgNum_in['var']
+        DoppLen = DoppLen_in['var']
+        ChirpFFTSize = ChirpFFTSize_in['var']
+        DoppRes = np.divide(2.0 * MaxVel_in['var'], DoppLen_in['var'])
+        MaxVel = MaxVel_in['var']
+        SeqIntTime = SeqIntTime_in['var']
 
+    data['no_av'] = np.divide(AvgNum, DoppLen)
+    data['DoppRes'] = DoppRes
+    data['DoppLen'] = DoppLen
+    data['MaxVel'] = MaxVel
+    data['ChirpFFTSize'] = ChirpFFTSize
+    data['SeqIntTime'] = SeqIntTime
+    data['n_ch'] = len(MaxVel)
+    data['rg_offsets'] = [0]
+    data['vel'] = []
+
+    for ic in range(len(AvgNum)):
+        nrange_ = larda.read(rpg_radar, f'C{ic + 1}Range', time_span)['var']
+        if len(nrange_.shape) == 1:
+            nrange_ = nrange_.size
         else:
-            for iT, iR in product(range(data['n_ts']), range(data['n_rg'])):
-                if mask[iT, iR]: continue
-                _, data['edges'][iT, iR, :] = find_peak_edges(data['VHSpec']['var'][iT, iR, :], data['thresh'][iT, iR])
+            nrange_ = nrange_.shape[1]
+        data['rg_offsets'].append(data['rg_offsets'][ic] + nrange_)
+        data['vel'].append(np.linspace(-MaxVel[ic] + (0.5 * DoppRes[ic]), +MaxVel[ic] - (0.5 * DoppRes[ic]), np.max(DoppLen)))
 
-        logger.info(f'Loading Noise Level, elapsed time = {seconds_to_fstring(time.time() - tstart)} [min:sec]')
+    return data
 
+
+def _noise_and_peak_edges(data, dealiasing_flag, vel_offsets=None, previous_peaks=None):
+    """noise threshold and integration boundaries (data['thresh'], data['edges']) of the spectra data['VHSpec'],
+    from the noise power data['Vnoise'] if available, otherwise the noise level is estimated
+
+    Returns:
+        idx_peak_matrix of the de-aliasing (look-back for the next time chunk), None without de-aliasing
+    """
+    data['edges'] = np.full((data['n_ts'], data['n_rg'], 2), 0, dtype=int)
+    if 'Vnoise' in data:
+        # initialize arrays
+        data['mean'] = np.full((data['n_ts'], data['n_rg']), -999.0)
+        data['variance'] = np.full((data['n_ts'], data['n_rg']), -999.0)
+        tmp = data['VHSpec']['var'].copy()
+        tmp[tmp <= 0.0] = np.nan
+
+        # catch RuntimeWarning: All-NaN slice encountered
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            data['thresh'] = np.nanmin(tmp, axis=2)
+            data['var_max'] = np.nanmax(tmp, axis=2)
+
+        # find all-noise-spectra (aka. fill_value)
+        mask = np.all(data['VHSpec']['var'] == -999.0, axis=2)
+        data['thresh'][mask] = data['Vnoise']['var'][mask]
+        del tmp
+
+    else:
+        noise_est = noise_estimation_uncompressed_data(data['VHSpec'], no_av=data['no_av'], n_std=6.0, rg_offsets=data['rg_offsets'])
+        mask = ~noise_est['signal']
+        data['thresh'] = noise_est['threshold']
+        data['VHSpec']['var'][mask] = -999.0
+
+        # IGNORES: RuntimeWarning: invalid value encountered in less
+        with np.errstate(invalid='ignore'):
+            masking = (data['VHSpec']['var'] < data['thresh'][:, :, np.newaxis]) & ~mask[:, :, np.newaxis]
+        data['VHSpec']['var'][masking] = -999.0
+
+    if not dealiasing_flag:
+        data['edges'] = find_peak_edges_cube(data['VHSpec']['var'], data['thresh'], mask)
+        return None
+
+    dealiased_spec, dealiased_mask, new_vel, new_bounds, _, idx_peak_matrix = dealiasing(
+        data['VHSpec']['var'],
+        data['vel'],
+        data['SLv']['var'],
+        data['rg_offsets'],
+        vel_offsets=vel_offsets,
+        show_triple=False,
+        previous_peaks=previous_peaks
+    )
+
+    data['VHSpec']['var'] = dealiased_spec
+    data['VHSpec']['mask'] = dealiased_mask
+    data['VHSpec']['vel'] = new_vel[0]  # copy to larda container
+    data['vel'] = new_vel  # copy all veloctiys
+    data['edges'] = new_bounds
+    return idx_peak_matrix
+
+
+def _remove_ghost_echos(data, ghost_echo_1, ghost_echo_2):
+    """set the precipitation and curtain-like ghost echos of the spectra data['VHSpec'] to fill_value"""
+    tstart = time.time()
     if ghost_echo_1:
-        tstart = time.time()
         data['ge1_mask'] = filter_ghost_1(data['VHSpec']['var'], data['VHSpec']['rg'], data['vel'], data['rg_offsets'])
         logger.info(f'Precipitation Ghost Filter applied, elapsed time = {seconds_to_fstring(time.time() - tstart)} [min:sec]')
         logger.info(f'Number of ghost pixel due to precipitation = {np.sum(data["ge1_mask"])}')
@@ -478,14 +586,6 @@ def load_spectra_rpgfmcw94(larda, time_span, rpg_radar='LIMRAD94', **kwargs):
         logger.info(f'Number of curtain-like ghost pixel = {np.sum(data["ge2_mask"])}')
         data['VHSpec']['var'][data['ge2_mask']], data['VHSpec']['mask'][data['ge2_mask']] = -999.0, True
 
-    if do_despeckle2D:
-        tstart = time.time()
-        data['dspkl_mask'] = despeckle2D(data['VHSpec']['var'])
-        data['VHSpec']['var'][data['dspkl_mask']], data['VHSpec']['mask'][data['dspkl_mask']] = -999.0, True
-        logger.info(f'Despeckle applied, elapsed time = {seconds_to_fstring(time.time() - tstart)} [min:sec]')
-
-    return data
-
 
 def dealiasing_check(masked3D):
     """
@@ -523,6 +623,109 @@ def dealiasing_check(masked3D):
     return alias_flag
 
 
+def _example_dealiasing():
+    """warmup arguments of _dealiasing_kernel: 2x2 spectra cube"""
+    spectra = np.stack([compiled.example_spectra()[0]] * 4).reshape(2, 2, -1)
+    n_vel_new = 3 * spectra.shape[2]
+    return [(spectra, np.kaiser(n_vel_new, 4.0), np.full((2, 2), [-80, 80]), np.full((2, 2), 1e-2, dtype=np.float32),
+             np.zeros(2, dtype=np.bool_), np.array([[0, 2]]), 2, spectra.shape[2] // 2, False,
+             np.full((2, 2, n_vel_new), -999.0, dtype=np.float32), np.ones((2, 2, n_vel_new), dtype=np.bool_),
+             np.zeros((2, 2, 2), dtype=np.int64), np.zeros((2, 2, 2), dtype=np.int64), np.full((4, 2), n_vel_new // 2), 0)]
+
+
+@compiled.jit(parallel=True, warmup=_example_dealiasing)
+def _dealiasing_kernel(spectra, window_fcn, iDbinTol, noise, all_clear, segments, k, jump, show_triple,
+                       dealiased_spectra, dealiased_mask, signal_boundaries, search_path, idx_peak_matrix, n_prev):
+    """top-down peak tracking of :py:func:`dealiasing`, fills the output arrays in place
+
+    The tripled spectrum is indexed modulo n_vel. The time segments are processed in parallel,
+    each one has to start after k clear sky profiles (no look-back to other segments).
+    The first k rows of idx_peak_matrix hold the peaks of the time steps before the spectra,
+    the last n_prev of them are valid (look-back of a previous chunk).
+    """
+    n_ts, n_rg, n_vel = spectra.shape
+    n_vel_new = 3 * n_vel
+
+    for iS in compiled.prange(segments.shape[0]):
+        for iT in range(segments[iS, 0], segments[iS, 1]):
+
+            # entire profile is clear sky
+            if all_clear[iT]:
+                continue
+
+            # assume no dealiasing at upper most range gate
+            idx_last_peak = n_vel_new // 2
+
+            # Top-Down approach: check range gates below
+            for iR in range(n_rg - 1, -1, -1):
+
+                # the search window for the next peak maximum surrounds ± velocity_jump_tolerance [m s-1] around the last peak maximum
+                lo = max(idx_last_peak + iDbinTol[iR, 0], 0)
+                hi = min(idx_last_peak + iDbinTol[iR, 1], n_vel_new)
+
+                # maximum of the spectrum weighted with the window function centered at the last peak
+                shift = n_vel_new // 2 - idx_last_peak
+                idx_new_peak, peak = lo, 0.0
+                for ivel in range(lo, hi):
+                    value = spectra[iT, iR, ivel % n_vel] * window_fcn[(ivel - shift) % n_vel_new]
+                    if np.isnan(value):
+                        idx_new_peak = ivel
+                        break
+                    if ivel == lo or value > peak:
+                        idx_new_peak, peak = ivel, value
+
+                # check if Doppler velocity jumps more than jump bins from the mean of the last peaks
+                total, count = 0, 0
+                for jT in range(max(k - n_prev, iT), iT + k + 1):
+                    for jR in range(max(0, iR - 1), min(iR + k, n_rg)):
+                        total += idx_peak_matrix[jT, jR]
+                        count += 1
+                mean_idx_last_ts = int(total / count)
+                if abs(idx_new_peak - mean_idx_last_ts) > jump:
+                    idx_new_peak = mean_idx_last_ts
+                    lo = max(idx_new_peak + iDbinTol[iR, 0], 0)
+                    hi = min(idx_new_peak + iDbinTol[iR, 1], n_vel_new)
+
+                search_path[iT, iR, 0] = lo  # for plotting
+                search_path[iT, iR, 1] = hi - 1
+
+                if lo < idx_new_peak < hi - 1:
+                    # calc signal boundaries, as find_peak_edges on the tripled spectrum
+                    threshold = noise[iT, iR]
+                    if threshold < 0:
+                        threshold = np.min(spectra[iT, iR, :])
+                    index_left, index_right = 0, n_vel_new
+                    for ivel in range(idx_new_peak, n_vel_new):
+                        if spectra[iT, iR, ivel % n_vel] > threshold: continue
+                        index_right = ivel
+                        break
+                    for ivel in range(idx_new_peak, -1, -1):
+                        if spectra[iT, iR, ivel % n_vel] > threshold: continue
+                        index_left = ivel + 1
+                        break
+
+                    # safety precautions, if idx-left-bound > idx-right-bound --> no signal
+                    if index_left == index_right + 1:
+                        # probably clear sky
+                        idx_peak_matrix[iT + k, iR] = idx_last_peak
+                        signal_boundaries[iT, iR, 0], signal_boundaries[iT, iR, 1] = -1, -1
+                    else:
+                        signal_boundaries[iT, iR, 0], signal_boundaries[iT, iR, 1] = index_left, index_right
+                        idx_peak_matrix[iT + k, iR] = idx_new_peak
+                        idx_last_peak = idx_new_peak
+                        # if show_triple, copy all signals including the triplication else copy only the main signal
+                        lb, rb = (0, n_vel_new) if show_triple else (index_left, index_right)
+                        for ivel in range(lb, rb):
+                            dealiased_spectra[iT, iR, ivel] = spectra[iT, iR, ivel % n_vel]
+                            dealiased_mask[iT, iR, ivel] = False
+
+                else:
+                    # last peak stays the same, no integration boundaries
+                    signal_boundaries[iT, iR, 0], signal_boundaries[iT, iR, 1] = -1, -1
+                    idx_peak_matrix[iT + k, iR] = idx_last_peak
+
+
+@instrumentation.timed('dealiasing')
 def dealiasing(
         spectra: np.array,
         vel_bins_per_chirp: List[np.array],
@@ -531,13 +734,13 @@ def dealiasing(
         show_triple: bool = False,
         vel_offsets: List[int] = None,
         jump: int = None,
+        previous_peaks: np.array = None,
 ) -> Union[np.array, np.array, List[np.array], np.array, np.array, np.array]:
     """
         Peaks exceeding the maximum unambiguous Doppler velocity range of ± v_Nyq in [m s-1]
         appear at the next upper (lower) range gate at the other end of the velocity spectrum.
         The dealiasing method presented here aims to correct for this and is applied to every time step.
-
-        Logging level INFO shows the de-aliasing progress bar.
+        The peak tracking runs in a compiled kernel, time segments separated by clear sky profiles in parallel.
 
     Args:
         spectra: dim = (n_time, n_range, n_velocity) in linear units!
@@ -547,6 +750,8 @@ def dealiasing(
         show_triple (optional): if True, return dealiased spectra including the triplication
         vel_offsets (optional): velocity window around the main peak [x1, x2], x1 < 0, x2 > 0 ! in [m s-1], default [-6.0, +9.0]
         jump (optional): maximum number of Doppler bins a spectrum can change in two adjacent range bins
+        previous_peaks (optional): dim = (n_prev, n_range), idx_peak_matrix of the last time steps before spectra,
+            to continue the de-aliasing of the previous time chunk
 
     Returns:
         tuple containing
@@ -588,83 +793,41 @@ def dealiasing(
     Dopp_res = np.array([vel_bins_per_chirp[ic][1] - vel_bins_per_chirp[ic][0] for ic in range(n_ch)])
 
     iDbinTol = [velocty_jump_tolerance[ires, :] // res for ires, res in enumerate(Dopp_res)]
-    iDbinTol = np.concatenate([np.array([iDbinTol[ic]] * rg_diffs[ic]) for ic in range(n_ch)]).astype(np.int)
-
-    # triplicate spectra
-    Z_linear = np.concatenate([spectra for _ in range(3)], axis=2)
+    iDbinTol = np.concatenate([np.array([iDbinTol[ic]] * rg_diffs[ic]) for ic in range(n_ch)]).astype(int)
 
-    # initialize arrays for dealiasing
+    # initialize arrays for dealiasing, the spectra are not triplicated but indexed modulo n_vel
+    spectra = np.ascontiguousarray(spectra)
     window_fcn = np.kaiser(n_vel_new, 4.0)
-    signal_boundaries = np.zeros((n_ts, n_rg, 2), dtype=np.int)
-    search_path = np.zeros((n_ts, n_rg, 2), dtype=np.int)
-    dealiased_spectra = np.full(Z_linear.shape, -999.0, dtype=np.float32)
-    dealiased_mask = np.full(Z_linear.shape, True, dtype=np.bool)
-    idx_peak_matrix = np.full((n_ts, n_rg), n_vel_new // 2, dtype=np.int)
+    signal_boundaries = np.zeros((n_ts, n_rg, 2), dtype=int)
+    search_path = np.zeros((n_ts, n_rg, 2), dtype=int)
+    dealiased_spectra = np.full((n_ts, n_rg, n_vel_new), -999.0, dtype=np.float32)
+    dealiased_mask = np.full((n_ts, n_rg, n_vel_new), True, dtype=bool)
+    # the first k rows hold the peaks of the time steps before, for the look-back
+    idx_peak_matrix = np.full((k + n_ts, n_rg), n_vel_new // 2, dtype=int)
+    n_prev = 0 if previous_peaks is None else min(len(previous_peaks), k)
+    if n_prev > 0:
+        idx_peak_matrix[k - n_prev:k] = previous_peaks[-n_prev:]
     all_clear = np.all(np.all(spectra <= 0.0, axis=2), axis=1)
-    noise = np.copy(noisefloor)
+    noise = np.array(noisefloor)
     noise_mask = spectra.min(axis=2) > noise
     noise[noise_mask] = spectra.min(axis=2)[noise_mask]
 
-    logger.debug(f'Doppler resolution per chirp : {Dopp_res}')
-    logger.info(f'Doppler spectra de-aliasing....... ')
-    for iT in range(n_ts) if logger.level > 20 else tqdm(range(n_ts), unit=' timesteps', total=n_ts):
-
-        # entire profile is clear sky
-        if all_clear[iT]:  continue
-
-        # assume no dealiasing at upper most range gate
-        idx_last_peak = n_vel_new // 2
-
-        # Top-Down approach: check range gates below
-        for iR in range(n_rg - 1, -1, -1):
-
-            # the search window for the next peak maximum surrounds ± velocity_jump_tolerance [m s-1] around the last peak maximum
-            search_window = range(max(idx_last_peak + iDbinTol[iR, 0], 0), min(idx_last_peak + iDbinTol[iR, 1], n_vel_new))
-            Z_windowed = Z_linear[iT, iR, :] * np.roll(window_fcn, n_vel_new // 2 - idx_last_peak)
-            Z_windowed = Z_windowed[search_window]  # Note: Think about index shift!
-            idx_new_peak = np.argmax(Z_windowed) + search_window[0]
-
-            # check if Doppler velocity jumps more than 120 bins from last _eak max to new(=one rg below) peak max
-            mean_idx_last_ts = int(np.mean(idx_peak_matrix[max(0, iT - k):min(iT + 1, n_ts), max(0, iR - 1):min(iR + k, n_rg)]))
-            if abs(idx_new_peak - mean_idx_last_ts) > jump:
-                logger.debug(f'jump at iT={iT}   iR={iR}')
-                idx_new_peak = mean_idx_last_ts
-                search_window = range(max(idx_new_peak + iDbinTol[iR, 0], 0), min(idx_new_peak + iDbinTol[iR, 1], n_vel_new))
-
-            search_path[iT, iR, :] = [search_window[0], search_window[-1]]  # for plotting
-
-            if search_window[0] < idx_new_peak < search_window[-1]:
-                # calc signal boundaries
-                _, _bnd = find_peak_edges(Z_linear[iT, iR, :], threshold=noise[iT, iR], imaxima=idx_new_peak)
-
-                # safety precautions, if idx-left-bound > idx-right-bound --> no signal
-                if _bnd[0] == _bnd[1] + 1:
-                    # probably clear sky
-                    idx_peak_matrix[iT, iR] = idx_last_peak
-                    signal_boundaries[iT, iR, :] = [-1, -1]
-                else:
-                    signal_boundaries[iT, iR, :] = _bnd
-                    idx_peak_matrix[iT, iR] = idx_new_peak
-                    idx_last_peak = idx_new_peak
-                    # if show_triple == True, copy all signals including the triplication else copy only the main signal and not the triplication
-                    _bnd_tmp = [None, None] if show_triple else _bnd
-                    dealiased_spectra[iT, iR, _bnd_tmp[0]:_bnd_tmp[1]] = Z_linear[iT, iR, _bnd_tmp[0]:_bnd_tmp[1]]
-                    dealiased_mask[iT, iR, _bnd_tmp[0]:_bnd_tmp[1]] = False
-
-            else:
-                # last peak stays the same, no integration boundaries
-                signal_boundaries[iT, iR, :] = [-1, -1]
-                idx_peak_matrix[iT, iR] = idx_last_peak
+    # a time step after k clear sky profiles does not depend on earlier ones,
+    # the segments starting there are de-aliased in parallel
+    starts = [iT for iT in range(n_ts) if iT == 0 or all_clear[max(0, iT - k):iT].all()]
+    segments = np.column_stack([starts, starts[1:] + [n_ts]]).astype(np.int64)
 
-            logger.debug(f'signal boundaries(iR == {iR}) = {signal_boundaries[iT, iR, :]}     '
-                         f'idx_peak_max  {idx_peak_matrix[iT, iR]},     '
-                         f'min val = noise floor : {Z_linear[iT, iR, :].min():.7f}, {noise[iT, iR]:.7f}     ')
+    logger.debug(f'Doppler resolution per chirp : {Dopp_res}')
+    logger.info(f'Doppler spectra de-aliasing, {len(segments)} independent segments....... ')
+    _dealiasing_kernel(spectra, window_fcn, iDbinTol, noise, all_clear, segments, k, jump, show_triple,
+                       dealiased_spectra, dealiased_mask, signal_boundaries, search_path, idx_peak_matrix, n_prev)
 
     # clean up signal boundaries
     signal_boundaries[(signal_boundaries <= 0) + (signal_boundaries >= n_vel_new)] = -1
-    return dealiased_spectra, dealiased_mask, velocity_new, signal_boundaries, search_path, idx_peak_matrix
+    return dealiased_spectra, dealiased_mask, velocity_new, signal_boundaries, search_path, idx_peak_matrix[k:]
 
 
+@instrumentation.timed('noise_estimation')
 def noise_estimation_uncompressed_data(data, n_std=6.0, **kwargs):
     """
     Creates a dict containing the noise threshold, mean noise level,
@@ -681,49 +844,28 @@ def noise_estimation_uncompressed_data(data, n_std=6.0, **kwargs):
         dict with noise floor estimation for all time and range points
     """
 
-    spectra3D = data['var'].copy()
+    spectra3D = np.array(data['var'])
     n_ts, n_rg, n_vel = spectra3D.shape
-    if 'rg_offsets' in kwargs:
-        rg_offsets = np.copy(kwargs['rg_offsets'])
-        rg_offsets[0] = -1
-        rg_offsets[-1] += 1
-    else:
-        rg_offsets = [-1, n_rg + 1]
-    no_av = kwargs['no_av'] if 'no_av' in kwargs else [1]
+    rg_offsets = np.array(kwargs['rg_offsets'] if 'rg_offsets' in kwargs else [0, n_rg], dtype=np.int64)
+    no_av = np.array(kwargs['no_av'] if 'no_av' in kwargs else [1], dtype=np.float64)
 
     # fill values needs to be masked for noise removal otherwise wrong results
     spectra3D[spectra3D == -999.0] = np.nan
 
     # Estimate Noise Floor for all chirps, time stemps and range gates aka. for all pixels
-    # Algorithm used: Hildebrand & Sekhon
+    # Algorithm used: Hildebrand & Sekhon, compiled kernel parallel over the time steps
+    logger.info(f'Noise estimation for uncompressed spectra....... ')
+    noise_free = np.isnan(spectra3D).any(axis=2)
+    mean, threshold, variance, numnoise, _, _ = estimate_noise_hs74_cube(spectra3D, no_av, rg_offsets, noise_free, std_div=n_std)
 
-    # allocate numpy arrays
     noise_est = {
-        'mean': np.zeros((n_ts, n_rg), dtype=np.float32),
-        'threshold': np.zeros((n_ts, n_rg), dtype=np.float32),
-        'variance': np.zeros((n_ts, n_rg), dtype=np.float32),
-        'numnoise': np.zeros((n_ts, n_rg), dtype=np.int32),
-        'signal': np.full((n_ts, n_rg), fill_value=True),
+        'mean': mean,
+        'threshold': threshold,
+        'variance': variance,
+        'numnoise': numnoise,
+        'signal': numnoise < n_vel,
     }
 
-    # gather noise level etc. for all chirps, range gates and times
-    logger.info(f'Noise estimation for uncompressed spectra....... ')
-    noise_free = np.isnan(spectra3D).any(axis=2)
-    iterator = product(range(n_ts), range(n_rg)) if logger.level > 20 else tqdm(product(range(n_ts), range(n_rg)), total=n_ts * n_rg, unit=' spectra')
-    for iT, iR in iterator:
-        if noise_free[iT, iR]: continue
-        mean, thresh, var, nnoise = estimate_noise_hs74(
-            spectra3D[iT, iR, :],
-            navg=no_av[getnointerval(rg_offsets, iR) - 1],
-            std_div=n_std
-        )
-
-        noise_est['mean'][iT, iR] = mean
-        noise_est['variance'][iT, iR] = var
-        noise_est['numnoise'][iT, iR] = nnoise
-        noise_est['threshold'][iT, iR] = thresh
-        noise_est['signal'][iT, iR] = nnoise < n_vel
-
     return noise_est
 
 
@@ -754,7 +896,8 @@ def seconds_to_fstring(time_diff):
     return datetime.datetime.fromtimestamp(time_diff).strftime("%M:%S")
 
 
-def despeckle2D(data, min_perc=80.0):
+@instrumentation.timed('despeckle2D')
+def despeckle2D(data, min_perc=80.0, window=5):
     """This function is used to remove all spectral lines for one time-range-pixel if surrounding% of the sourounding pixels are fill_values.
 
     Args:
@@ -762,20 +905,19 @@ def despeckle2D(data, min_perc=80.0):
 
     Keyword Args:
         min_perc (float): minimum percentage value of neighbouring pixel, that need to be above the noise threshold
+        window (int): edge length of the (time, range) box, default 5
 
     Returns:
-        mask (numpy.array, bool): where True = fill_value, and False = signal, dimensions: (time, range, velocity)
+        mask (numpy.array, bool): where True = fill_value, and False = signal, dimensions: (time, range, velocity),
+        a read-only view of the 2D mask broadcast along the velocity axis
 
     """
     # there must be high levels of reflection/scattering in this region to produce ghost echos
-    mask_2D = despeckle(np.all(data <= 0.0, axis=2), min_perc)
-    mask = data <= 0.0
-    for iBin in range(data.shape[2]):
-        mask[:, :, iBin] = mask_2D
-
-    return mask
+    mask_2D = despeckle(np.all(data <= 0.0, axis=2), min_perc, window)
+    return np.broadcast_to(mask_2D[:, :, np.newaxis], data.shape)
 
 
+@instrumentation.timed('ghost_filter_1')
 def filter_ghost_1(data, rg, vel, offset, dBZ_thresh=-20.0, reduce_by=1.5, **kwargs):
     """This function is used to remove certain spectral lines "speckle ghost echoes" from all chirps of RPG FMCW 94GHz cloud radar spectra.
     The speckle occur usually near the maximum unambiguous Doppler velocity.
@@ -807,18 +949,21 @@ def filter_ghost_1(data, rg, vel, offset, dBZ_thresh=-20.0, reduce_by=1.5, **kwa
     signal_min = z2lin(dBZ_thresh)
     n_vel = data.shape[2]
 
+    # (range, velocity) bins near the maximum unambiguous Doppler velocity, per chirp
+    near_nyquist = np.full(data.shape[1:], False)
     for iC in range(len(vel)):
         if iC < 1 and ignore_chirp1:
             continue  # exclude first chirp because ghost is hidden under real signal anyway
         idx_max_vel_new = argnearest(vel[iC], vel[iC][-1] - reduce_by)
-        for iV in range(n_vel - idx_max_vel_new):
-            mask[ts_to_mask, offset[iC]:offset[iC + 1], iV] = data[ts_to_mask, offset[iC]:offset[iC + 1], iV] < signal_min
-        for iV in range(idx_max_vel_new, n_vel):
-            mask[ts_to_mask, offset[iC]:offset[iC + 1], iV] = data[ts_to_mask, offset[iC]:offset[iC + 1], iV] < signal_min
+        near_nyquist[offset[iC]:offset[iC + 1], :max(n_vel - idx_max_vel_new, 0)] = True
+        near_nyquist[offset[iC]:offset[iC + 1], idx_max_vel_new:] = True
+
+    mask[ts_to_mask] = np.where(near_nyquist, data[ts_to_mask] < signal_min, mask[ts_to_mask])
 
     return mask
 
 
+@instrumentation.timed('ghost_filter_2')
 def filter_ghost_2(data, rg, SL, first_offset, dBZ_thresh=-5.0, reduce_by=10.0):
     """This function is used to remove curtain-like ghost echoes
     from the first chirp of RPG FMCW 94GHz cloud radar spectra.
@@ -843,10 +988,7 @@ def filter_ghost_2(data, rg, SL, first_offset, dBZ_thresh=-5.0, reduce_by=10.0):
     dBZ_max = np.max(data[:, argnearest(rg, RG_MIN_):argnearest(rg, RG_MAX_), :], axis=2)
     ts_to_mask = np.any(dBZ_max >= z2lin(dBZ_thresh), axis=1)
     sens_lim = SL * reduce_by
-    for iT, mask_iT in enumerate(ts_to_mask):
-        if mask_iT:
-            for iV in range(data.shape[2]):
-                mask[iT, :first_offset, iV] = data[iT, :first_offset, iV] < sens_lim[iT, :first_offset]
+    mask[ts_to_mask, :first_offset] = data[ts_to_mask, :first_offset] < sens_lim[ts_to_mask, :first_offset, np.newaxis]
 
     return mask
 
@@ -857,6 +999,7 @@ def split_by_compression_status(var, mask):
     return split_int[0::2] if mask[0] else split_int[1::2]
 
 
+@instrumentation.timed('moments')
 def spectra2moments(ZSpec, paraminfo, **kwargs):
     """
     This routine calculates the radar moments: reflectivity, mean Doppler velocity, spectrum width, skewness and
@@ -874,11 +1017,6 @@ def spectra2moments(ZSpec, paraminfo, **kwargs):
     # initialize variables:
     n_ts, n_rg, n_vel = ZSpec['VHSpec']['var'].shape
     n_chirps = ZSpec['n_ch']
-    Z = np.full((n_ts, n_rg), np.nan)
-    V = np.full((n_ts, n_rg), np.nan)
-    SW = np.full((n_ts, n_rg), np.nan)
-    SK = np.full((n_ts, n_rg), np.nan)
-    K = np.full((n_ts, n_rg), np.nan)
 
     spec_lin = ZSpec['VHSpec']['var'].copy()
     mask = spec_lin <= 0.0
@@ -890,16 +1028,16 @@ def spectra2moments(ZSpec, paraminfo, **kwargs):
     mask3 = ZSpec['edges'][:, :, 1] - ZSpec['edges'][:, :, 0] >= n_vel
     mask = mask1 * mask2 * mask3
 
+    # velocity bins of all chirps as 2D array, padded with NaN if the chirps differ in length
+    vel = np.full((n_chirps, max(len(v) for v in ZSpec['vel'][:n_chirps])), np.nan)
     for iC in range(n_chirps):
-        tstart = time.time()
-        for iR in range(ZSpec['rg_offsets'][iC], ZSpec['rg_offsets'][iC + 1]):  # range dimension
-            for iT in range(n_ts):  # time dimension
-                if mask[iT, iR]: continue
-                lb, rb = ZSpec['edges'][iT, iR, :]
-                Z[iT, iR], V[iT, iR], SW[iT, iR], SK[iT, iR], K[iT, iR] = \
-                    radar_moment_calculation(spec_lin[iT, iR, lb:rb], ZSpec['vel'][iC][lb:rb], ZSpec['DoppRes'][iC])
+        vel[iC, :len(ZSpec['vel'][iC])] = ZSpec['vel'][iC]
 
-        logger.info(f'Chirp {iC + 1} Moments Calculated, elapsed time = {seconds_to_fstring(time.time() - tstart)} [min:sec]')
+    tstart = time.time()
+    Z, V, SW, SK, K = radar_moments_cube(
+        spec_lin, np.asarray(ZSpec['edges'], dtype=np.int64), vel, np.asarray(ZSpec['DoppRes'], dtype=np.float64)[:n_chirps],
+        np.asarray(ZSpec['rg_offsets'][:n_chirps + 1], dtype=np.int64), mask)
+    logger.info(f'Moments Calculated, elapsed time = {seconds_to_fstring(time.time() - tstart)} [min:sec]')
 
     moments = {'Ze': Z, 'VEL': V, 'sw': SW, 'skew': SK, 'kurt': K}
     # create the mask where invalid values have been encountered
@@ -924,6 +1062,224 @@ def spectra2moments(ZSpec, paraminfo, **kwargs):
     return container_dict
 
 
+def _time_rows(rows, index):
+    """select time steps of a dict of arrays with the time along the first axis"""
+    return {key: value[index] for key, value in rows.items()}
+
+
+def _join_time_rows(first, second):
+    """concatenate two dicts of arrays with the time along the first axis"""
+    if first is None:
+        return second
+    return {key: np.concatenate([first[key], second[key]]) for key in second}
+
+
+class ChunkedDespeckle:
+    """:py:func:`despeckle` of a (time, range) mask delivered in consecutive time chunks
+
+    despeckle sets the pixels in place, time step by time step. A time step depends on the final
+    mask of the ``window // 2`` time steps before and on the unchanged mask of the following ones.
+    The last time steps of a chunk are held back until the next chunk (or the end) arrives, the
+    concatenated result is identical to despeckle of the whole mask.
+
+    Args:
+        min_perc (float, optional): minimum percentage of neighbours that need to be a fill value
+        window (int, optional): edge length of the (time, range) box
+    """
+
+    def __init__(self, min_perc=80.0, window=5):
+        self.min_perc = min_perc
+        self.window = window
+        self.tail = None  # final mask of the last time steps returned
+        self.held = None  # time steps held back
+
+    def __call__(self, rows, mask, last=False):
+        """
+        Args:
+            rows (dict): arrays of the next time steps (time along the first axis), held back with the mask, or None
+            mask (numpy.array, bool): mask of the next time steps, True = fill value, dimensions: (time, range)
+            last (bool, optional): end of the time series, return all remaining time steps
+
+        Returns:
+            rows of the completed time steps with the despeckled mask as ``rows['dspkl_mask']``, None if no time step is completed
+        """
+        shift = self.window // 2
+        held = self.held if rows is None else _join_time_rows(self.held, {**rows, 'dspkl_mask': mask})
+        if held is None:
+            return None
+
+        n_rows = held['dspkl_mask'].shape[0]
+        n_done = n_rows if last else max(n_rows - (self.window - shift), 0)
+        self.held = _time_rows(held, slice(n_done, None)) if n_done < n_rows else None
+        if n_done == 0:
+            return None
+
+        tail = held['dspkl_mask'][:0] if self.tail is None else self.tail
+        mask_2D = despeckle(np.concatenate([tail, held['dspkl_mask']]), self.min_perc, self.window)[len(tail):]
+        done = _time_rows(held, slice(None, n_done))
+        done['dspkl_mask'] = mask_2D[:n_done]
+        tail = np.concatenate([tail, done['dspkl_mask']])
+        self.tail = tail[max(len(tail) - shift, 0):]
+        return done
+
+
+def iter_moments_rpgfmcw94(larda, time_span, rpg_radar='LIMRAD94', **kwargs):
+    """
+    Radar moments of the RPG-FMCW 94GHz spectra, processed in consecutive time chunks. Only one chunk
+    of spectra (and a few time steps of overlap) is in memory, independent of the length of time_span.
+
+    Per chunk: despeckle, noise level, de-aliasing or peak edges, ghost echo filters, despeckle and the moments,
+    as :py:func:`load_spectra_rpgfmcw94` and :py:func:`spectra2moments`. The look-back of the de-aliasing and
+    the despeckle boxes are continued over the chunk borders (see :py:class:`ChunkedDespeckle`), so the
+    concatenated moments are identical to ``spectra2moments(load_spectra_rpgfmcw94(larda, time_span, **kwargs), paraminfo, **kwargs)``.
+
+    Args:
+        larda (class larda): Initialized pyLARDA, already connected to a specific campaign
+        time_span (list): Starting and ending time point in datetime format.
+        rpg_radar (string): name of the radar system as defined in the toml file
+        **chunk_size (int): number of time steps read at once, default 512
+        **max_memory (int): memory budget in bytes, sets the chunk_size (see :py:data:`CHUNK_MEMORY_FACTOR`)
+        **paraminfo (dict): information from params_[campaign].toml, default: parameters of rpg_radar
+        **kwargs: options of :py:func:`load_spectra_rpgfmcw94` (except heave_correction) and :py:func:`spectra2moments`
+
+    Yields:
+        container_dict (dict): larda containers Ze, VEL, sw, skew, kurt of the next time steps
+    """
+    chunk_size = int(kwargs['chunk_size']) if 'chunk_size' in kwargs else 512
+    paraminfo = kwargs['paraminfo'] if 'paraminfo' in kwargs else larda.connectors[rpg_radar].system_info['params']
+    std_above_mean_noise = float(kwargs['noise_factor']) if 'noise_factor' in kwargs else 6.0
+    dealiasing_flag = kwargs['dealiasing'] if 'dealiasing' in kwargs else False
+    vel_offsets = kwargs['dealiasing_vel'] if 'dealiasing_vel' in kwargs else None
+    ghost_echo_1 = kwargs['ghost_echo_1'] if 'ghost_echo_1' in kwargs else True
+    ghost_echo_2 = kwargs['ghost_echo_2'] if 'ghost_echo_2' in kwargs else True
+    do_despeckle2D = kwargs['despeckle2D'] if 'despeckle2D' in kwargs else True
+    do_despeckle = kwargs['despeckle'] if 'despeckle' in kwargs else False
+    estimate_noise = True if std_above_mean_noise > 0.0 else False
+
+    if 'heave_correction' in kwargs and kwargs['heave_correction']:
+        raise ValueError('heave correction needs the whole time span, use load_spectra_rpgfmcw94')
+
+    settings = chirp_settings(larda, rpg_radar, time_span)
+    settings['NF'] = std_above_mean_noise
+    if 'max_memory' in kwargs:
+        factor = CHUNK_MEMORY_FACTOR_DEALIASING if dealiasing_flag else CHUNK_MEMORY_FACTOR
+        bytes_per_ts = settings['rg_offsets'][-1] * int(np.max(settings['DoppLen'])) * 4 * factor
+        chunk_size = max(int(kwargs['max_memory']) // bytes_per_ts, 1)
+        logger.info(f'chunk size {chunk_size} for a memory budget of {int(kwargs["max_memory"]) / 1024**2:.0f} MB')
+    SLv = larda.read(rpg_radar, "SLv", time_span, [0, 'max'])
+    n_ts = SLv['ts'].size
+    read_noise = estimate_noise
+
+    despeckle_before = ChunkedDespeckle()
+    despeckle_after = ChunkedDespeckle()
+    despeckle_moments = ChunkedDespeckle()
+    previous_peaks = None
+
+    def as_data(rows):
+        data = {**settings, 'n_ts': rows['var'].shape[0], 'n_rg': rows['var'].shape[1], 'n_vel': rows['var'].shape[2]}
+        data['VHSpec'] = {**spec, 'ts': rows['ts'], 'var': rows['var'], 'mask': rows['mask'], 'rg_offsets': settings['rg_offsets']}
+        data['SLv'] = {**SLv, 'ts': rows['ts'], 'var': rows['SLv']}
+        if 'Vnoise' in rows: data['Vnoise'] = {'var': rows['Vnoise']}
+        return data
+
+    def despeckle_spectra(stream, rows, last):
+        rows = stream(rows, None if rows is None else np.all(rows['var'] <= 0.0, axis=2), last)
+        if rows is not None:
+            mask_3D = np.broadcast_to(rows.pop('dspkl_mask')[:, :, np.newaxis], rows['var'].shape)
+            rows['var'][mask_3D], rows['mask'][mask_3D] = -999.0, True
+        return rows
+
+    for it_b in range(0, n_ts, chunk_size):
+        tstart = time.time()
+        it_e = min(it_b + chunk_size, n_ts)
+        last = it_e == n_ts
+
+        # the first time step after begin is read, the begin is placed between the time steps
+        begin = time_span[0] if it_b == 0 else ts_to_dt(0.5 * (SLv['ts'][it_b - 1] + SLv['ts'][it_b]))
+        chunk_span = [begin, ts_to_dt(SLv['ts'][it_e - 1])]
+        spec = larda.read(rpg_radar, 'VSpec', chunk_span, [0, 'max'])
+        if not np.array_equal(spec['ts'], SLv['ts'][it_b:it_e]):
+            raise ValueError(f'time steps of VSpec and SLv differ in {chunk_span}')
+
+        rows = {'ts': spec['ts'], 'var': spec['var'], 'mask': spec['mask'], 'SLv': SLv['var'][it_b:it_e]}
+        if read_noise:
+            try:
+                rows['Vnoise'] = larda.read(rpg_radar, 'VNoisePow', chunk_span, [0, 'max'])['var']
+            except KeyError:
+                logger.info('KeyError: Noise Power variable not found, calculate noise level...')
+                read_noise = False
+        logger.info(f'Loading spectra {it_b}:{it_e} of {n_ts}, elapsed time = {seconds_to_fstring(time.time() - tstart)} [min:sec]')
+
+        # the despeckle streams hold back the last time steps until the next chunk
+        if do_despeckle2D:
+            rows = despeckle_spectra(despeckle_before, rows, last)
+
+        if rows is not None:
+            data = as_data(rows)
+            if estimate_noise:
+                idx_peak_matrix = _noise_and_peak_edges(data, dealiasing_flag, vel_offsets=vel_offsets, previous_peaks=previous_peaks)
+                if dealiasing_flag:
+                    previous_peaks = idx_peak_matrix if previous_peaks is None else np.concatenate([previous_peaks, idx_peak_matrix])[-2:]
+            _remove_ghost_echos(data, ghost_echo_1, ghost_echo_2)
+            rows = {'ts': rows['ts'], 'var': data['VHSpec']['var'], 'mask': data['VHSpec']['mask'], 'SLv': rows['SLv'], 'edges': data['edges']}
+            vel = data['vel']
+
+        if do_despeckle2D:
+            rows = despeckle_spectra(despeckle_after, rows, last)
+
+        moments, invalid_mask = None, None
+        if rows is not None:
+            data = as_data(rows)
+            data.update({'vel': vel, 'edges': rows['edges']})
+            container_dict = spectra2moments(data, paraminfo)
+            moments = {'ts': rows['ts'], **{mom: container['var'] for mom, container in container_dict.items()}}
+            invalid_mask = container_dict['Ze']['mask']
+
+        if do_despeckle:
+            moments = despeckle_moments(moments, invalid_mask, last)
+            if moments is not None:
+                invalid_mask = moments.pop('dspkl_mask')
+                for mom in container_dict.keys():
+                    moments[mom][invalid_mask] = -999.0
+
+        if moments is not None:
+            yield {mom: {**container, 'ts': moments['ts'], 'var': moments[mom], 'mask': invalid_mask} for mom, container in container_dict.items()}
+
+
+def spectra2moments_chunked(larda, time_span, rpg_radar='LIMRAD94', **kwargs):
+    """
+    Radar moments of the RPG-FMCW 94GHz spectra, processed in time chunks with :py:func:`iter_moments_rpgfmcw94`
+    to keep the memory bounded for long time spans.
+
+    Args:
+        larda (class larda): Initialized pyLARDA, already connected to a specific campaign
+        time_span (list): Starting and ending time point in datetime format.
+        rpg_radar (string): name of the radar system as defined in the toml file
+        **nc_file (string): append the moments of every chunk to this NetCDF file (see :py:func:`pyLARDA.NcWrite.append_simple_nc`)
+            instead of returning them
+        **kwargs: options of :py:func:`iter_moments_rpgfmcw94`
+
+    Returns:
+        container_dict (dict): dictionary of larda containers, including larda container for Ze, VEL, sw, skew, kurt,
+        or the file name if nc_file is given
+    """
+    nc_file = kwargs['nc_file'] if 'nc_file' in kwargs else None
+
+    if nc_file is not None:
+        import pyLARDA.NcWrite as NcWrite
+        for ichunk, moments in enumerate(iter_moments_rpgfmcw94(larda, time_span, rpg_radar, **kwargs)):
+            NcWrite.append_simple_nc(nc_file, list(moments.values()), create=ichunk == 0)
+        return nc_file
+
+    chunks = list(iter_moments_rpgfmcw94(larda, time_span, rpg_radar, **kwargs))
+    invalid_mask = np.concatenate([chunk['Ze']['mask'] for chunk in chunks])
+    container_dict = {}
+    for mom, container in chunks[0].items():
+        container_dict[mom] = {**container, 'ts': np.concatenate([chunk[mom]['ts'] for chunk in chunks]),
+                               'var': np.concatenate([chunk[mom]['var'] for chunk in chunks]), 'mask': invalid_mask}
+    return container_dict
+
+
 def heave_correction(moments, date, path_to_seapath="/projekt2/remsens/data_new/site-campaign/rv_meteor-eurec4a/instruments/RV-METEOR_DSHIP",
                      mean_hr=True, only_heave=False, use_cross_product=True, transform_to_earth=True, add=False):
     """Correct mean Doppler velocity for heave motion of ship (RV-Meteor)
@@ -992,6 +1348,7 @@ def heave_correction(moments, date, path_to_seapath="/projekt2/remsens/data_new/
         return new_vel, heave_corr, seapath_out
 
 
+@instrumentation.timed('heave_correction')
 def heave_correction_spectra(data, date,
                              path_to_seapath="/projekt2/remsens/data_new/site-campaign/rv_meteor-eurec4a/instruments/RV-METEOR_DSHIP",
                              mean_hr=True, only_heave=False, use_cross_product=True, transform_to_earth=True, add=False,
@@ -1056,7 +1413,7 @@ def heave_correction_spectra(data, date,
     # transform bin boundaries, necessary because python starts counting at 0
     rg_borders_id = rg_borders - np.array([0, 1, 1, 1])
     # setting the length of the mean doppler velocity time series for calculating time shift
-    n_ts_run = np.int(10 * 60 / 1.5)  # 10 minutes with time res of 1.5 s
+    n_ts_run = int(10 * 60 / 1.5)  # 10 minutes with time res of 1.5 s
     if version == 'ca':
         # here seapath is a xarray DataSet
         seapath = seapath.dropna('time_shifted')  # drop nans for interpolation
@@ -1638,8 +1995,8 @@ def calc_shifted_chirp_timestamps(radar_ts, radar_mdv, chirp_ts, rg_borders_id,
     time_shift_array = np.zeros((len(radar_ts), no_chirps))
     chirp_ts_shifted = chirp_ts
     # get total hours in data and then loop through each hour
-    hours = np.int(np.ceil(radar_ts.shape[0] * np.mean(np.diff(radar_ts)) / 60 / 60))
-    idx = np.int(np.floor(len(radar_ts) / hours))
+    hours = int(np.ceil(radar_ts.shape[0] * np.mean(np.diff(radar_ts)) / 60 / 60))
+    idx = int(np.floor(len(radar_ts) / hours))
     for i in range(hours):
         start_idx = i * idx
         if i < hours-1:
@@ -1716,9 +2073,9 @@ def calc_corr_matrix_claudia(radar_ts, radar_rg, rg_borders_id, chirp_ts_shifted
     no_chirps = len(chirp_ts_shifted)
     corr_matrix = np.zeros((len(radar_ts), len(radar_rg)))
     # get total hours in data and then loop through each hour
-    hours = np.int(np.ceil(radar_ts.shape[0] * np.mean(np.diff(radar_ts)) / 60 / 60))
+    hours = int(np.ceil(radar_ts.shape[0] * np.mean(np.diff(radar_ts)) / 60 / 60))
     # divide the day in equal hourly slices
-    idx = np.int(np.floor(len(radar_ts) / hours))
+    idx = int(np.floor(len(radar_ts) / hours))
     for i in range(hours):
         start_idx = i * idx
         if i < hours-1:
@@ -1749,7 +2106,7 @@ def get_range_bin_borders(no_chirps, container):
         ndarray with chirp borders including 0 range_bins
 
     """
-    range_bins = np.zeros(no_chirps + 1, dtype=np.int)  # needs to be length 4 to include all +1 chirp borders
+    range_bins = np.zeros(no_chirps + 1, dtype=int)  # needs to be length 4 to include all +1 chirp borders
     for i in range(no_chirps):
         try:
             range_bins[i + 1] = range_bins[i] + container[f'C{i + 1}Range']['var'][0].shape
@@ -1968,198 +2325,149 @@ def find_closest_timesteps(df, ts):
     return df_closest
 
 
-def spectra2sldr(ZSpec, paraminfo, **kwargs):
-    """
-    This routine calculates the
+def _software_normalisation(sw_version):
+    """normalisation of the combined spectrum of the STSR mode: 4 from the software version 5.40 on, 2 before"""
+    sw_version = float(sw_version)
+    # accept 5.4 as well as 540
+    if sw_version < 100:
+        sw_version *= 100
+    return 4.0 if sw_version >= 540 else 2.0
 
-    Args:
-        ZSpec (dict): list containing the dicts for each chrip of RPG-FMCW Doppler cloud radar
-        paraminfo (dict): information from params_[campaign].toml for the system LIMRAD94
 
-    Returns:
-        container_dict (dict): dictionary of larda containers, including larda container for Ze, VEL, sw, skew, kurt
+def _in_file_units(container, index):
+    """spectra of the time steps index as stored in the file, undoing the 'divideby2' var_conversion of the reader"""
+    factor = 2.0 if container['paraminfo'].get('var_conversion') == 'divideby2' else 1.0
+    return container['var'][index].astype(np.float64) * factor
 
-    """
 
-    tstart = time.time()  # initialize variables:
+def _stsr_spectra(ZSpec, index, norm, snr_min):
+    """
+    Signal spectra of the vertical and horizontal channel and the covariance spectrum of the time steps index,
+    from the spectra measured in the STSR mode (simultaneous transmission, simultaneous reception).
+    Spectral lines with a SNR below snr_min in one of the channels, or a fill value in one of the spectra, are set to 0.
 
-    tspec_lin = ZSpec['VHSpec']['var'].copy()  # - ZSpec[iC]['mean']
-    hspec_lin = ZSpec['HSpec']['var'].copy()
-    tspec_lin = ZSpec['thresh']['var'].copy()  # - ZSpec[iC]['mean']
-    vspec_lin = tspec_lin - hspec_lin
-    Revhspec_lin = ZSpec['ReVHSpec']['var'].copy()
-    Imvhspec_lin = ZSpec['ImVHSpec']['var'].copy()
-    vspec_lin[vspec_lin <= 0.0] = np.nan
-    hspec_lin[hspec_lin <= 0.0] = np.nan
-    Revhspec_lin[Revhspec_lin <= 0.0] = np.nan
-    Imvhspec_lin[Imvhspec_lin <= 0.0] = np.nan
+    Returns:
+        Zv, Zh, covariance (complex) and the signal mask, dimensions: (time, range, vel), and the spectral noise power
+        per spectral line Nv, Nh, dimensions: (time, range, 1)
+    """
+    Zt, Zh, Zre, Zim = [_in_file_units(ZSpec[key], index) for key in ['VHSpec', 'HSpec', 'ReVHSpec', 'ImVHSpec']]
+    Zv = norm * Zt - Zh - 2.0 * Zre
+    del Zt
 
-    vhspec_complex = Revhspec_lin + Imvhspec_lin * 1j
+    # the integrated noise is distributed over the spectral lines of the chirp
+    n_fft = np.repeat(np.asarray(ZSpec['DoppLen'][:ZSpec['n_ch']], dtype=np.float64), np.diff(ZSpec['rg_offsets'][:ZSpec['n_ch'] + 1]))
+    Nv = (ZSpec['Vnoise']['var'][index] / n_fft)[:, :, np.newaxis]
+    Nh = (ZSpec['Hnoise']['var'][index] / n_fft)[:, :, np.newaxis]
 
-    for j in range(vspec_lin.shape[0]):
+    fill = ZSpec['VHSpec']['mask'][index] | ZSpec['HSpec']['mask'][index] | ZSpec['ReVHSpec']['mask'][index] | ZSpec['ImVHSpec']['mask'][index]
+    with np.errstate(invalid='ignore'):
+        signal = (Zv >= snr_min * Nv) & (Zh >= snr_min * Nh) & (Nv > 0.0) & (Nh > 0.0) & ~fill
 
-        Zt = tspec_lin[j, :, :]
-        Zh = hspec_lin[j, :, :]
-        Zre = Revhspec_lin[j, :, :]
-        Zim = Imvhspec_lin[j, :, :]
+    Zv[~signal], Zh[~signal], Zre[~signal], Zim[~signal] = 0.0, 0.0, 0.0, 0.0
+    return Zv, Zh, Zre + 1j * Zim, signal, Nv, Nh
 
 
+@instrumentation.timed('sldr')
+def spectra2sldr(ZSpec, paraminfo, **kwargs):
     """
-        ZT  = double(ncread(filename,['C' num2str(i) 'VSpec']));    % In the case of STSR mode, this variable contains the combined reflectivity spectrum
-        ZH  = double(ncread(filename,['C' num2str(i) 'HSpec']));    % Spectrum in the horizontal channel
-        ZRE = double(ncread(filename,['C' num2str(i) 'ReVHSpec'])); % Real part of the covariance spectrum
-        ZIM = double(ncread(filename,['C' num2str(i) 'ImVHSpec'])); % Imaginary part of the covariance spectrum
-        
-        NV  = double(ncread(filename,['C' num2str(i) 'VNoisePow'])); % Integrated noise in the vertical channel
-        NH  = double(ncread(filename,['C' num2str(i) 'HNoisePow'])); % Integrated noise in the horizontal channel
-        
-        SLDR = zeros(size(ZT,2),size(ZT,3)) * NaN;
-        
-        for j = 1:size(ZT,3)
-            
-            Zt = ZT(:,:,j);
-            Zh = ZH(:,:,j);
-            Zre = ZRE(:,:,j);
-            Zim = ZIM(:,:,j);
-            
-            Nv = NV(:,j);
-            Nh = NH(:,j);
-        
-            if SW >= 540
-                Zv = 4 * Zt - Zh - 2 * Zre; % Starting from the software version 5.40, the combined spectrum is normalized by 4
-            else
-                Zv = 2 * Zt - Zh - 2 * Zre; % In the previous versions the combined spectrum was normalized by 2
-            end
-
-            clear Zt
-
-            Nfft = size(Zv,1); % Number of spectral lines
-
-            Nv = Nv/Nfft; % Spectral noise power in each spectral bin
-            Nh = Nh/Nfft; % Spectral noise power in each spectral bin
-
-            Nv = repmat(Nv,1,Nfft)';
-            Nh = repmat(Nh,1,Nfft)';
-
-            % Method based on Galletti et al. 2011
-
-            % According to (10) in the Galletti's paper the depolarization
-            % ratio can be calculated from the degree of polarization in the 
-            % case of the reflectio symmetry. In the case of vertical
-            % observations the assumption is typically reasonable. The
-            % assumption is sometimes not applicable in thunderstorm clouds,
-            % where electrical activity can allign ice particles in a certain
-            % direction. This formula also cannot be used at lower elevation
-            % angles since liquid and  ice particles tend to orient
-            % horizontally.
-
-            % In the STSR radars the degree of polarization is related to the
-            % correlation coefficient (see eq. (12) in Galletti and Zrnic 2012).
-            % In the case of vertical observations ZDR is most of the time 1
-            % (or 0 dB). In this case the degree of polarization is equal to
-            % the correlation coefficient. Thus, in the eq. (10) in the
-            % Galletti's paper we can use the correlation coefficient instead
-            % of the degree of polarization.
-
-            % The main disadvantage of this method is that it does not take into
-            % account that we have signal + noise and we are only interested in
-            % the depolarization ratio of the signal. In other words, if SNR is
-            % low, there will be strong apparent depolarization caused by noise.
-            % In order to avoid this, I have introduced the threshold of 30 dB.
-            % The 30 dB threshold has been chosen because this is typically the
-            % level of polarimetric coupling in the good antennas of
-            % meteorological radars.
-
-            SNRv = Zv./Nv;
-            SNRh = Zh./Nh;
-
-            % Spectral lines with less than 30 dB SNR are replaced by NaN
-            % values
-            k = find((SNRv < 1000) | (SNRh < 1000));
-
-            Zv(k) = NaN;
-            Zh(k) = NaN;
-            Zre(k) = NaN;
-            Zim(k) = NaN;
-
-            Nv(k) = NaN;
-            Nh(k) = NaN;
-
-            clear k SNRv SNRh
-
-            Zv = squeeze(nansum(Zv));
-            Zh = squeeze(nansum(Zh));
-            Zre = squeeze(nansum(Zre));
-            Zim = squeeze(nansum(Zim));
-
-            Nv = squeeze(nansum(Nv));
-            Nh = squeeze(nansum(Nh));
-            
-            k = find((Zv ==0) | (Zh == 0));
-            
-            Zv(k) = NaN;
-            Zh(k) = NaN;
-            Zre(k) = NaN;
-            Zim(k) = NaN;
-
-            rhv  = abs(Zre+1i*Zim)./sqrt((Zv+Nv).*(Zh+Nh)); % Correlation coefficient for each spectral bin
-            sldr = ((1-rhv)./(1+rhv));                      % Depolarization ratio according to (10)
-
-            sldr = single(sldr);
-            
-            SLDR(:,j) = sldr';
-            
-    """
+    This routine calculates the slanted linear depolarization ratio SLDR and the correlation coefficient from the
+    spectra of the RPG-FMCW 94GHz radar in the STSR mode, see :py:func:`spectra2polarimetry`.
 
-    logger.info(f'Polarimetric spectra & products calculated, elapsed time = {seconds_to_fstring(time.time() - tstart)} [min:sec]')
+    Args:
+        ZSpec (dict): spectra of the RPG-FMCW 94GHz radar, loaded with load_spectra_rpgfmcw94(..., add_horizontal_channel=True)
+        paraminfo (dict): information from params_[campaign].toml for the system LIMRAD94
+        **kwargs: options of :py:func:`spectra2polarimetry`
 
-    return pol
+    Returns:
+        container_dict (dict): dictionary of larda containers, including larda container for ldr (SLDR) and RHV
 
+    """
+    pol = spectra2polarimetry(ZSpec, paraminfo, **{**kwargs, 'spectral': False})
+    return {key: pol[key] for key in ['ldr', 'RHV']}
 
 
+@instrumentation.timed('polarimetry')
 def spectra2polarimetry(ZSpec, paraminfo, **kwargs):
     """
-    This routine calculates the
+    This routine calculates polarimetric variables from the spectra of the RPG-FMCW 94GHz radar in the STSR mode:
+    the slanted linear depolarization ratio (SLDR), the correlation coefficient, the differential reflectivity and the
+    differential phase, integrated over the spectrum and per spectral line.
+
+    The SLDR follows Galletti et al. (2011), eq. (10), with the degree of polarization replaced by the correlation
+    coefficient (Galletti and Zrnic, 2012, eq. (12)), which requires reflection symmetry (vertical pointing) and a
+    ZDR of about 0 dB. The signal of the vertical channel is Zv = 4 Zt - Zh - 2 Re(Zvh) from the combined spectrum Zt,
+    normalised by 2 instead of 4 before the software version 5.40. Spectral lines with a SNR below the threshold in one
+    of the channels are excluded, otherwise the noise causes a strong apparent depolarization. The integrated noise
+    powers of each chirp are spread over its number of spectral lines.
 
     Args:
-        ZSpec (dict): list containing the dicts for each chrip of RPG-FMCW Doppler cloud radar
+        ZSpec (dict): spectra of the RPG-FMCW 94GHz radar, loaded with load_spectra_rpgfmcw94(..., add_horizontal_channel=True),
+            with the spectra VHSpec, HSpec, ReVHSpec, ImVHSpec and the noise powers Vnoise, Hnoise
         paraminfo (dict): information from params_[campaign].toml for the system LIMRAD94
+        **sw_version (float): software version of the radar, e.g. 540 or 5.40, default 540
+        **snr_threshold (float): minimum SNR of a spectral line in both channels in dB, default 30
+            (typical polarimetric coupling of a good antenna)
+        **spectral (bool): also return the polarimetric spectra as (time, range, vel) containers ldr_s, RHV_s, ZDR_s,
+            PhiDP_s, default False. They need 17 bytes per spectral line (4 float32 spectra and the mask), about
+            60 GB for one day of 3 s profiles with 500 range gates and 256 spectral lines.
 
     Returns:
-        container_dict (dict): dictionary of larda containers, including larda container for Ze, VEL, sw, skew, kurt
+        container_dict (dict): dictionary of larda containers, including larda container for ldr (SLDR), RHV, ZDR and PhiDP
+        (linear, PhiDP in rad)
 
     """
+    norm = _software_normalisation(kwargs['sw_version'] if 'sw_version' in kwargs else 540)
+    snr_min = 10 ** ((kwargs['snr_threshold'] if 'snr_threshold' in kwargs else 30.0) / 10.0)
+    spectral = kwargs['spectral'] if 'spectral' in kwargs else False
 
-    tstart = time.time()  # initialize variables:
+    for key in ['HSpec', 'ReVHSpec', 'ImVHSpec', 'Vnoise', 'Hnoise']:
+        if key not in ZSpec:
+            raise ValueError(f'{key} missing, load the spectra with add_horizontal_channel=True and the noise power')
+    if ZSpec['HSpec']['var'].shape != ZSpec['VHSpec']['var'].shape:
+        raise ValueError('the horizontal and combined spectra differ in shape (de-aliased spectra are not supported)')
 
-    vspec_lin = ZSpec['VHSpec']['var'].copy()  # - ZSpec[iC]['mean']
-    hspec_lin = ZSpec['HSpec']['var'].copy()
-    vspec_lin = vspec_lin - hspec_lin
-    Revhspec_lin = ZSpec['ReVHSpec']['var'].copy()
-    Imvhspec_lin = ZSpec['ImVHSpec']['var'].copy()
-    vspec_lin[vspec_lin <= 0.0] = np.nan
-    hspec_lin[hspec_lin <= 0.0] = np.nan
-    Revhspec_lin[Revhspec_lin <= 0.0] = np.nan
-    Imvhspec_lin[Imvhspec_lin <= 0.0] = np.nan
-
-    vhspec_complex = Revhspec_lin + Imvhspec_lin * 1j
-
-    ZDR = vspec_lin / hspec_lin
-    rhoVH = np.absolute(vhspec_complex) / (vspec_lin * hspec_lin)
-    phiDP = np.angle(vhspec_complex)
-    tmp1 = vspec_lin + hspec_lin - 2 * Revhspec_lin
-    tmp2 = vspec_lin + hspec_lin + 2 * Revhspec_lin
-    SLDR = tmp1 / tmp2
-    CORR = np.absolute(vspec_lin - hspec_lin + 2j * Imvhspec_lin) / np.sqrt(tmp1 * tmp2)
-
-    pol = {'ZDR_s': ZDR, 'ZDR': np.nansum(ZDR, axis=2),
-           'rhoVH_s': rhoVH, 'rhoVH': np.nansum(rhoVH, axis=2),
-           'phiDP_s': phiDP, 'phiDP': np.nansum(phiDP, axis=2),
-           'ldr_s': SLDR, 'ldr': np.nansum(SLDR, axis=2),
-           'CORR_s': CORR, 'CORR': np.nansum(CORR, axis=2)
-           }
+    tstart = time.time()
+    n_ts, n_rg, n_vel = ZSpec['VHSpec']['var'].shape
+    integrated = {key: np.full((n_ts, n_rg), -999.0) for key in ['ldr', 'RHV', 'ZDR', 'PhiDP']}
+    invalid_mask = np.full((n_ts, n_rg), True)
+    if spectral:
+        spectra = {key: np.full((n_ts, n_rg, n_vel), -999.0, dtype=np.float32) for key in ['ldr', 'RHV', 'ZDR', 'PhiDP']}
+        spectra_mask = np.full((n_ts, n_rg, n_vel), True)
+
+    # blocks of time steps, to limit the memory of the temporary arrays
+    block = max(POLARIMETRY_BLOCK_SIZE // (n_rg * n_vel), 1)
+    for it in range(0, n_ts, block):
+        index = slice(it, min(it + block, n_ts))
+        Zv, Zh, cov, signal, Nv, Nh = _stsr_spectra(ZSpec, index, norm, snr_min)
+
+        n_lines = signal.sum(axis=2)
+        Zv_int, Zh_int, cov_int = Zv.sum(axis=2), Zh.sum(axis=2), cov.sum(axis=2)
+        valid = n_lines > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rhv = np.abs(cov_int) / np.sqrt((Zv_int + Nv[:, :, 0] * n_lines) * (Zh_int + Nh[:, :, 0] * n_lines))
+            values = {'ldr': (1.0 - rhv) / (1.0 + rhv), 'RHV': rhv, 'ZDR': Zh_int / Zv_int,
+                      'PhiDP': np.mod(np.angle(cov_int), 2 * np.pi)}
+        for key, value in values.items():
+            integrated[key][index][valid] = value[valid]
+        invalid_mask[index] = ~valid
+
+        if spectral:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                rhv = np.abs(cov) / np.sqrt((Zv + Nv) * (Zh + Nh))
+                values = {'ldr': (1.0 - rhv) / (1.0 + rhv), 'RHV': rhv, 'ZDR': Zh / Zv, 'PhiDP': np.mod(np.angle(cov), 2 * np.pi)}
+            for key, value in values.items():
+                spectra[key][index][signal] = value[signal]
+            spectra_mask[index] = ~signal
+
+    # the units of the LV1 variables are read from the file
+    paraminfo = {key: {'var_unit': '-', **paraminfo[key]} for key in integrated}
+    container_dict = {key: make_container_from_spectra([ZSpec], integrated[key], paraminfo[key], invalid_mask, 'VHSpec') for key in integrated}
+    if spectral:
+        for key in spectra:
+            container = make_container_from_spectra([ZSpec], spectra[key], paraminfo[key], spectra_mask, 'VHSpec')
+            container.update({'dimlabel': ['time', 'range', 'vel'], 'vel': ZSpec['VHSpec']['vel'], 'name': f'{key}_s'})
+            container_dict[f'{key}_s'] = container
 
     logger.info(f'Polarimetric spectra & products calculated, elapsed time = {seconds_to_fstring(time.time() - tstart)} [min:sec]')
 
-    return pol
-
+    return container_dict
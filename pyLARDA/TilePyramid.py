@@ -0,0 +1,333 @@
+#!/usr/bin/python3
+
+"""
+Multi-resolution pyramid of time averaged time-height tiles.
+
+Each level of the pyramid has a fixed time resolution (e.g. 1 day, 1 h, 5 min).
+A level is split into tiles of ``BINS_PER_TILE`` time bins, which are aligned to
+the unix epoch, so the tile index of a timestamp is simply ``ts // (res*BINS_PER_TILE)``.
+The finest level is read from the raw files of the connector, the coarser levels
+are aggregated from the tiles of the next finer level. Only tiles touched by new
+or modified files are rebuilt.
+
+Layout on disk:
+
+.. code::
+
+    <tile_dir>/<system>/<param>/manifest.json
+    <tile_dir>/<system>/<param>/<res>/<tile_index>.npz
+
+"""
+
+import os
+import json
+import datetime
+import functools
+import logging
+
+import numpy as np
+
+import pyLARDA.helpers as h
+import pyLARDA.Transformations as Transf
+import pyLARDA.Connector as Connector
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEVELS = [86400, 3600, 300]
+BINS_PER_TILE = 256
+DATEstrfmt = "%Y%m%d-%H%M%S"
+
+
+def get_tile_dir(info_dict, camp_name):
+    """directory of the tiles of a campaign
+
+    either ``tiledump`` from the campaigns.toml or ``<connectordump>/<camp_name>/tiles``
+    """
+    if 'tiledump' in info_dict:
+        return os.path.join(info_dict['tiledump'], camp_name)
+    return os.path.join(info_dict['connectordump'], camp_name, 'tiles')
+
+
+def tile_span(res):
+    """time span of a tile in seconds"""
+    return res * BINS_PER_TILE
+
+
+def tile_index(ts, res):
+    """index of the tile containing the unix timestamp ts"""
+    return int(ts // tile_span(res))
+
+
+def tile_interval(idx, res):
+    """begin and end of a tile as unix timestamps"""
+    return idx * tile_span(res), (idx + 1) * tile_span(res)
+
+
+def check_levels(levels):
+    """sort levels from coarse to fine and check that they nest
+
+    Returns:
+        sorted list of resolutions in seconds
+    """
+    levels = sorted([int(l) for l in levels], reverse=True)
+    for coarse, fine in zip(levels[:-1], levels[1:]):
+        if coarse % fine != 0:
+            raise ValueError(f"tile levels do not nest: {coarse} is not a multiple of {fine}")
+    return levels
+
+
+def _pyramid_dir(tile_dir, system, param):
+    return os.path.join(tile_dir, system, param)
+
+
+def _tile_file(tile_dir, system, param, res, idx):
+    return os.path.join(_pyramid_dir(tile_dir, system, param), str(res), f"{idx}.npz")
+
+
+def load_manifest(tile_dir, system, param):
+    """load the manifest of a pyramid, an empty dict if not built yet"""
+    fname = os.path.join(_pyramid_dir(tile_dir, system, param), 'manifest.json')
+    if not os.path.isfile(fname):
+        return {}
+    with open(fname) as f:
+        return json.load(f)
+
+
+def save_manifest(tile_dir, system, param, manifest):
+    """write the manifest atomically"""
+    fname = os.path.join(_pyramid_dir(tile_dir, system, param), 'manifest.json')
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    with open(fname + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(fname + '.tmp', fname)
+
+
+def save_tile(tile_dir, system, param, res, idx, tile):
+    """store a tile as compressed npz (float32 mean and the number of valid values)"""
+    fname = _tile_file(tile_dir, system, param, res, idx)
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    with open(fname + '.tmp', 'wb') as f:
+        np.savez_compressed(
+            f, ts=tile['ts'], rg=tile['rg'],
+            var=tile['var'].astype(np.float32),
+            count=tile['count'].astype(np.uint32))
+    os.replace(fname + '.tmp', fname)
+
+
+def remove_tile(tile_dir, system, param, res, idx):
+    """delete a tile, e.g. when its files disappeared"""
+    fname = _tile_file(tile_dir, system, param, res, idx)
+    if os.path.isfile(fname):
+        os.remove(fname)
+
+
+def load_tile(tile_dir, system, param, res, idx, manifest=None):
+    """load a single tile as larda data container
+
+    Args:
+        tile_dir: directory of the campaigns' tiles
+        system (str): system identifier
+        param (str): parameter
+        res (int): time resolution of the level in seconds
+        idx (int): tile index
+        manifest (dict, optional): already loaded manifest
+
+    Returns:
+        data_container with the additional key ``count``, None if the tile does not exist
+    """
+    fname = _tile_file(tile_dir, system, param, res, idx)
+    if not os.path.isfile(fname):
+        return None
+    if manifest is None:
+        manifest = load_manifest(tile_dir, system, param)
+
+    with np.load(fname) as npz:
+        tile = {k: npz[k] for k in ['ts', 'rg', 'var', 'count']}
+    tile.update({
+        'dimlabel': ['time', 'range'],
+        'mask': (tile['count'] == 0) | ~np.isfinite(tile['var']),
+        'system': system, 'name': param,
+        'filename': fname,
+        'tile': {'res': res, 'index': idx, 'interval': list(tile_interval(idx, res))},
+    })
+    tile.update(manifest.get('meta', {}))
+    return tile
+
+
+def _build_finest(larda, system, param, res, idx, intervals):
+    """read the raw data of a tile interval and average it
+
+    Args:
+        intervals: ``[begin, end]`` unix timestamps of the files of the parameter
+
+    Returns:
+        tile and metadata, ``None, {}`` if there is no data in the interval
+    """
+    t0, t1 = tile_interval(idx, res)
+    # the reader excludes a profile exactly at the begin, profiles outside are dropped by average_time
+    begin, end = h.ts_to_dt(t0) - datetime.timedelta(seconds=1), h.ts_to_dt(t1)
+    # same rule as the file selection of the connector, which asserts on an empty list
+    if not any(f_b < t1 and f_e > t0 - 1 for f_b, f_e in intervals):
+        logger.debug(f"no files for tile {system} {param} {res} {idx}")
+        return None, {}
+
+    conn = larda.connectors[system]
+    load_data = Connector.setupreader(conn.system_info['params'][param])
+    # the reader returns None for a file without profiles in the interval
+    parts = [part for part in (load_data(f, [begin, end], [0, 'max']) for f in conn.get_filelist(param, [begin, end]))
+             if part is not None]
+    if not parts:
+        logger.debug(f"no data for tile {system} {param} {res} {idx}")
+        return None, {}
+    data = functools.reduce(Transf.join, parts)
+    if data['dimlabel'] != ['time', 'range']:
+        raise ValueError(f"tiles only work for time-height parameters, {system} {param} is {data['dimlabel']}")
+
+    tile = Transf.average_time(data, res, t0=t0, n_bins=BINS_PER_TILE)
+    meta = {k: data[k] for k in ['rg_unit', 'var_unit', 'var_lims', 'colormap', 'plot_varconverter'] if k in data}
+    return tile, meta
+
+
+def _build_coarser(tile_dir, system, param, res, idx, finer_res):
+    """aggregate a tile from the tiles of the next finer level"""
+    t0, t1 = tile_interval(idx, res)
+    sums, counts, rg = None, None, None
+    for fine_idx in range(tile_index(t0, finer_res), tile_index(t1 - 1, finer_res) + 1):
+        fname = _tile_file(tile_dir, system, param, finer_res, fine_idx)
+        if not os.path.isfile(fname):
+            continue
+        with np.load(fname) as npz:
+            fine = {k: npz[k] for k in ['ts', 'rg', 'var', 'count']}
+        if rg is None:
+            rg = fine['rg']
+            sums = np.zeros((BINS_PER_TILE, rg.shape[0]))
+            counts = np.zeros((BINS_PER_TILE, rg.shape[0]), dtype=np.int64)
+        elif fine['rg'].shape != rg.shape or not np.allclose(fine['rg'], rg):
+            # range grid changed in between, use the nearest range gate
+            sel = np.abs(fine['rg'][np.newaxis, :] - rg[:, np.newaxis]).argmin(axis=1)
+            fine['var'], fine['count'] = fine['var'][:, sel], fine['count'][:, sel]
+        s, c = Transf.rebin_time(
+            fine['ts'], fine['var'].astype(np.float64) * fine['count'], fine['count'],
+            t0, res, BINS_PER_TILE)
+        sums += s
+        counts += c
+
+    if rg is None:
+        return None
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = np.where(counts > 0, sums / counts, 0.)
+    return {'ts': t0 + (np.arange(BINS_PER_TILE) + 0.5) * res, 'rg': rg, 'var': var, 'count': counts}
+
+
+def build_pyramid(larda, system, param, tile_dir, levels=None, rebuild=False):
+    """build or incrementally update the tile pyramid of a time-height parameter
+
+    Files of the connector are compared against the manifest (by modification time),
+    only tiles covering new, changed or removed files are rebuilt. Tiles without any
+    data left are deleted.
+
+    Args:
+        larda: larda object connected to the campaign
+        system (str): system identifier
+        param (str): parameter
+        tile_dir: directory of the campaigns' tiles, see :py:func:`get_tile_dir`
+        levels (list, optional): time resolutions in seconds, default ``DEFAULT_LEVELS``
+        rebuild (bool, optional): ignore the manifest and rebuild all tiles
+
+    Returns:
+        dict with the rebuilt tile indices per level
+    """
+    conn = larda.connectors[system]
+    which_path = conn.system_info['params'][param]['which_path']
+    base_dir = conn.system_info['path'][which_path]['base_dir']
+
+    manifest = {} if rebuild else load_manifest(tile_dir, system, param)
+    levels = check_levels(levels if levels is not None else manifest.get('levels', DEFAULT_LEVELS))
+    if manifest.get('levels', levels) != levels or manifest.get('bins_per_tile', BINS_PER_TILE) != BINS_PER_TILE:
+        logger.warning(f"tile levels of {system} {param} changed, rebuilding")
+        manifest = {}
+
+    known_files = manifest.get('files', {})
+    known_intervals = manifest.get('intervals', {})
+    tiles = {int(k): set(v) for k, v in manifest.get('tiles', {}).items()}
+    current_files = {}
+    current_intervals = {}
+    dirty = set()
+    finest = levels[-1]
+
+    def mark_dirty(ts_b, ts_e):
+        dirty.update(range(tile_index(ts_b, finest), tile_index(ts_e, finest) + 1))
+
+    for (f_b, f_e), f in conn.filehandler[which_path]:
+        try:
+            mtime = os.path.getmtime(base_dir + f)
+        except OSError:
+            continue
+        ts_b = h.dt_to_ts(datetime.datetime.strptime(f_b, DATEstrfmt))
+        ts_e = h.dt_to_ts(datetime.datetime.strptime(f_e, DATEstrfmt))
+        current_files[f] = mtime
+        current_intervals[f] = [ts_b, ts_e]
+        if known_files.get(f) == mtime:
+            continue
+        mark_dirty(ts_b, ts_e)
+        if f in known_intervals:
+            # the file may have covered a different interval before
+            mark_dirty(*known_intervals[f])
+
+    removed = known_files.keys() - current_files.keys()
+    for f in removed:
+        if f in known_intervals:
+            mark_dirty(*known_intervals[f])
+        else:
+            # manifest without intervals, check all tiles
+            dirty.update(tiles.get(finest, set()))
+    logger.info(f"tiles {system} {param}: {len(current_files) - len(known_files.keys() & current_files.keys())} "
+                f"new files, {len(removed)} removed files, {len(dirty)} tiles at {finest}s to update")
+
+    meta = manifest.get('meta', {})
+    rebuilt = {}
+    finer_res = None
+    for res in levels[::-1]:
+        if finer_res is not None:
+            dirty = {tile_index(tile_interval(i, finer_res)[0], res) for i in dirty}
+        for idx in sorted(dirty):
+            if finer_res is None:
+                tile, tile_meta = _build_finest(larda, system, param, res, idx, current_intervals.values())
+                meta.update(tile_meta)
+            else:
+                tile = _build_coarser(tile_dir, system, param, res, idx, finer_res)
+            if tile is None or not np.any(tile['count']):
+                # no data left in the interval
+                remove_tile(tile_dir, system, param, res, idx)
+                tiles.get(res, set()).discard(idx)
+                continue
+            save_tile(tile_dir, system, param, res, idx, tile)
+            tiles.setdefault(res, set()).add(idx)
+        rebuilt[res] = sorted(dirty)
+        finer_res = res
+
+    manifest = {
+        'levels': levels, 'bins_per_tile': BINS_PER_TILE,
+        'files': current_files,
+        'intervals': current_intervals,
+        'tiles': {str(k): sorted(v) for k, v in tiles.items()},
+        'meta': meta,
+        'updated': h.dt_to_ts(datetime.datetime.utcnow()),
+    }
+    save_manifest(tile_dir, system, param, manifest)
+    return rebuilt
+
+
+def pyramid_info(tile_dir, system, param):
+    """summary of a pyramid (levels, tile span and available tiles per level) for http transfer"""
+    manifest = load_manifest(tile_dir, system, param)
+    if not manifest:
+        return {}
+    return {
+        'levels': manifest['levels'],
+        'bins_per_tile': manifest['bins_per_tile'],
+        'tile_span': {str(res): tile_span(res) for res in manifest['levels']},
+        'tiles': manifest['tiles'],
+        'meta': manifest['meta'],
+        'updated': manifest['updated'],
+    }
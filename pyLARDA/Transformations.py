@@ -1,34 +1,38 @@
 #!/usr/bin/python3
 
+from __future__ import annotations
 
 import datetime
 import sys
 
-import matplotlib
 import numpy as np
 from copy import copy
 
 # import itertools
 
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import make_axes_locatable
-from matplotlib import ticker
-# scientific python imports
-import scipy.interpolate
-from scipy import stats
-import xarray as xr
-import pandas as pd
 from typing import List, Set, Dict, Tuple, Optional
 
-import pyLARDA.VIS_Colormaps as VIS_Colormaps
 import pyLARDA.helpers as h
+import pyLARDA.instrumentation as instrumentation
+
+# the plotting and scientific python stack is imported on first use,
+# joining or slicing containers does not need it
+matplotlib = h.lazy_import('matplotlib', 'matplotlib.pyplot', 'matplotlib.dates', before=h.use_agg_backend)
+plt = h.lazy_import('matplotlib.pyplot', before=h.use_agg_backend)
+axes_grid1 = h.lazy_import('mpl_toolkits.axes_grid1', before=h.use_agg_backend)
+ticker = h.lazy_import('matplotlib.ticker')
+scipy = h.lazy_import('scipy', 'scipy.interpolate')
+stats = h.lazy_import('scipy.stats')
+xr = h.lazy_import('xarray')
+pd = h.lazy_import('pandas')
+VIS_Colormaps = h.lazy_import('pyLARDA.VIS_Colormaps', before=h.use_agg_backend)
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+@instrumentation.timed('join')
 def join(datadict1, datadict2):
     """join two data containers in time domain
     
@@ -245,22 +249,22 @@ def interpolate2d(data, mask_thres=0.1, **kwargs):
     if method == 'rectbivar':
         kx, ky = 1, 1
         interp_var = scipy.interpolate.RectBivariateSpline(data['ts'], data['rg'], var, kx=kx, ky=ky)
-        interp_mask = scipy.interpolate.RectBivariateSpline(data['ts'], data['rg'], data['mask'].astype(np.float), kx=kx, ky=ky)
+        interp_mask = scipy.interpolate.RectBivariateSpline(data['ts'], data['rg'], data['mask'].astype(float), kx=kx, ky=ky)
         args_to_pass["grid"] = True
     elif method == 'linear1d':
         points = np.array(list(zip(np.repeat(data['ts'], len(data['rg'])), np.tile(data['rg'], len(data['ts'])))))
         interp_var = scipy.interpolate.LinearNDInterpolator(points, var.flatten(), fill_value=-999.0)
-        interp_mask = scipy.interpolate.LinearNDInterpolator(points, (data['mask'].flatten()).astype(np.float))
+        interp_mask = scipy.interpolate.LinearNDInterpolator(points, (data['mask'].flatten()).astype(float))
     elif method == 'linear':
         ts = np.reshape(np.repeat(data['ts'], len(data['rg'])), var.shape)
         rg = np.reshape(np.tile(data['rg'], len(data['ts'])), var.shape)
         nanmask = np.isfinite(var)
         interp_var = scipy.interpolate.interp2d(ts[nanmask], rg[nanmask], var[nanmask])
-        interp_mask = scipy.interpolate.interp2d(data['ts'], data['rg'], np.transpose(data['mask']).astype(np.float))
+        interp_mask = scipy.interpolate.interp2d(data['ts'], data['rg'], np.transpose(data['mask']).astype(float))
     elif method == 'nearest':
         points = np.array(list(zip(np.repeat(data['ts'], len(data['rg'])), np.tile(data['rg'], len(data['ts'])))))
         interp_var = scipy.interpolate.NearestNDInterpolator(points, var.flatten())
-        interp_mask = scipy.interpolate.NearestNDInterpolator(points, (data['mask'].flatten()).astype(np.float))
+        interp_mask = scipy.interpolate.NearestNDInterpolator(points, (data['mask'].flatten()).astype(float))
     else:
         raise ValueError('Unknown Interpolation Method', method)
 
@@ -294,6 +298,75 @@ def interpolate2d(data, mask_thres=0.1, **kwargs):
     return interp_data
 
 
+def rebin_time(ts, sums, counts, t0, bin_width, n_bins):
+    """sum up already weighted values onto a regular time grid
+
+    ``ts`` has to be sorted, values outside of ``[t0, t0 + n_bins*bin_width)``
+    are dropped
+
+    Args:
+        ts (np.array): timestamps of the input, dim = (n_time,)
+        sums (np.array): sum of the values per timestamp, dim = (n_time, ...)
+        counts (np.array): number of valid values per timestamp, same shape as sums
+        t0 (float): begin of the first bin
+        bin_width (float): width of a bin in seconds
+        n_bins (int): number of bins
+
+    Returns:
+        (sums, counts) on the new grid, dim = (n_bins, ...)
+    """
+    new_sums = np.zeros((n_bins,) + sums.shape[1:], dtype=np.float64)
+    new_counts = np.zeros((n_bins,) + sums.shape[1:], dtype=np.int64)
+
+    ibin = np.floor((ts - t0) / bin_width).astype(np.int64)
+    valid = (ibin >= 0) & (ibin < n_bins)
+    if not np.any(valid):
+        return new_sums, new_counts
+    ibin, sums, counts = ibin[valid], sums[valid], counts[valid]
+
+    # ts is sorted, so each bin is a contiguous block and reduceat can be used
+    starts = np.concatenate(([0], np.nonzero(np.diff(ibin))[0] + 1))
+    new_sums[ibin[starts]] = np.add.reduceat(sums, starts, axis=0)
+    new_counts[ibin[starts]] = np.add.reduceat(counts, starts, axis=0)
+    return new_sums, new_counts
+
+
+def average_time(data, bin_width, t0=None, n_bins=None):
+    """average a time or timeheight data container onto a regular time grid
+
+    Masked values are ignored, bins without any valid value are masked.
+    The number of valid values per bin is kept in ``count``.
+
+    Args:
+        data: larda data container with dimlabel ``['time']`` or ``['time', 'range']``
+        bin_width (float): width of the time bins in seconds
+        t0 (float, optional): begin of the first bin, default first timestamp floored to bin_width
+        n_bins (int, optional): number of bins, default up to the last timestamp
+
+    Returns:
+        data_container with ``ts`` at the bin centers
+    """
+    assert data['dimlabel'] in [['time'], ['time', 'range']], \
+        "average_time only works for time and timeheight containers, not {}".format(data['dimlabel'])
+    if t0 is None:
+        t0 = np.floor(data['ts'][0] / bin_width) * bin_width
+    if n_bins is None:
+        n_bins = int(np.floor((data['ts'][-1] - t0) / bin_width)) + 1
+
+    valid = ~data['mask'] & np.isfinite(data['var'])
+    sums, counts = rebin_time(
+        data['ts'], np.where(valid, data['var'], 0.), valid.astype(np.int64), t0, bin_width, n_bins)
+
+    new_data = {**data}
+    new_data['ts'] = t0 + (np.arange(n_bins) + 0.5) * bin_width
+    with np.errstate(invalid='ignore', divide='ignore'):
+        new_data['var'] = sums / counts
+    new_data['mask'] = counts == 0
+    new_data['var'][new_data['mask']] = 0.
+    new_data['count'] = counts
+    return new_data
+
+
 def combine(func, datalist, keys_to_update, **kwargs):
     """apply a func to the variable
 
@@ -865,7 +938,7 @@ def plot_barbs_timeheight(u_wind, v_wind, *args, **kwargs):
         cMap.set_bad(color='grey', alpha=1.)
         norm = matplotlib.colors.BoundaryNorm(steps, cMap.N)
         cp = ax.pcolormesh(x, y, vel, vmin=0, vmax=18, cmap=cMap, norm=norm)
-        divider = make_axes_locatable(ax)
+        divider = axes_grid1.make_axes_locatable(ax)
         cax0 = divider.append_axes("right", size="3%", pad=0.5)
         c_bar = fig.colorbar(cp, cax=cax0, ax=ax, ticks=steps[::2])
         c_bar.ax.tick_params(labelsize=12)
@@ -2279,7 +2352,7 @@ def plot_spectra_cwt(data, scalesmatr, iT=0, iR=0, legend=True, **kwargs):
                    '{} UTC  at {:.2f} m ({})'.format(dT2.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3], rg2, 'MIRA'),
                    horizontalalignment='left', verticalalignment='center', transform=ax[0].transAxes)
 
-    divider0 = make_axes_locatable(ax[0])
+    divider0 = axes_grid1.make_axes_locatable(ax[0])
     cax0 = divider0.append_axes("right", size="2.5%", pad=0.05)
     cax0.axis('off')
 
@@ -2304,7 +2377,7 @@ def plot_spectra_cwt(data, scalesmatr, iT=0, iR=0, legend=True, **kwargs):
     # Set the tick labels
     # ax[1].set_yticklabels([r'$2^{1.75}$', r'$2^{2.5}$', '$2^{3.25}$', '$2^{3.75}$'])
     ax[1].set_xticklabels([])
-    divider = make_axes_locatable(ax[1])
+    divider = axes_grid1.make_axes_locatable(ax[1])
     cax = divider.append_axes("right", size="2.5%", pad=0.05)
     fig.add_axes(cax)
     cbar = fig.colorbar(img, cax=cax, orientation="vertical")
@@ -2330,7 +2403,7 @@ def plot_spectra_cwt(data, scalesmatr, iT=0, iR=0, legend=True, **kwargs):
         # Set the tick labels
         ax[2].set_yticklabels([r'$2^{1.00}$', r'$2^{1.75}$', '$2^{2.50}$', '$2^{3.75}$'])
         ax[2].set_xticklabels([])
-        divider = make_axes_locatable(ax[2])
+        divider = axes_grid1.make_axes_locatable(ax[2])
         cax = divider.append_axes("right", size="2.5%", pad=0.05)
         fig.add_axes(cax)
         cbar = fig.colorbar(img, cax=cax, orientation="vertical")
@@ -3,17 +3,21 @@
 
 import pyLARDA.Connector as Connector
 import pyLARDA.ParameterInfo as ParameterInfo
-import pyLARDA.spec2mom_limrad94 as spec2mom_limrad94
+import pyLARDA.remote_cache as remote_cache
+import pyLARDA.instrumentation as instrumentation
+import pyLARDA.helpers as h
 import datetime, os, calendar, copy, time
+import importlib
 from pathlib import Path
 import numpy as np
 import csv
 import logging
 import toml
-import requests
 import json
 import pprint
 
+requests = h.lazy_import('requests')
+
 from pyLARDA._meta import __version__, __author__, __init_text__, __default_info__
 
 ROOT_DIR = Path(__file__).resolve().parent
@@ -21,26 +25,56 @@ logger = logging.getLogger(__name__)
 
 os.environ["HDF5_USE_FILE_LOCKING"] = 'FALSE'
 
+# submodules with heavy dependencies (plotting stack, numba, scipy) are only
+# imported on first access, e.g. pyLARDA.Transformations
+LAZY_SUBMODULES = ['Transformations', 'SpectraProcessing', 'spec2mom_limrad94', 'NcReader', 'RPGReader',
+                   'peakTree', 'trace_reader', 'VIS_Colormaps', 'NcWrite', 'compiled']
+
+
+def __getattr__(name):
+    if name in LAZY_SUBMODULES:
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
 class LARDA :
     """init a new larda instance
 
     Args:
         data_source (str, optional): either ``'local'``, ``'remote'`` or ``'filepath'``
         uri: link to backend
+        cache_dir (optional): enable the local disk cache for remote data in this directory
+        cache_ttl (float, optional): seconds cached remote data is used without revalidation, default 3600
+        cache_size_mb (float, optional): size limit of the cache, default 2048
+        config_dir (optional): directory of ``campaigns.toml`` for local data, default ``$LARDA_CONFIG_DIR``
+            or ``larda-cfg`` next to the larda directory
 
     Returns:
         larda object
     """
-    def __init__(self, data_source='local', uri=None):
+    def __init__(self, data_source='local', uri=None, cache_dir=None, cache_ttl=3600, cache_size_mb=2048,
+                 config_dir=None):
         if data_source == 'local':
             self.data_source = 'local'
-            self.camp = LARDA_campaign(ROOT_DIR.parents[1] / "larda-cfg", 'campaigns.toml')
+            if config_dir is None:
+                config_dir = os.environ.get('LARDA_CONFIG_DIR', ROOT_DIR.parents[1] / "larda-cfg")
+            self.camp = LARDA_campaign(Path(config_dir), 'campaigns.toml')
             self.campaign_list = self.camp.get_campaign_list()
         elif data_source == 'remote':
             self.data_source = 'remote'
             self.uri = uri
-            resp = requests.get(self.uri + '/api/')
-            self.campaign_list = resp.json()['campaign_list']
+            # one connection pool shared by all connectors, large enough for the parallel requests
+            self.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+            self.cache = None
+            if cache_dir is not None:
+                self.cache = remote_cache.RemoteCache(
+                    cache_dir, ttl=cache_ttl, max_bytes=int(cache_size_mb*1024**2))
+            campaigns = remote_cache.cached_get(
+                self.session, self.cache, self.uri + '/api/', remote_cache.make_key(self.uri, 'api'))
+            self.campaign_list = campaigns['campaign_list']
         elif data_source == 'filepath':
             self.data_source = 'filepath'
             self.uri = ''
@@ -59,7 +93,7 @@ class LARDA :
             return self.connect_templates(*args, **kwargs)
 
 
-    def connect_local(self, camp_name, build_lists=True, filt=None):
+    def connect_local(self, camp_name, build_lists=True, filt=None, mmap_index=False):
         """built the connector list for the specified campaign (only valid systems are considered)
         the connectors are instances of the Connector.Connector Class
 
@@ -70,6 +104,7 @@ class LARDA :
             camp_name (str): name of campaign as defined in ``campaigns.toml``
             build_lists (Bool, optional): Flag to build the filelists or not (with many files this may take some time)
             filt (list, optional): Filter for name ``['system', 'MIRA']`` or insturment identifiert ``['instr_name', 'hatpro_g2_lacros']``
+            mmap_index (Bool, optional): load the filelists as compact memory-mapped index (see :py:mod:`pyLARDA.FileIndex`)
     
         """
 
@@ -120,7 +155,7 @@ class LARDA :
 
             else:
                 #load lists
-                conn.load_filehandler(self.camp.info_dict['connectordump'], camp_name)
+                conn.load_filehandler(self.camp.info_dict['connectordump'], camp_name, mmap_index=mmap_index)
             
             if system in self.camp.VALID_SYSTEMS:
                 self.connectors[system] = conn
@@ -143,15 +178,18 @@ class LARDA :
             camp_name: name of the campaign in the remote source
         """
         logger.info("connect_remote {}".format(camp_name))
-        resp = requests.get(self.uri + '/api/{}/'.format(camp_name))
-        #print(resp.json())
-        self.camp = LARDA_campaign_remote(resp.json()['config_file'])
+        campaign_info = remote_cache.cached_get(
+            self.session, self.cache, self.uri + '/api/{}/'.format(camp_name),
+            remote_cache.make_key(self.uri, 'api', camp_name))
+        #print(campaign_info)
+        self.camp = LARDA_campaign_remote(campaign_info['config_file'])
 
-        self.camp.INFO_TEXT = resp.json()['info_text']
+        self.camp.INFO_TEXT = campaign_info['info_text']
 
         self.connectors = {}
-        for k, c in resp.json()['connectors'].items():
-            self.connectors[k] = Connector.Connector_remote(camp_name, k, c, self.uri)
+        for k, c in campaign_info['connectors'].items():
+            self.connectors[k] = Connector.Connector_remote(
+                camp_name, k, c, self.uri, session=self.session, cache=self.cache)
 
         logger.warning(self.camp.INFO_TEXT)
         return self
@@ -190,10 +228,24 @@ class LARDA :
             parameter (str): choosen param
             time_interval: ``[dt, dt]`` time interval, or [dt] one time
             *further_slices: range, vel,.. ``[0, max]`` or [3000]
+            **timing (bool): add the time spent per stage as ``data['timing']``
+                (default: :py:func:`pyLARDA.instrumentation.enabled`)
+            **track_memory (bool): add the peak and retained memory per stage to the timing
 
         Returns:
             the dictionary with data
         """
+        track_memory = kwargs.pop('track_memory') if 'track_memory' in kwargs else instrumentation.memory_tracked()
+        timing = kwargs.pop('timing') if 'timing' in kwargs else instrumentation.enabled() or track_memory
+        if timing:
+            with instrumentation.recording(memory=track_memory) as recorder:
+                with instrumentation.span('read') as s:
+                    data = self.read(system, parameter, time_interval, *further_slices,
+                                     timing=False, track_memory=False, **kwargs)
+                    s.add_bytes(h.container_nbytes(data))
+            data['timing'] = recorder.report()
+            logger.debug("timing {} {}\n{}".format(system, parameter, instrumentation.format_report(data['timing'])))
+            return data
 
         if self.data_source == 'filepath':
             data = self.connectors[system].collect_path(parameter, time_interval, *further_slices, **kwargs) 
@@ -202,6 +254,27 @@ class LARDA :
 
         return data
 
+    def read_many(self, system, parameters, time_interval, *further_slices, **kwargs):
+        """read several parameters of one system at once
+
+        Args:
+            system (str): identifier for the system
+            parameters (list): choosen params
+            time_interval: ``[dt, dt]`` time interval, or [dt] one time
+            *further_slices: range, vel,.. ``[0, max]`` or [3000]
+
+        Returns:
+            dict ``{parameter: data}``
+        """
+
+        if self.data_source == 'filepath':
+            data = {p: self.connectors[system].collect_path(p, time_interval, *further_slices, **kwargs)
+                    for p in parameters}
+        else:
+            data = self.connectors[system].collect_many(parameters, time_interval, *further_slices, **kwargs)
+
+        return data
+
     def description(self, system, parameter):
         """
         Args:
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+"""
+Compilation of the numerical kernels (noise estimation, peak finding,
+despeckle, ...) with numba, cached on disk.
+
+Kernels are decorated with :py:func:`jit` instead of ``numba.jit``:
+
+.. code-block:: python
+
+    @compiled.jit(fastmath=True, warmup=lambda: [(np.ones(256),)])
+    def find_main_peak(signal):
+        ...
+
+They are compiled in nopython mode with ``cache=True``. The machine code is
+stored in ``__pycache__`` next to the module (or in ``NUMBA_CACHE_DIR`` if
+the package directory is not writable), so a new process only loads it
+instead of compiling again. Without numba, or with ``LARDA_NO_JIT=1``,
+the plain Python/NumPy function is used.
+
+Services (gunicorn workers, cron jobs) compile or load all kernels at boot
+with :py:func:`warmup`, or once after an installation with
+``python -m pyLARDA.compiled``.
+
+"""
+
+import os
+import time
+import importlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# modules defining kernels, imported by warmup()
+KERNEL_MODULES = ['pyLARDA.spec2mom_limrad94', 'pyLARDA.SpectraProcessing']
+
+_disabled = os.environ.get('LARDA_NO_JIT', '0') == '1'
+try:
+    if _disabled:
+        raise ImportError('disabled by LARDA_NO_JIT')
+    import numba
+except ImportError as e:
+    numba = None
+    logger.info(f'numba not available ({e}), using the pure python kernels')
+
+_kernels = {}
+
+
+def available():
+    """True if the kernels are compiled with numba"""
+    return numba is not None
+
+
+def jit(parallel=False, fastmath=False, warmup=None):
+    """decorator compiling a kernel in nopython mode with an on-disk cache
+
+    Args:
+        parallel (bool, optional): multi-threaded kernel (loops with :py:func:`prange`)
+        fastmath (bool, optional): allow reordering of floating point operations
+        warmup (callable, optional): returns a list of argument tuples, one per
+            signature to compile in :py:func:`warmup`
+
+    Returns:
+        the numba dispatcher, or the function itself without numba
+    """
+    def decorator(func):
+        kernel = func
+        if numba is not None:
+            kernel = numba.jit(nopython=True, cache=True, parallel=parallel, fastmath=fastmath)(func)
+        _kernels[f'{func.__module__}.{func.__name__}'] = (kernel, warmup)
+        return kernel
+    return decorator
+
+
+# parallel loop in compiled kernels, plain range in the pure python fallback
+prange = numba.prange if numba is not None else range
+
+
+def example_spectra(n_vel=256):
+    """synthetic Doppler spectra (noise and a gaussian peak) in float32 and float64 as warmup arguments"""
+    import numpy as np
+    vel = np.linspace(-1., 1., n_vel)
+    spectrum = 1e-3 * (1 + 0.1 * np.cos(np.arange(n_vel) * 2.1)) + np.exp(-vel ** 2 / 0.01)
+    return [spectrum.astype(np.float32), spectrum]
+
+
+def warmup(modules=None):
+    """compile (or load from the cache) all kernels with their warmup arguments
+
+    Args:
+        modules (list, optional): modules defining the kernels, default :py:data:`KERNEL_MODULES`
+
+    Returns:
+        dict with the seconds per kernel
+    """
+    for module in (KERNEL_MODULES if modules is None else modules):
+        importlib.import_module(module)
+
+    timing = {}
+    for name, (kernel, arguments) in _kernels.items():
+        if arguments is None or numba is None:
+            continue
+        t0 = time.perf_counter()
+        for args in arguments():
+            kernel(*args)
+        timing[name] = time.perf_counter() - t0
+        logger.debug(f'warmup {name} {timing[name]:.3f}s')
+    logger.info(f'warmup of {len(timing)} kernels took {sum(timing.values()):.2f}s')
+    return timing
+
+
+if __name__ == '__main__':
+    # the kernel modules register in pyLARDA.compiled, not in __main__
+    import pyLARDA.compiled
+    logging.basicConfig(level=logging.INFO)
+    if not pyLARDA.compiled.available():
+        print('numba not available, nothing to compile')
+    for name, seconds in pyLARDA.compiled.warmup().items():
+        print(f'{name:<60s} {seconds:7.3f}s')
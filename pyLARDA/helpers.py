@@ -1,7 +1,8 @@
 #!/usr/bin/python
 
 
-import datetime, os, copy
+import datetime, os, sys, copy
+import importlib
 import numpy as np
 import pprint as pp
 import re
@@ -16,6 +17,55 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class LazyModule:
+    """placeholder for a module, that is imported on the first attribute access
+
+    Keeps heavy dependencies (plotting stack, scipy, xarray, requests) out of
+    ``import pyLARDA``.
+
+    Args:
+        name: module to import
+        *submodules: further modules imported along (e.g. ``'scipy.interpolate'`` for ``scipy``)
+        before (callable, optional): called once before the import
+    """
+    def __init__(self, name, *submodules, before=None):
+        self.__dict__.update(_name=name, _submodules=submodules, _before=before, _module=None)
+
+    def _load(self):
+        if self._module is None:
+            if self._before is not None:
+                self._before()
+            module = importlib.import_module(self._name)
+            for submodule in self._submodules:
+                importlib.import_module(submodule)
+            self.__dict__['_module'] = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'imported' if self._module is not None else 'not imported yet'
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name, *submodules, before=None):
+    """module that is imported on first use, see :py:class:`LazyModule`
+
+    .. code-block:: python
+
+        plt = h.lazy_import('matplotlib.pyplot', before=h.use_agg_backend)
+    """
+    return LazyModule(name, *submodules, before=before)
+
+
+def use_agg_backend():
+    """select the non-interactive Agg backend, unless pyplot is already in use"""
+    import matplotlib
+    if 'matplotlib.pyplot' not in sys.modules:
+        matplotlib.use('Agg')
+
+
 def ident(x):
     return x
 
@@ -385,6 +435,7 @@ def pformat(data, verbose=False):
     string.append("var_unit    {}".format(data["var_unit"]))
     string.append("var_lims    {}".format(data["var_lims"]))
     string.append("default colormap {}".format(data["colormap"]))
+    string.append("memory      {:.1f} MB".format(container_nbytes(data)/1024**2))
     if verbose:
         string.append("filenames")
         string.append(pp.pformat(data["filename"], indent=2))
@@ -393,6 +444,26 @@ def pformat(data, verbose=False):
     return "\n".join(string)
 
 
+def container_nbytes(data):
+    """memory held by the arrays of a data container (or a dict of containers)
+
+    Args:
+        data (dict): data container
+
+    Returns:
+        number of bytes
+    """
+    nbytes = 0
+    for v in data.values():
+        if isinstance(v, np.ndarray):
+            nbytes += v.nbytes
+        elif isinstance(v, dict):
+            nbytes += container_nbytes(v)
+        elif isinstance(v, (list, tuple)):
+            nbytes += sum([e.nbytes for e in v if isinstance(e, np.ndarray)])
+    return nbytes
+
+
 def isKthBitSet(n, k):
     """
     Function to check if a certain bit of a number is set (required to analyse quality flags)
@@ -554,6 +625,17 @@ def change_dir(folder_path, **kwargs):
     logger.debug('\ncd to: {}'.format(folder_path))
 
 
+def pid_alive(pid):
+    """True if a process with this pid exists (also if it belongs to another user)"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
 def make_dir(folder_path):
     """
     This routine changes to a folder or creates it (including subfolders) if it does not exist already.
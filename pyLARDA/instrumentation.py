@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+"""
+Lightweight timing instrumentation of the read and processing pipeline.
+
+Stages are marked with spans
+
+.. code-block:: python
+
+    with instrumentation.span('open'):
+        ...
+
+or with the decorator ``@instrumentation.timed('despeckle')``. Spans are only
+measured while a :py:func:`recording` is active, otherwise they cost a single
+context variable lookup. Nested spans are reported with their path
+(``collect/file/open``).
+
+``larda.read(..., timing=True)`` (or :py:func:`enable` for all reads) adds the
+breakdown to the data container:
+
+.. code-block:: python
+
+    data['timing'] = {'read': {'seconds': 0.41, 'calls': 1, 'bytes': 0},
+                      'read/file/open': {'seconds': 0.02, 'calls': 4, 'bytes': 0}, ...}
+
+With ``track_memory=True`` (``recording(memory=True)``) the Python allocations
+(including numpy arrays) are traced with ``tracemalloc`` and every stage
+additionally reports ``peak_bytes`` (maximum above the memory at the start of
+the stage) and ``retained_bytes`` (still allocated at its end). Tracing slows
+down allocation heavy code, so it is meant for finding chunk sizes and budgets,
+not for production. Before python 3.9 (no ``tracemalloc.reset_peak``) a stage
+only sees peaks above the highest peak before the stage.
+
+.. code-block:: python
+
+    with instrumentation.recording(memory=True) as recorder:
+        spectra = SpectraProcessing.load_spectra_rpgfmcw94(larda, time_span)
+    print(instrumentation.format_report(recorder.report()))
+
+"""
+
+import os
+import time
+import tracemalloc
+import functools
+import threading
+import contextlib
+import contextvars
+import logging
+
+logger = logging.getLogger(__name__)
+
+_recorder = contextvars.ContextVar('larda_recorder', default=None)
+_path = contextvars.ContextVar('larda_span_path', default=())
+# open spans in memory mode, to pass the peak on to the enclosing span
+_open_spans = contextvars.ContextVar('larda_open_spans', default=())
+_enabled = os.environ.get('LARDA_TIMING', '0') == '1'
+_track_memory = os.environ.get('LARDA_TRACK_MEMORY', '0') == '1'
+# tracemalloc.reset_peak is new in python 3.9
+_reset_peak = getattr(tracemalloc, 'reset_peak', None)
+
+
+def enable(flag=True, memory=False):
+    """record the timing (and optionally the memory) of all ``larda.read`` calls"""
+    global _enabled, _track_memory
+    _enabled = flag
+    _track_memory = memory
+
+
+def enabled():
+    return _enabled
+
+
+def memory_tracked():
+    return _track_memory
+
+
+class Recorder:
+    """sums of time, calls and bytes per span path
+
+    Args:
+        memory (bool, optional): trace the allocations per span
+    """
+    def __init__(self, memory=False):
+        self.stages = {}
+        self.memory = memory
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, nbytes=0, peak=None, retained=None):
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = {'seconds': 0., 'calls': 0, 'bytes': 0}
+                if peak is not None:
+                    self.stages[name].update({'peak_bytes': 0, 'retained_bytes': 0})
+            stage = self.stages[name]
+            stage['seconds'] += seconds
+            stage['calls'] += 1
+            stage['bytes'] += nbytes
+            if peak is not None:
+                stage['peak_bytes'] = max(stage['peak_bytes'], peak)
+                stage['retained_bytes'] += retained
+
+    def report(self):
+        """plain dict ``{path: {'seconds', 'calls', 'bytes'}}``"""
+        with self._lock:
+            return {k: dict(v) for k, v in self.stages.items()}
+
+
+class _Span:
+    __slots__ = ('recorder', 'name', 'path', 'nbytes', '_start', '_token', '_mem_start', '_mem_token', 'mem_peak', '_peak_start')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.nbytes = 0
+
+    def __enter__(self):
+        path = _path.get() + (self.name,)
+        self._token = _path.set(path)
+        self.path = '/'.join(path)
+        if self.recorder.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            stack = _open_spans.get()
+            if stack:
+                # the peak so far belongs to the enclosing span
+                stack[-1].mem_peak = max(stack[-1].mem_peak, current, peak if peak > stack[-1]._peak_start else 0)
+            if _reset_peak is not None:
+                _reset_peak()
+                peak = current
+            # without reset_peak (python 3.8) only a peak above the one at the start is seen
+            self._mem_start, self.mem_peak, self._peak_start = current, current, peak
+            self._mem_token = _open_spans.set(stack + (self,))
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self._start
+        peak, retained = None, None
+        if self.recorder.memory:
+            current, traced_peak = tracemalloc.get_traced_memory()
+            self.mem_peak = max(self.mem_peak, current, traced_peak if traced_peak > self._peak_start else 0)
+            _open_spans.reset(self._mem_token)
+            stack = _open_spans.get()
+            if stack:
+                stack[-1].mem_peak = max(stack[-1].mem_peak, self.mem_peak)
+            peak, retained = self.mem_peak - self._mem_start, current - self._mem_start
+        self.recorder.add(self.path, seconds, self.nbytes, peak=peak, retained=retained)
+        self.nbytes = 0
+        _path.reset(self._token)
+        return False
+
+    def add_bytes(self, nbytes):
+        """account bytes (e.g. of the arrays read) to the span"""
+        self.nbytes += int(nbytes)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add_bytes(self, nbytes):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """context manager timing a stage (no-op without active recording)"""
+    recorder = _recorder.get()
+    if recorder is None:
+        return _NO_SPAN
+    return _Span(recorder, name)
+
+
+def timed(name):
+    """decorator timing every call of a function as span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _recorder.get() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def recording(memory=False):
+    """record all spans within the with block
+
+    Args:
+        memory (bool, optional): also trace the allocations (peak and retained bytes per span)
+
+    Yields:
+        :py:class:`Recorder`, use ``.report()`` after the block
+    """
+    recorder = Recorder(memory=memory)
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    token = _recorder.set(recorder)
+    path_token = _path.set(())
+    spans_token = _open_spans.set(())
+    try:
+        yield recorder
+    finally:
+        _open_spans.reset(spans_token)
+        _path.reset(path_token)
+        _recorder.reset(token)
+        if started:
+            tracemalloc.stop()
+
+
+def format_report(report):
+    """table of a :py:meth:`Recorder.report` for the log"""
+    lines = ['{:<40s} {:>9s} {:>6s} {:>10s} {:>10s} {:>10s}'.format(
+        'stage', 'seconds', 'calls', 'MB', 'peak MB', 'kept MB')]
+    for name, stage in report.items():
+        lines.append('{:<40s} {:9.3f} {:6d} {:10.1f} {:>10s} {:>10s}'.format(
+            name, stage['seconds'], stage['calls'], stage['bytes']/1024**2,
+            '{:.1f}'.format(stage['peak_bytes']/1024**2) if 'peak_bytes' in stage else '-',
+            '{:.1f}'.format(stage['retained_bytes']/1024**2) if 'retained_bytes' in stage else '-'))
+    return '\n'.join(lines)
+
+
+def in_context(func):
+    """bind func to a copy of the current context, to keep recording in worker threads"""
+    return functools.partial(contextvars.copy_context().run, func)
@@ -0,0 +1,313 @@
+#!/usr/bin/python3
+"""
+Batch processing of the LIMRAD94 spectra into daily moment files (the Cloudnet
+input) for a range of days.
+
+.. code-block:: bash
+
+    python -m pyLARDA.limrad94_to_cloudnet -c lacros_dacapo --begin 20190101 --end 20190131 \\
+        -o /data/cloudnet/limrad94 -j 4 --memory 4G
+
+The days are processed in a pool of worker processes, one process per day.
+The spectra of a day are read in time chunks sized to the memory budget of a
+worker (see :py:func:`pyLARDA.SpectraProcessing.spectra2moments_chunked`),
+and without ``-j`` only as many workers are started as budgets fit into the
+memory of the machine.
+
+The manifest ``manifest.json`` in the output directory records per day the
+status, the output file, the input files with their modification time, the
+processing options, the elapsed time and the peak memory of the worker (or
+the error). A day is skipped if it is done with the same options and the
+input files did not change since, so an interrupted run continues with the
+remaining days. ``--force`` processes all days again.
+
+"""
+
+import os
+import sys
+import json
+import time
+import datetime
+import argparse
+import resource
+import traceback
+import multiprocessing
+import logging
+
+import numpy as np
+
+import pyLARDA
+import pyLARDA.compiled as compiled
+
+logger = logging.getLogger(__name__)
+
+# variables of the LV1 files added to the moments for the Cloudnet input
+CLOUDNET_LV1_PARAMS = ['ldr', 'bt', 'rr', 'LWP', 'MaxVel', 'SurfRelHum', 'Azm', 'Elv']
+# memory of a worker that does not depend on the chunk size (interpreter, libraries, LV1 variables)
+WORKER_BASE_MEMORY = 512 * 1024**2
+
+
+def parse_size(size):
+    """memory size like ``4G``, ``500M`` or a number of bytes"""
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    size = str(size).strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def day_range(begin, end):
+    """list of the days from begin to end (both included) as YYYYMMDD strings"""
+    begin_dt = datetime.datetime.strptime(begin, '%Y%m%d')
+    end_dt = datetime.datetime.strptime(end, '%Y%m%d')
+    return [(begin_dt + datetime.timedelta(days=i)).strftime('%Y%m%d') for i in range((end_dt - begin_dt).days + 1)]
+
+
+def day_span(day):
+    """time span of a day"""
+    begin = datetime.datetime.strptime(day, '%Y%m%d')
+    return [begin, begin + datetime.timedelta(hours=23, minutes=59, seconds=59)]
+
+
+def output_file(out_dir, day, options):
+    """file name written by :py:func:`process_day`"""
+    if options['format'] == 'cloudnet':
+        # as pyLARDA.NcWrite.rpg_radar2nc
+        return os.path.join(out_dir, f'{day}-{options["site"]}-limrad94.nc')
+    return os.path.join(out_dir, f'{day}_{options["system"]}_moments.nc')
+
+
+def input_files(larda, day, options):
+    """input files of a day with their modification time, None if there are no spectra"""
+    connector = larda.connectors[options['system']]
+    params = ['VSpec'] + (CLOUDNET_LV1_PARAMS if options['format'] == 'cloudnet' else [])
+    files = {}
+    for param in params:
+        try:
+            filelist = connector.get_filelist(param, day_span(day))
+        except AssertionError:
+            if param == 'VSpec':
+                return None
+            raise
+        files.update({str(f): os.path.getmtime(f) for f in filelist})
+    return files
+
+
+def load_manifest(out_dir):
+    fname = os.path.join(out_dir, 'manifest.json')
+    if not os.path.isfile(fname):
+        return {'days': {}}
+    with open(fname) as f:
+        return json.load(f)
+
+
+def save_manifest(out_dir, manifest):
+    """write the manifest atomically"""
+    fname = os.path.join(out_dir, 'manifest.json')
+    manifest['updated'] = time.time()
+    with open(fname + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(fname + '.tmp', fname)
+
+
+def up_to_date(entry, inputs, options):
+    """True if the day in the manifest was processed with the same options and inputs"""
+    return (entry.get('status') == 'done' and entry.get('options') == options
+            and entry.get('inputs') == inputs and os.path.isfile(entry.get('output', '')))
+
+
+def _init_worker(threads):
+    # share the cores between the workers instead of numba starting one thread per core in every worker
+    if compiled.available() and threads is not None:
+        compiled.numba.set_num_threads(threads)
+
+
+def process_day(job):
+    """moments of one day, run in a worker process
+
+    Args:
+        job (dict): campaign, day, out_dir, config_dir, max_memory and the options
+
+    Returns:
+        dict with day, status (``done`` or ``failed``), output, seconds, max_rss (bytes) and error
+    """
+    import pyLARDA.SpectraProcessing as SpectraProcessing
+    import pyLARDA.NcWrite as NcWrite
+
+    options = job['options']
+    system = options['system']
+    result = {'day': job['day'], 'output': output_file(job['out_dir'], job['day'], options)}
+    t0 = time.time()
+    try:
+        larda = pyLARDA.LARDA(config_dir=job['config_dir']).connect(job['campaign'], build_lists=False)
+        time_span = day_span(job['day'])
+        processing = dict(max_memory=job['max_memory'], noise_factor=options['noise_factor'],
+                          dealiasing=options['dealiasing'], ghost_echo_1=options['ghost_echo'],
+                          ghost_echo_2=options['ghost_echo'], despeckle=options['despeckle'])
+
+        if options['format'] == 'moments':
+            SpectraProcessing.spectra2moments_chunked(larda, time_span, system, nc_file=result['output'], **processing)
+        else:
+            moments = SpectraProcessing.spectra2moments_chunked(larda, time_span, system, **processing)
+            for var in CLOUDNET_LV1_PARAMS:
+                logger.debug('loading variable from LV1 :: ' + var)
+                moments[var] = larda.read(system, var, time_span, [0, 'max'])
+            moments['ldr']['var'] = np.ma.masked_where(moments['Ze']['mask'], moments['ldr']['var'])
+            settings = SpectraProcessing.chirp_settings(larda, system, time_span)
+            moments['no_av'] = settings['no_av']
+            # start index of the chirps, counting from 1
+            moments['rg_offsets'] = np.array(settings['rg_offsets'][:-1]) + 1
+            larda_git_path = os.path.dirname(os.path.dirname(os.path.abspath(pyLARDA.__file__)))
+            NcWrite.rpg_radar2nc(moments, job['out_dir'], larda_git_path, site=options['site'], version=options['version'],
+                                 ghost_echo_1=options['ghost_echo'], ghost_echo_2=options['ghost_echo'],
+                                 despeckle=options['despeckle'], NF=options['noise_factor'])
+        result['status'] = 'done'
+    except Exception as e:
+        logger.error(f'{job["day"]} failed\n{traceback.format_exc()}')
+        result.update({'status': 'failed', 'error': f'{type(e).__name__}: {e}'})
+
+    result['seconds'] = time.time() - t0
+    # one process per day (maxtasksperchild=1), so this is the peak of this day (kilobytes on linux)
+    result['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return result
+
+
+def default_jobs(max_memory, n_days):
+    """number of workers whose memory budgets fit into the physical memory"""
+    n_cpu = os.cpu_count() or 1
+    try:
+        total_memory = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        n_cpu = min(n_cpu, max(int(0.8 * total_memory) // max_memory, 1))
+    except (ValueError, OSError, AttributeError):
+        pass
+    return max(min(n_cpu, n_days), 1)
+
+
+def run(campaign, days, out_dir, jobs=None, memory=4 * 1024**3, force=False, config_dir=None, **kwargs):
+    """process the days in a pool of workers and keep the manifest up to date
+
+    Args:
+        campaign (str): name of the campaign
+        days (list): days as YYYYMMDD strings
+        out_dir (str): directory of the output files and the manifest
+        jobs (int, optional): number of worker processes, default :py:func:`default_jobs`
+        memory (int, optional): memory budget per worker in bytes
+        force (bool, optional): process the days that are up to date as well
+        config_dir (optional): directory of the campaigns.toml, default ``$LARDA_CONFIG_DIR``
+        **system (str): radar system, default LIMRAD94
+        **format (str): ``cloudnet`` (:py:func:`pyLARDA.NcWrite.rpg_radar2nc`) or ``moments``
+            (:py:func:`pyLARDA.NcWrite.append_simple_nc`), default cloudnet
+        **site (str): site name in the Cloudnet file name, default cloudnet_stationname of the campaign
+        **version (str): Cloudnet version, ``python`` or ``matlab``, default python
+        **noise_factor (float): number of standard deviations above the mean noise, default 6.0
+        **dealiasing (bool): default False
+        **despeckle (bool): despeckle the moments, default True
+        **ghost_echo (bool): remove the precipitation and curtain ghost echos, default True
+
+    Returns:
+        dict of the manifest entries of the days, with the status ``done``, ``failed``, ``skipped`` or ``no data``
+    """
+    larda = pyLARDA.LARDA(config_dir=config_dir).connect(campaign, build_lists=False)
+    system = kwargs['system'] if 'system' in kwargs else 'LIMRAD94'
+    options = {
+        'system': system,
+        'format': kwargs['format'] if 'format' in kwargs else 'cloudnet',
+        'site': kwargs['site'] if 'site' in kwargs and kwargs['site'] else getattr(larda.camp, 'CLOUDNET_STATIONNAME', 'no-site'),
+        'version': kwargs['version'] if 'version' in kwargs else 'python',
+        'noise_factor': float(kwargs['noise_factor']) if 'noise_factor' in kwargs else 6.0,
+        'dealiasing': bool(kwargs['dealiasing']) if 'dealiasing' in kwargs else False,
+        'despeckle': bool(kwargs['despeckle']) if 'despeckle' in kwargs else True,
+        'ghost_echo': bool(kwargs['ghost_echo']) if 'ghost_echo' in kwargs else True,
+    }
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    manifest['campaign'] = campaign
+    results = {}
+
+    todo, inputs_todo = [], {}
+    for day in days:
+        entry = manifest['days'].get(day, {})
+        try:
+            inputs = input_files(larda, day, options)
+        except Exception as e:
+            results[day] = {'status': 'failed', 'error': f'{type(e).__name__}: {e}'}
+            continue
+        if inputs is None:
+            results[day] = {'status': 'no data'}
+        elif not force and up_to_date(entry, inputs, options):
+            results[day] = {**entry, 'status': 'skipped'}
+        else:
+            todo.append({'campaign': campaign, 'day': day, 'out_dir': out_dir, 'config_dir': config_dir,
+                         'max_memory': max(memory - WORKER_BASE_MEMORY, memory // 4), 'options': options})
+            inputs_todo[day] = inputs
+    logger.info(f'{len(todo)} of {len(days)} days to process')
+
+    if todo:
+        jobs = jobs if jobs else default_jobs(memory, len(todo))
+        threads = max((os.cpu_count() or 1) // jobs, 1)
+        logger.info(f'{jobs} workers with {threads} threads and {memory / 1024**2:.0f} MB each')
+        with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(threads,), maxtasksperchild=1) as pool:
+            for result in pool.imap_unordered(process_day, todo):
+                day = result.pop('day')
+                results[day] = {**result, 'inputs': inputs_todo[day], 'options': options,
+                                'finished': datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}
+                manifest['days'][day] = results[day]
+                save_manifest(out_dir, manifest)
+                logger.info(f'{day} {result["status"]} after {result["seconds"]:.1f}s')
+
+    return {day: results[day] for day in days}
+
+
+def format_report(results):
+    """table of the days returned by :py:func:`run`"""
+    lines = ['{:<10s} {:<8s} {:>9s} {:>9s}  {}'.format('day', 'status', 'seconds', 'peak MB', 'output / error')]
+    for day, entry in results.items():
+        seconds = '{:.1f}'.format(entry['seconds']) if entry['status'] in ['done', 'failed'] and 'seconds' in entry else '-'
+        peak = '{:.0f}'.format(entry['max_rss'] / 1024**2) if entry['status'] in ['done', 'failed'] and 'max_rss' in entry else '-'
+        lines.append('{:<10s} {:<8s} {:>9s} {:>9s}  {}'.format(
+            day, entry['status'], seconds, peak, entry['error'] if entry['status'] == 'failed' else entry.get('output', '')))
+    counts = {status: sum(entry['status'] == status for entry in results.values())
+              for status in ['done', 'skipped', 'failed', 'no data']}
+    lines.append(', '.join(f'{n} {status}' for status, n in counts.items()))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pyLARDA.limrad94_to_cloudnet',
+        description='''
+        Daily LIMRAD94 moments (Cloudnet input) for a range of days, processed in parallel.
+        Days that are up to date in the manifest of the output directory are skipped.'''
+    )
+    parser.add_argument('-c', '--campaign', required=True, help='campaign name')
+    parser.add_argument('--begin', required=True, help='first day, YYYYMMDD')
+    parser.add_argument('--end', help='last day, YYYYMMDD, default begin')
+    parser.add_argument('-o', '--output', required=True, help='output directory')
+    parser.add_argument('-j', '--jobs', type=int, help='number of worker processes, default: as many as memory budgets fit')
+    parser.add_argument('--memory', default='4G', help='memory budget per worker, e.g. 2G or 500M, default 4G')
+    parser.add_argument('--system', default='LIMRAD94', help='radar system, default LIMRAD94')
+    parser.add_argument('--format', choices=['cloudnet', 'moments'], default='cloudnet',
+                        help='Cloudnet input file or plain moments, default cloudnet')
+    parser.add_argument('--site', help='site in the file name, default cloudnet_stationname of the campaign')
+    parser.add_argument('--version', choices=['python', 'matlab'], default='python', help='Cloudnet version, default python')
+    parser.add_argument('--noise-factor', type=float, default=6.0, help='standard deviations above the mean noise, default 6')
+    parser.add_argument('--dealiasing', action='store_true', help='de-alias the spectra')
+    parser.add_argument('--no-despeckle', action='store_true', help='do not despeckle the moments')
+    parser.add_argument('--no-ghost-echo', action='store_true', help='keep the precipitation and curtain ghost echos')
+    parser.add_argument('--force', action='store_true', help='process the days that are up to date as well')
+    args = parser.parse_args(argv)
+
+    results = run(args.campaign, day_range(args.begin, args.end if args.end else args.begin), args.output,
+                  jobs=args.jobs, memory=parse_size(args.memory), force=args.force,
+                  system=args.system, format=args.format, site=args.site, version=args.version,
+                  noise_factor=args.noise_factor, dealiasing=args.dealiasing,
+                  despeckle=not args.no_despeckle, ghost_echo=not args.no_ghost_echo)
+    print(format_report(results))
+    return 1 if any(entry['status'] == 'failed' for entry in results.values()) else 0
+
+
+if __name__ == '__main__':
+    log = logging.getLogger('pyLARDA')
+    log.setLevel(logging.INFO)
+    log.addHandler(logging.StreamHandler())
+    sys.exit(main())
@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+"""
+Local disk cache for data loaded from a remote larda backend.
+
+Each entry is a directory with the arrays of the data container as ``.npy`` files
+(loaded memory mapped and copy-on-write) and the remaining keys plus the ETag
+reported by the backend in ``meta.msgpack``. Within the time to live an entry is
+used without asking the backend, afterwards it is revalidated with the ETag.
+If the backend is not reachable, stale entries are used anyway.
+
+"""
+
+import os
+import time
+import json
+import shutil
+import hashlib
+import logging
+import functools
+
+import numpy as np
+import msgpack
+
+import pyLARDA.helpers as h
+
+requests = h.lazy_import('requests')
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(*args, **kwargs):
+    """hash of the request parameters"""
+    key = json.dumps([[str(a) for a in args], sorted([(k, str(v)) for k, v in kwargs.items()])])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class RemoteCache:
+    """disk cache for remote data containers and json responses
+
+    Args:
+        cache_dir: directory of the cache
+        ttl (float, optional): seconds an entry is used without revalidation
+        max_bytes (int, optional): size limit, least recently used entries are removed first
+    """
+    def __init__(self, cache_dir, ttl=3600, max_bytes=2*1024**3):
+        self.cache_dir = str(cache_dir)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """load an entry
+
+        Returns:
+            (data, etag, fresh) or None if not cached
+        """
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, 'meta.msgpack'), 'rb') as f:
+                meta = msgpack.unpackb(f.read(), strict_map_key=False)
+            data = meta['data']
+            for i, path in enumerate(meta['arrays']):
+                parent = functools.reduce(dict.__getitem__, path[:-1], data)
+                parent[path[-1]] = np.load(os.path.join(entry_dir, f'{i}.npy'), mmap_mode='c')
+            # mtime of the directory marks the last use
+            os.utime(entry_dir)
+        except (OSError, ValueError, KeyError, msgpack.UnpackException) as e:
+            if os.path.exists(entry_dir):
+                logger.warning(f'removing broken cache entry {key}: {e}')
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        fresh = (time.time() - meta['validated']) < self.ttl
+        return data, meta['etag'], fresh
+
+    def put(self, key, etag, data):
+        """store a data container, a dict of data containers (or any msgpack-serializable dict)
+
+        Containers with object arrays are not cached.
+        """
+        arrays = _find_arrays(data)
+        if any([v.dtype == np.dtype('object') for v in arrays.values()]):
+            logger.info(f'not caching {key}, contains object arrays')
+            return
+        entry_dir = self._entry_dir(key)
+        tmp_dir = entry_dir + f'.tmp{os.getpid()}'
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            for i, v in enumerate(arrays.values()):
+                np.save(os.path.join(tmp_dir, f'{i}.npy'), np.asarray(v))
+            meta = {'etag': etag, 'validated': time.time(), 'arrays': [list(p) for p in arrays.keys()],
+                    'data': _without_arrays(data)}
+            with open(os.path.join(tmp_dir, 'meta.msgpack'), 'wb') as f:
+                f.write(msgpack.packb(meta))
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+        except (OSError, TypeError) as e:
+            logger.warning(f'could not cache {key}: {e}')
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        self.trim()
+
+    def revalidated(self, key):
+        """the backend confirmed the entry (304), restart the time to live"""
+        fname = os.path.join(self._entry_dir(key), 'meta.msgpack')
+        try:
+            with open(fname, 'rb') as f:
+                meta = msgpack.unpackb(f.read(), strict_map_key=False)
+            meta['validated'] = time.time()
+            with open(fname + '.tmp', 'wb') as f:
+                f.write(msgpack.packb(meta))
+            os.replace(fname + '.tmp', fname)
+        except (OSError, ValueError, msgpack.UnpackException) as e:
+            logger.warning(f'could not update cache entry {key}: {e}')
+
+    def trim(self):
+        """remove least recently used entries until the cache fits into max_bytes"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir() or '.tmp' in entry.name:
+                continue
+            size = sum([f.stat().st_size for f in os.scandir(entry.path)])
+            entries.append((entry.stat().st_mtime, size, entry.path))
+        total = sum([e[1] for e in entries])
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+
+def _find_arrays(data, path=()):
+    """numpy arrays of a (nested) dict by their key path"""
+    arrays = {}
+    for k, v in data.items():
+        if isinstance(v, np.ndarray):
+            arrays[path + (k,)] = v
+        elif isinstance(v, dict):
+            arrays.update(_find_arrays(v, path + (k,)))
+    return arrays
+
+
+def _without_arrays(data):
+    return {k: _without_arrays(v) if isinstance(v, dict) else v
+            for k, v in data.items() if not isinstance(v, np.ndarray)}
+
+
+def cached_get(session, cache, url, key, params=None, **kwargs):
+    """GET a json response through the cache (revalidated with the ETag)
+
+    Args:
+        session: requests.Session
+        cache: RemoteCache or None
+        url: url to fetch
+        key: cache key
+
+    Returns:
+        decoded json
+    """
+    if cache is None:
+        resp = session.get(url, params=params, **kwargs)
+        resp.raise_for_status()
+        return resp.json()
+
+    entry = cache.get(key)
+    if entry is not None and entry[2]:
+        return entry[0]['json']
+    headers = {'If-None-Match': entry[1]} if entry is not None and entry[1] else {}
+    try:
+        resp = session.get(url, params=params, headers=headers, **kwargs)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        if entry is None:
+            raise
+        logger.warning(f'{url} not reachable ({e}), using cached response')
+        return entry[0]['json']
+    if resp.status_code == 304 and entry is not None:
+        cache.revalidated(key)
+        return entry[0]['json']
+    resp.raise_for_status()
+    cache.put(key, resp.headers.get('ETag'), {'json': resp.json()})
+    return resp.json()
+
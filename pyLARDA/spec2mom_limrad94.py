@@ -17,9 +17,9 @@ sys.path.append('../../larda/')
 sys.path.append('.')
 
 import numpy as np
-from numba import jit
 import copy, time
 import pyLARDA.helpers as h
+import pyLARDA.compiled as compiled
 
 from datetime import timedelta
 
@@ -27,7 +27,7 @@ from datetime import timedelta
 
 import numpy as np
 
-@jit(nopython=True, fastmath=True)
+@compiled.jit(fastmath=True, warmup=lambda: [(s, 1.0, 1.0) for s in compiled.example_spectra()])
 def estimate_noise_hs74_fast(spectrum, navg=1, std_div=6.0, nnoise_min=1):
     """REFERENCE TO ARM PYART GITHUB REPO: https://github.com/ARM-DOE/pyart/blob/master/pyart/util/hildebrand_sekhon.py
 
@@ -116,7 +116,7 @@ def estimate_noise_hs74_fast(spectrum, navg=1, std_div=6.0, nnoise_min=1):
 
     return mean, threshold, var, nnoise, signal_flag, left_intersec, right_intersec
 
-@jit(nopython=True, fastmath=True)
+@compiled.jit(fastmath=True, warmup=lambda: [(s,) for s in compiled.example_spectra()])
 def estimate_noise_hs74(spectrum, navg=1.0, std_div=-1.0):
     """
     Estimate noise parameters of a Doppler spectrum.
@@ -200,7 +200,60 @@ def estimate_noise_hs74(spectrum, navg=1.0, std_div=-1.0):
     return mean, threshold, var, nnoise, signal_flag, left_intersec, right_intersec
 
 
-@jit(nopython=True)
+def _example_cubes():
+    """warmup arguments of estimate_noise_hs74_cube: 2x2 spectra cube of two chirps"""
+    return [(np.stack([s] * 4).reshape(2, 2, -1), np.ones(2), np.array([0, 1, 2]), np.zeros((2, 2), dtype=np.bool_), 6.0, 1)
+            for s in compiled.example_spectra()]
+
+
+@compiled.jit(parallel=True, fastmath=True, warmup=_example_cubes)
+def estimate_noise_hs74_cube(spectra, no_av, rg_offsets, skip, std_div=6.0, nnoise_min=1):
+    """Hildebrand & Sekhon noise estimation of all spectra of a cube in one pass,
+    the time steps are processed in parallel.
+
+    Args:
+        spectra (numpy.array): 3D Doppler spectra (time, range, velocity) in linear units, fill values as NaN
+        no_av (numpy.array): number of spectral averages (divided by the FFT points) per chirp
+        rg_offsets (numpy.array): range indices where the chirps start, last entry is the number of range gates
+        skip (numpy.array): 2D boolean (time, range), pixels that keep the default values
+        std_div (float, optional): Number of standard deviations above mean noise floor to specify the
+            signal threshold, default: threshold=mean_noise + 6*std(mean_noise)
+        nnoise_min (int, optional): Minimum number of noise samples to consider the estimation valid.
+
+    Returns:
+        tuple with the 2D (time, range) arrays mean, threshold, variance, numnoise, signal and the
+        3D bounds (time, range, 2) of the main peak, for each pixel as in :py:func:`estimate_noise_hs74_fast`
+        (skipped pixels: 0, signal True, bounds -111)
+    """
+    n_ts, n_rg, _ = spectra.shape
+    mean = np.zeros((n_ts, n_rg), dtype=np.float32)
+    threshold = np.zeros((n_ts, n_rg), dtype=np.float32)
+    variance = np.zeros((n_ts, n_rg), dtype=np.float32)
+    numnoise = np.zeros((n_ts, n_rg), dtype=np.int32)
+    signal = np.ones((n_ts, n_rg), dtype=np.bool_)
+    bounds = np.full((n_ts, n_rg, 2), -111, dtype=np.int32)
+
+    chirp = np.zeros(n_rg, dtype=np.int64)
+    for ic in range(len(rg_offsets) - 1):
+        chirp[rg_offsets[ic]:rg_offsets[ic + 1]] = ic
+
+    for iT in compiled.prange(n_ts):
+        for iR in range(n_rg):
+            if skip[iT, iR]:
+                continue
+            m, t, v, n, sig, left, right = estimate_noise_hs74_fast(spectra[iT, iR, :], no_av[chirp[iR]], std_div, nnoise_min)
+            mean[iT, iR] = m
+            threshold[iT, iR] = t
+            variance[iT, iR] = v
+            numnoise[iT, iR] = n
+            signal[iT, iR] = sig
+            bounds[iT, iR, 0] = left
+            bounds[iT, iR, 1] = right
+
+    return mean, threshold, variance, numnoise, signal, bounds
+
+
+@compiled.jit(warmup=lambda: [(s,) for s in compiled.example_spectra()])
 def find_main_peak(signal):
     idxMaxSignal = np.argmax(signal)
     thresh = np.min(signal)
@@ -265,45 +318,15 @@ def noise_estimation(data, **kwargs):
             n_r = data[ic]['rg'].size
             tstart = time.time()
 
-            # allocate numpy arrays
-            noise_est.append({'mean': np.zeros((n_t, n_r), dtype=np.float32),
-                              'threshold': np.zeros((n_t, n_r), dtype=np.float32),
-                              'variance': np.zeros((n_t, n_r), dtype=np.float32),
-                              'numnoise': np.zeros((n_t, n_r), dtype=np.int32),
-                              'signal': np.full((n_t, n_r), fill_value=True),
-                              'bounds': np.full((n_t, n_r, 2), fill_value=None)})
-
-            # gather noise level etc. for all chirps, range gates and times
-            for iT in range(n_t):
-                # it is ok to check only the first range gate here, because every signal contains at least one value below the noise floor
-                nonoise = any(np.isnan(data[ic]['var'][iT, 0, :]))
-                for iR in range(n_r):
-                    if not nonoise:
-                        mean, thresh, var, nnoise, signal, left, right = \
-                            estimate_noise_hs74_fast(data[ic]['var'][iT, iR, :], navg=data[ic]['no_av'], std_div=n_std)
-
-                        noise_est[ic]['mean'][iT, iR] = mean
-                        noise_est[ic]['variance'][iT, iR] = var
-                        noise_est[ic]['numnoise'][iT, iR] = nnoise
-                        noise_est[ic]['threshold'][iT, iR] = thresh
-                        noise_est[ic]['signal'][iT, iR] = signal
-                        noise_est[ic]['bounds'][iT, iR, :] = [left, right]
-                        #data[ic]['var'][iT, iR, data[ic]['var'][iT, iR, :] < thresh] = -999.0
-
-
-                    elif main_peak and not nonoise:
-
-                        # filter for c1 ghost echos?
-                        # sum_SaN_neg = np.count_nonzero(~np.isnan(data[ic]['var'][iT, iR, :n_dbin]))
-                        # sum_SaN_pos = np.count_nonzero(~np.isnan(data[ic]['var'][iT, iR, n_dbin:]))
-                        # if sum_SaN_neg < 10 and sum_SaN_pos < 8 and ic == 0:
-                        #    thresh, left, right = np.min(data[ic]['var'][iT, iR, :]), -222, -222
-                        #    data[ic]['var'][iT, iR, :] = np.nan
-                        # else:
-                        thresh, left, right = find_main_peak(data[ic]['var'][iT, iR, :])
-
-                        noise_est[ic]['threshold'][iT, iR] = thresh
-                        noise_est[ic]['bounds'][iT, iR, :] = [left, right]
+            # it is ok to check only the first range gate here, because every signal contains at least one value below the noise floor
+            skip = np.repeat(np.isnan(data[ic]['var'][:, 0, :]).any(axis=1)[:, np.newaxis], n_r, axis=1)
+            mean, thresh, var, nnoise, signal, bounds = estimate_noise_hs74_cube(
+                data[ic]['var'], np.array([data[ic]['no_av']], dtype=np.float64), np.array([0, n_r]), skip, std_div=n_std)
+
+            bounds = bounds.astype(object)
+            bounds[skip] = None
+            noise_est.append({'mean': mean, 'threshold': thresh, 'variance': var, 'numnoise': nnoise,
+                              'signal': signal, 'bounds': bounds})
 
             noise_est[ic]['bounds'][noise_est[ic]['bounds'] == -222] = None
             print('noise removed, chirp = {}, elapsed time = {:.3f} sec.'.format(ic + 1, time.time() - tstart))
@@ -366,39 +389,27 @@ def spectra_to_moments_rpgfmcw94(spectrum_container, **kwargs):
         velocity_bins = spectrum_container[ic]['vel']
         DoppRes = spectrum_container[ic]['DoppRes']
 
-        # if ic == 3:
-        #    mask = spectra_linear_units < h.lin2z(25.0) and
-        #    spectra_linear_units[] = spectra_linear_units
-
-        for iR in range(no_ranges):  # range dimension
-            for iT in range(no_times):  # time dimension
-                if include_noise:
-                    # type1: calculate moments just for main peak, bounded by 2 values lb and ub
-                    signal = spectra_linear_units[iT, iR, :]  # extract power spectra in chosen range
-                    velocity_bins_extr = velocity_bins  # extract velocity bins in chosen Vdop bin range
-                    Ze_lin, VEL, sw, skew, kurt = moment_calculation(signal, velocity_bins_extr, DoppRes)
-
-                else:
-                    Ze_lin, VEL, sw, skew, kurt = [np.nan] * 5
-
-                    if noise_est[ic]['signal'][iT, iR]:
-                        if main_peak:
-                            lb, rb = noise_est[ic]['bounds'][iT, iR, :]
-                            spec_no_noise = copy.deepcopy(spectra_linear_units[iT, iR, lb:rb])
-                            velocity_bins_extr = velocity_bins[lb:rb]
-                            Ze_lin, VEL, sw, skew, kurt = moment_calculation(spec_no_noise, velocity_bins_extr, DoppRes)
-                        else:
-                            spec_no_noise = copy.deepcopy(spectra_linear_units[iT, iR, :])
-                            spec_no_noise[spectra_linear_units[iT, iR, :] < noise_est[ic]['threshold'][iT, iR]] = np.nan
-                            Ze_lin, VEL, sw, skew, kurt = moment_calculation(spec_no_noise, velocity_bins, DoppRes)
-
-                iR_tot = cum_rg[ic] + iR
-
-                moments['Ze'][iR_tot, iT] = Ze_lin  # copy temporary Ze_linear variable to output variable
-                moments['VEL'][iR_tot, iT] = VEL
-                moments['sw'][iR_tot, iT] = sw
-                moments['skew'][iR_tot, iT] = skew
-                moments['kurt'][iR_tot, iT] = kurt
+        n_vel = spectra_linear_units.shape[2]
+        bounds = np.zeros((no_times, no_ranges, 2), dtype=np.int64)
+        bounds[:, :, 1] = n_vel
+        threshold = np.full((no_times, no_ranges), -np.inf, dtype=np.float32)
+        if include_noise:
+            # type1: calculate moments of the full spectra
+            use = np.ones((no_times, no_ranges), dtype=np.bool_)
+        else:
+            use = np.asarray(noise_est[ic]['signal'], dtype=np.bool_)
+            if main_peak:
+                # only the main peak, bounded by 2 values lb and ub (None: to the end of the spectrum)
+                for i in range(2):
+                    edge = noise_est[ic]['bounds'][:, :, i]
+                    known = np.not_equal(edge, None)
+                    bounds[:, :, i][known] = edge[known].astype(np.int64)
+            else:
+                threshold = np.asarray(noise_est[ic]['threshold'], dtype=np.float32)
+
+        Ze_lin, VEL, sw, skew, kurt = moments_cube(spectra_linear_units, velocity_bins, DoppRes, bounds, threshold, use)
+        for mom, values in zip(['Ze', 'VEL', 'sw', 'skew', 'kurt'], [Ze_lin, VEL, sw, skew, kurt]):
+            moments[mom][cum_rg[ic]:cum_rg[ic + 1], :] = values.T
 
         print('moments calculated, chrip = {}, elapsed time = {:.3f} sec.'.format(ic + 1, time.time() - tstart))
 
@@ -415,7 +426,7 @@ def spectra_to_moments_rpgfmcw94(spectrum_container, **kwargs):
     return moments
 
 
-@jit(nopython=True)
+@compiled.jit(warmup=lambda: [(s, 1e-2) for s in compiled.example_spectra()])
 def check_signal(spec, thresh):
     """
     This helper function checks if a spectrum contains num_cons consecutive values above the noise threshold.
@@ -441,7 +452,7 @@ def check_signal(spec, thresh):
     return False
 
 
-@jit(nopython=True, fastmath=True)
+@compiled.jit(fastmath=True, warmup=lambda: [(s, np.linspace(-9., 9., s.size), 0.07) for s in compiled.example_spectra()])
 def moment_calculation(signal, vel_bins, DoppRes):
     """
     Calculation of radar moments: reflectivity, mean Doppler velocity, spectral width,
@@ -484,85 +495,103 @@ def moment_calculation(signal, vel_bins, DoppRes):
     return Ze_lin, VEL, sw, skew, kurt
 
 
-def filter_ghost_echos_RPG94GHz_FMCW(data, **kwargs):
-    ######################################################################
-    #
-    # 2nd and 3rd chirp ghost echo filter
-    if 'clean_spectra' in kwargs and kwargs['clean_spectra']:
+def _example_moment_cubes():
+    """warmup arguments of moments_cube: 2x2 spectra cube"""
+    return [(np.stack([s] * 4).reshape(2, 2, -1), np.linspace(-9., 9., s.size), 0.07, np.full((2, 2, 2), [10, 200]),
+             np.full((2, 2), -np.inf, dtype=np.float32), np.ones((2, 2), dtype=np.bool_)) for s in compiled.example_spectra()]
 
-        sensitivity_limit = kwargs['SL'] if 'SL' in kwargs else sys.exit(
-            'Error in clean_spectra ghost echo filter :: Sensitivity Limit missing!')
-        Ze = kwargs['Ze'] if 'Ze' in kwargs else sys.exit(
-            'Error in clean_spectra ghost echo filter :: Ze values missing!')
 
-        for ichirp in [0, 1, 2]:
+@compiled.jit(parallel=True, fastmath=True, warmup=_example_moment_cubes)
+def moments_cube(spectra, vel, DoppRes, bounds, threshold, use):
+    """Radar moments of all spectra of one chirp, the time steps are processed in parallel.
 
-            # threholds for 3rd chrip ghost echo filter
-            new_ny_vel = data[ichirp]['vel'].max() - 2.5
+    Args:
+        spectra (numpy.array): 3D Doppler spectra (time, range, velocity) in linear units
+        vel (numpy.array): velocity bins of the chirp
+        DoppRes (float): Doppler resolution of the chirp
+        bounds (numpy.array): 3D integer (time, range, 2), the moments use spectra[iT, iR, lb:rb]
+        threshold (numpy.array): 2D (time, range), values below are set to NaN (-inf to keep the noise)
+        use (numpy.array): 2D boolean (time, range), pixels for which the moments are calculated
 
-            ic_Ze_max = h.z2lin(-22.5)
+    Returns:
+        3D array (5, time, range) with Ze_lin, VEL, sw, skew and kurt as in :py:func:`moment_calculation`,
+        NaN for the unused pixels
+    """
+    n_ts, n_rg, _ = spectra.shape
+    moments = np.full((5, n_ts, n_rg), np.nan)
+
+    for iT in compiled.prange(n_ts):
+        for iR in range(n_rg):
+            if not use[iT, iR]:
+                continue
+            lb, rb = bounds[iT, iR, 0], bounds[iT, iR, 1]
+            signal = spectra[iT, iR, lb:rb].copy()
+            signal[signal < threshold[iT, iR]] = np.nan
+            Ze_lin, VEL, sw, skew, kurt = moment_calculation(signal, vel[lb:rb], DoppRes)
+            moments[0, iT, iR] = Ze_lin
+            moments[1, iT, iR] = VEL
+            moments[2, iT, iR] = sw
+            moments[3, iT, iR] = skew
+            moments[4, iT, iR] = kurt
 
-            idx_left = np.argwhere(-new_ny_vel > data[ichirp]['vel']).max()
-            idx_right = np.argwhere(new_ny_vel < data[ichirp]['vel']).min()
+    return moments
 
-            Ze_lin_left = data[ichirp]['var'][:, :, :idx_left].copy()
-            Ze_lin_right = data[ichirp]['var'][:, :, idx_right:].copy()
 
-            # if noise was already removed by the RPG software, replace the ghost with -999.,
-            # if noise factor 0 was selected in the RPG software, replace the ghost by the minimum spectrum value,
-            # to avoid wrong noise estimations (to much signal would be lost otherwise),
-            idx_ts_nf0 = np.argwhere(data[ichirp]['var'][:, 0, 0] != -999.0)
+def filter_nyquist_ghosts(data):
+    """2nd and 3rd chirp ghost echo filter, replaces weak signals near the maximum unambiguous Doppler
+    velocity of each chirp in place.
 
-            if idx_ts_nf0.size > 0:
-                mask_left, mask_right = Ze_lin_left < ic_Ze_max, Ze_lin_right < ic_Ze_max
-                min_left, min_right = np.amin(Ze_lin_left, axis=2), np.amin(Ze_lin_right, axis=2)
+    Args:
+        data (list): data containers of the first three chirps, with 'var' (time, range, velocity) and 'vel'
+    """
+    for ichirp in [0, 1, 2]:
 
-                for i_bin in range(mask_left.shape[2]):
-                    Ze_lin_left[mask_left[:, :, i_bin], i_bin] = min_left[mask_left[:, :, i_bin]]
-                for i_bin in range(mask_right.shape[2]):
-                    Ze_lin_right[mask_right[:, :, i_bin], i_bin] = min_right[mask_right[:, :, i_bin]]
-            else:
-                Ze_lin_left[Ze_lin_left < ic_Ze_max] = -999.0
-                Ze_lin_right[Ze_lin_right < ic_Ze_max] = -999.0
+        # threholds for 3rd chrip ghost echo filter
+        new_ny_vel = data[ichirp]['vel'].max() - 2.5
 
-            data[ichirp]['var'][:, :, :idx_left] = Ze_lin_left.copy()
-            data[ichirp]['var'][:, :, idx_right:] = Ze_lin_right.copy()
-    ######################################################################
-    #
-    # 2nd and 3rd chirp ghost echo filter
-    if 'C2C3' in kwargs and kwargs['C2C3']:
-        for ichirp in [0, 1, 2]:
+        ic_Ze_max = h.z2lin(-22.5)
 
-            # threholds for 3rd chrip ghost echo filter
-            new_ny_vel = data[ichirp]['vel'].max() - 2.5
+        idx_left = np.argwhere(-new_ny_vel > data[ichirp]['vel']).max()
+        idx_right = np.argwhere(new_ny_vel < data[ichirp]['vel']).min()
 
-            ic_Ze_max = h.z2lin(-22.5)
+        Ze_lin_left = data[ichirp]['var'][:, :, :idx_left]
+        Ze_lin_right = data[ichirp]['var'][:, :, idx_right:]
 
-            idx_left = np.argwhere(-new_ny_vel > data[ichirp]['vel']).max()
-            idx_right = np.argwhere(new_ny_vel < data[ichirp]['vel']).min()
+        # if noise was already removed by the RPG software, replace the ghost with -999.,
+        # if noise factor 0 was selected in the RPG software, replace the ghost by the minimum spectrum value,
+        # to avoid wrong noise estimations (to much signal would be lost otherwise),
+        idx_ts_nf0 = np.argwhere(data[ichirp]['var'][:, 0, 0] != -999.0)
 
-            Ze_lin_left = data[ichirp]['var'][:, :, :idx_left].copy()
-            Ze_lin_right = data[ichirp]['var'][:, :, idx_right:].copy()
+        if idx_ts_nf0.size > 0:
+            fill_left = np.amin(Ze_lin_left, axis=2)[:, :, np.newaxis]
+            fill_right = np.amin(Ze_lin_right, axis=2)[:, :, np.newaxis]
+        else:
+            fill_left, fill_right = -999.0, -999.0
 
-            # if noise was already removed by the RPG software, replace the ghost with -999.,
-            # if noise factor 0 was selected in the RPG software, replace the ghost by the minimum spectrum value,
-            # to avoid wrong noise estimations (to much signal would be lost otherwise),
-            idx_ts_nf0 = np.argwhere(data[ichirp]['var'][:, 0, 0] != -999.0)
+        Ze_lin_left = np.where(Ze_lin_left < ic_Ze_max, fill_left, Ze_lin_left)
+        Ze_lin_right = np.where(Ze_lin_right < ic_Ze_max, fill_right, Ze_lin_right)
 
-            if idx_ts_nf0.size > 0:
-                mask_left, mask_right = Ze_lin_left < ic_Ze_max, Ze_lin_right < ic_Ze_max
-                min_left, min_right = np.amin(Ze_lin_left, axis=2), np.amin(Ze_lin_right, axis=2)
+        data[ichirp]['var'][:, :, :idx_left] = Ze_lin_left
+        data[ichirp]['var'][:, :, idx_right:] = Ze_lin_right
 
-                for i_bin in range(mask_left.shape[2]):
-                    Ze_lin_left[mask_left[:, :, i_bin], i_bin] = min_left[mask_left[:, :, i_bin]]
-                for i_bin in range(mask_right.shape[2]):
-                    Ze_lin_right[mask_right[:, :, i_bin], i_bin] = min_right[mask_right[:, :, i_bin]]
-            else:
-                Ze_lin_left[Ze_lin_left < ic_Ze_max] = -999.0
-                Ze_lin_right[Ze_lin_right < ic_Ze_max] = -999.0
 
-            data[ichirp]['var'][:, :, :idx_left] = Ze_lin_left.copy()
-            data[ichirp]['var'][:, :, idx_right:] = Ze_lin_right.copy()
+def filter_ghost_echos_RPG94GHz_FMCW(data, **kwargs):
+    ######################################################################
+    #
+    # 2nd and 3rd chirp ghost echo filter
+    if 'clean_spectra' in kwargs and kwargs['clean_spectra']:
+
+        sensitivity_limit = kwargs['SL'] if 'SL' in kwargs else sys.exit(
+            'Error in clean_spectra ghost echo filter :: Sensitivity Limit missing!')
+        Ze = kwargs['Ze'] if 'Ze' in kwargs else sys.exit(
+            'Error in clean_spectra ghost echo filter :: Ze values missing!')
+
+        filter_nyquist_ghosts(data)
+    ######################################################################
+    #
+    # 2nd and 3rd chirp ghost echo filter
+    if 'C2C3' in kwargs and kwargs['C2C3']:
+        filter_nyquist_ghosts(data)
 
     ######################################################################
     #
@@ -585,11 +614,7 @@ def filter_ghost_echos_RPG94GHz_FMCW(data, **kwargs):
         ts_to_mask = np.argwhere(h.lin2z(sum_over_heightC2) > C2_Ze_threshold)[:, 0]
 
         m1 = invalid_mask[:rg_offsets[1], :].copy()
-        for idx_ts in ts_to_mask:
-            m1[:, idx_ts] = data['Ze'][:rg_offsets[1], idx_ts] < sens_lim
-            # a = data['Ze'][:rg_offsets[1], idx_ts] < sens_lim
-            # b = data['VEL'][:rg_offsets[1], idx_ts] < -0.5
-            # m1[:, idx_ts] = a == b
+        m1[:, ts_to_mask] = data['Ze'][:rg_offsets[1], ts_to_mask] < sens_lim[:, np.newaxis]
 
         invalid_mask[:rg_offsets[1], :] = m1.copy()
 
@@ -599,38 +624,64 @@ def filter_ghost_echos_RPG94GHz_FMCW(data, **kwargs):
         return invalid_mask
 
 
-@jit(nopython=True, fastmath=True)
-def despeckle(mask, min_percentage):
+@compiled.jit(warmup=lambda: [(np.zeros((32, 32), dtype=np.int64), 80.), (np.zeros((32, 32), dtype=np.bool_), 80.)])
+def despeckle(mask, min_percentage, window=5):
     """
     SPECKLEFILTER:
         Remove small patches (speckle) from any given mask by checking 5x5 box
         around each pixel, more than half of the points in the box need to be 1
         to keep the 1 at current pixel
 
+    The pixels are processed in order and set in place, later boxes contain the pixels set before.
+    The box sums are updated from running column sums, so the filter is linear in the number of pixels.
+    See :py:func:`despeckle_box` for the order independent variant.
+
     Args:
-        mask (numpy.array, integer): mask where 1 = an invalid/fill value and 0 = a data point [height x time]
+        mask (numpy.array, integer or bool): mask where 1 = an invalid/fill value and 0 = a data point [height x time]
         min_percentage (float): minimum percentage of neighbours that need to be signal above noise
+        window (int, optional): edge length of the box, default 5
 
     Return:
         mask ... speckle-filtered matrix of 0 and 1 that represents (cloud) mask [height x time]
 
     """
 
-    WSIZE = 5  # 5x5 window
-    n_bins = WSIZE*WSIZE
-    min_bins = int(min_percentage/100 * n_bins)
-    shift = int(WSIZE / 2)
+    n_bins = window * window
+    min_bins = int(min_percentage / 100 * n_bins)
+    shift = int(window / 2)
     n_rg, n_ts = mask.shape
+    if n_rg <= window or n_ts <= window:
+        return mask
 
-    for iR in range(n_rg - WSIZE):
-        for iT in range(n_ts - WSIZE):
-            if mask[iR, iT] == 1 and np.sum(mask[iR:iR + WSIZE, iT:iT + WSIZE]) > min_bins:
+    # sums over the rows iR..iR+window-1 of each column
+    colsum = np.zeros(n_ts, dtype=np.int64)
+    for iR in range(window):
+        for iT in range(n_ts):
+            colsum[iT] += int(mask[iR, iT])
+
+    for iR in range(n_rg - window):
+        if iR > 0:
+            for iT in range(n_ts):
+                colsum[iT] += int(mask[iR + window - 1, iT]) - int(mask[iR - 1, iT])
+
+        box = 0
+        for iT in range(window):
+            box += colsum[iT]
+
+        for iT in range(n_ts - window):
+            if iT > 0:
+                box += colsum[iT + window - 1] - colsum[iT - 1]
+            if mask[iR, iT] == 1 and box > min_bins and mask[iR + shift, iT + shift] != 1:
+                delta = 1 - int(mask[iR + shift, iT + shift])
                 mask[iR + shift, iT + shift] = 1
+                colsum[iT + shift] += delta
+                box += delta
 
     return mask
 
-@jit(nopython=True, fastmath=True)
-def despeckle3d(mask, min_percentage):
+
+@compiled.jit(warmup=lambda: [(np.zeros((16, 16, 16), dtype=np.int64), 80.)])
+def despeckle3d(mask, min_percentage, window=5):
     """
     SPECKLEFILTER
 
@@ -648,11 +699,14 @@ def despeckle3d(mask, min_percentage):
     Args:
         mask         ... mask where 1 = an invalid/fill value and 0 = a data point [height x time]
         nr_neighbors ... number of neighbors of pixel that have to be 1 in order to keep pixel value as 1
+        window       ... edge length of the box, default 5
 
 
     Return:
         mask2 ... speckle-filtered matrix of 0 and 1 that represents (cloud) mask [height x time]
 
+    Like :py:func:`despeckle` in place and order dependent, with running plane, column and box sums.
+
     example of a proggi using this function:
     % % % filter out speckles of liq (this is done later in the Shupe 2007 algorithm)
     % % nr_neighbors = 15;  % number of neighbors of pixel (in a 5x5 matrix; i.e., 25pxl) that have to be 1 in order to keep pixel value as 1 in "speckleFilter.m" (orig=12)
@@ -660,25 +714,95 @@ def despeckle3d(mask, min_percentage):
     20 neighbors in 5x5 matrix means 80%
     """
 
-    window_size = 5  # 5x5x5 window
-    n_bins = window_size*window_size*window_size
-    min_bins = int(min_percentage/100 * n_bins)
-    shift = int(window_size / 2)
-    n_rg, n_ts, n_vel = np.array(mask.shape) - window_size
-
-    for iR in range(n_rg):
+    n_bins = window * window * window
+    min_bins = int(min_percentage / 100 * n_bins)
+    shift = int(window / 2)
+    n_rg, n_ts, n_vel = mask.shape
+    if n_rg <= window or n_ts <= window or n_vel <= window:
+        return mask
+
+    # sums over the range gates iR..iR+window-1, and of those over the time steps iT..iT+window-1
+    plane = np.zeros((n_ts, n_vel), dtype=np.int64)
+    col = np.zeros(n_vel, dtype=np.int64)
+    for iR in range(window):
         for iT in range(n_ts):
             for iB in range(n_vel):
-                if mask[iR, iT, iB] == 1:
-                    # selecting window of 5x5 pixels
-                    window = mask[iR:iR + window_size, iT:iT + window_size, iB:iB + window_size]
+                plane[iT, iB] += int(mask[iR, iT, iB])
 
-                    # if more than n_neighbours pixel in the window are fill values, remove the pixel in the middle
-                    if np.sum(window) > min_bins:
-                        mask[iR + shift, iT + shift, iB + shift] = 1
+    for iR in range(n_rg - window):
+        if iR > 0:
+            for iT in range(n_ts):
+                for iB in range(n_vel):
+                    plane[iT, iB] += int(mask[iR + window - 1, iT, iB]) - int(mask[iR - 1, iT, iB])
+
+        col[:] = 0
+        for iT in range(window):
+            for iB in range(n_vel):
+                col[iB] += plane[iT, iB]
+
+        for iT in range(n_ts - window):
+            if iT > 0:
+                for iB in range(n_vel):
+                    col[iB] += plane[iT + window - 1, iB] - plane[iT - 1, iB]
+
+            box = 0
+            for iB in range(window):
+                box += col[iB]
+
+            for iB in range(n_vel - window):
+                if iB > 0:
+                    box += col[iB + window - 1] - col[iB - 1]
+                # if more than n_neighbours pixel in the window are fill values, remove the pixel in the middle
+                if mask[iR, iT, iB] == 1 and box > min_bins and mask[iR + shift, iT + shift, iB + shift] != 1:
+                    delta = 1 - int(mask[iR + shift, iT + shift, iB + shift])
+                    mask[iR + shift, iT + shift, iB + shift] = 1
+                    plane[iT + shift, iB + shift] += delta
+                    col[iB + shift] += delta
+                    box += delta
 
     return mask
 
+
+def despeckle_box(mask, min_percentage, window=5):
+    """Order independent variant of :py:func:`despeckle` and :py:func:`despeckle3d` for 2D or 3D masks.
+
+    All boxes are evaluated on the input mask (box sums from a summed-area table), pixels set by
+    the filter do not count for the other boxes. The result therefore differs slightly from the
+    in place filters, but does not depend on the processing order.
+
+    Args:
+        mask (numpy.array, integer or bool): mask where 1 = an invalid/fill value and 0 = a data point
+        min_percentage (float): minimum percentage of neighbours that need to be signal above noise
+        window (int, optional): edge length of the box, default 5
+
+    Returns:
+        new mask of the same type
+    """
+    mask = np.asarray(mask)
+    min_bins = int(min_percentage / 100 * window ** mask.ndim)
+    shift = int(window / 2)
+    if any(n <= window for n in mask.shape):
+        return mask.copy()
+
+    # summed-area table with a leading zero in every dimension
+    table = np.pad(mask.astype(np.int64), [(1, 0)] * mask.ndim)
+    for axis in range(mask.ndim):
+        table = np.cumsum(table, axis=axis)
+
+    # box sums for the box starts 0 .. n - window - 1 (as in the in place filters), inclusion-exclusion of the corners
+    n_box = [n - window for n in mask.shape]
+    box = np.zeros(n_box, dtype=np.int64)
+    for corner in np.ndindex(*[2] * mask.ndim):
+        index = tuple(slice(window, window + n) if c else slice(0, n) for c, n in zip(corner, n_box))
+        box += (-1) ** (mask.ndim - sum(corner)) * table[index]
+
+    starts = tuple(slice(0, n) for n in n_box)
+    centers = tuple(slice(shift, shift + n) for n in n_box)
+    new_mask = mask.copy()
+    new_mask[centers][(mask[starts] == 1) & (box > min_bins)] = 1
+    return new_mask
+
+
 def make_container_from_spectra(spectra_all_chirps, values, paraminfo, invalid_mask):
     """
     This routine will generate a larda container from calculated moments from spectra.
@@ -11,9 +11,9 @@ import pyLARDA.helpers as h
 import pyLARDA.Transformations as Transf
 import pyLARDA.NcReader as NcReader
 
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+# plotting stack only on first use
+matplotlib = h.lazy_import('matplotlib', 'matplotlib.pyplot', before=h.use_agg_backend)
+plt = h.lazy_import('matplotlib.pyplot', before=h.use_agg_backend)
 
 import logging
 logger = logging.getLogger(__name__)
@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+"""
+Binary encoding of data containers for the transfer between backend and remote client.
+
+Instead of nested lists, the arrays are sent as compressed raw buffers. The codec
+is negotiated: the client sends the codecs it supports (``codecs=zstd,lz4,gzip``),
+the backend uses the first one it supports as well. zstd and lz4 are optional
+(packages ``zstandard`` and ``lz4``), gzip is always available.
+
+For quicklooks the variable can additionally be reduced in precision:
+
+- ``precision=float16``
+- ``precision=int16`` quantised with scale and offset (65533 steps between min and max),
+  in dB for linear reflectivities and ratios (see :py:func:`logarithmic`), fill values are kept
+
+"""
+
+import gzip
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CODECS = {'gzip': (lambda b: gzip.compress(b, compresslevel=4), gzip.decompress)}
+
+try:
+    import lz4.frame
+    CODECS['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+except ImportError:
+    pass
+
+try:
+    import zstandard
+    CODECS['zstd'] = (lambda b: zstandard.ZstdCompressor(level=3).compress(b),
+                      lambda b: zstandard.ZstdDecompressor().decompress(b))
+except ImportError:
+    pass
+
+PREFERENCE = ['zstd', 'lz4', 'gzip']
+PRECISIONS = ['float16', 'int16']
+ARRAY_KEYS = ['ts', 'rg', 'vel', 'var', 'mask', 'vel_ch2', 'vel_ch3', 'aux', 'count']
+# only the variable may be transferred lossy, coordinates are always exact
+LOSSY_KEYS = ['var']
+# int16 quantisation: three codes are reserved, the remaining 65533 steps span min to max
+INT16_FILL, INT16_INVALID, INT16_ZERO = -32768, -32767, -32766
+INT16_FIRST = -32765
+INT16_STEPS = 32767 - INT16_FIRST
+# units of linear reflectivities, quantised in dBZ
+LINEAR_Z_UNITS = ['Z', 'mm6 m-3', 'mm6/m3', 'mm^6/m^3', 'mm^6 m^-3', 'm^6 m^-3', 'Z m-1 s']
+
+
+def available_codecs():
+    """codecs supported in this environment, preferred first"""
+    return [c for c in PREFERENCE if c in CODECS]
+
+
+def negotiate(client_codecs):
+    """choose the codec for a comma separated list of client codecs
+
+    Returns:
+        name of the codec or None if there is no common one
+    """
+    if not client_codecs:
+        return None
+    for c in client_codecs.split(','):
+        if c.strip() in CODECS:
+            return c.strip()
+    return None
+
+
+def encode_array(arr, codec, precision=None, log=False, fill_value=None):
+    """encode a numeric array as dict with the compressed raw buffer
+
+    Args:
+        arr (np.ndarray): array
+        codec (str): one of ``CODECS``
+        precision (str, optional): ``'float16'`` or ``'int16'`` for lossy transfer of float arrays
+        log (bool, optional): quantise ``int16`` in dB (for linear reflectivities, ratios, ...)
+        fill_value (float, optional): kept exactly with ``int16``, it does not take up a step of the range
+
+    Returns:
+        msgpack-serializable dict
+    """
+    arr = np.ascontiguousarray(arr)
+    enc = {'__ndarray__': True, 'codec': codec, 'shape': list(arr.shape)}
+    if precision is not None and arr.dtype.kind == 'f':
+        if precision == 'float16':
+            enc['dtype_orig'] = arr.dtype.str
+            arr = arr.astype(np.float16)
+        elif precision == 'int16':
+            enc['dtype_orig'] = arr.dtype.str
+            q = np.full(arr.shape, INT16_INVALID, dtype=np.int16)
+            fill = (arr == fill_value) if fill_value is not None else np.zeros(arr.shape, dtype=bool)
+            q[fill] = INT16_FILL
+            values = arr
+            if log:
+                q[~fill & (arr <= 0)] = INT16_ZERO
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    values = 10 * np.log10(arr)
+            valid = np.isfinite(values) & ~fill
+            vmin = float(values[valid].min()) if valid.any() else 0.
+            vmax = float(values[valid].max()) if valid.any() else 0.
+            scale = (vmax - vmin) / INT16_STEPS if vmax > vmin else 1.
+            q[valid] = np.round((values[valid] - vmin) / scale + INT16_FIRST).astype(np.int16)
+            enc.update({'scale': scale, 'offset': vmin, 'log': bool(log), 'fill_value': fill_value})
+            arr = q
+        else:
+            raise ValueError(f"unknown precision {precision}, use one of {PRECISIONS}")
+    enc['dtype'] = arr.dtype.str
+    enc['data'] = CODECS[codec][0](arr.tobytes())
+    return enc
+
+
+def decode_array(enc):
+    """inverse of :py:func:`encode_array`, lossy arrays are returned in their original dtype"""
+    buf = bytearray(CODECS[enc['codec']][1](enc['data']))
+    arr = np.frombuffer(buf, dtype=np.dtype(enc['dtype'])).reshape(enc['shape'])
+    if 'scale' in enc:
+        out = (arr.astype(enc['dtype_orig']) - INT16_FIRST) * enc['scale'] + enc['offset']
+        if enc.get('log'):
+            out = 10 ** (out / 10.)
+        out[arr == INT16_INVALID] = np.nan
+        out[arr == INT16_ZERO] = 0.
+        out[arr == INT16_FILL] = enc['fill_value'] if enc.get('fill_value') is not None else np.nan
+        return out
+    if 'dtype_orig' in enc:
+        return arr.astype(enc['dtype_orig'])
+    return arr
+
+
+def logarithmic(data):
+    """True if the variable of the container is linear but spans orders of magnitude (reflectivity, ldr, backscatter),
+    judged by the var_conversion, plot_varconverter or var_unit"""
+    paraminfo = data.get('paraminfo', {})
+    return ('z2lin' in str(paraminfo.get('var_conversion', ''))
+            or data.get('plot_varconverter', paraminfo.get('plot_varconverter')) in ['dB', 'log', 'lin2z']
+            or data.get('var_unit') in LINEAR_Z_UNITS)
+
+
+def encode_container(data, codec, precision=None):
+    """replace the numeric arrays of a data container by encoded buffers (in place)
+
+    Args:
+        data (dict): data container
+        codec (str): one of ``CODECS``
+        precision (str, optional): lossy transfer of the variable
+
+    Returns:
+        the data container
+    """
+    log = precision == 'int16' and logarithmic(data)
+    fill_value = data.get('paraminfo', {}).get('fill_value', -999.)
+    for k in ARRAY_KEYS:
+        if k in data and isinstance(data[k], np.ndarray) and data[k].dtype.kind in 'biuf':
+            if k in LOSSY_KEYS:
+                data[k] = encode_array(data[k], codec, precision=precision, log=log, fill_value=fill_value)
+            else:
+                data[k] = encode_array(data[k], codec)
+    return data
+
+
+def decode_container(data):
+    """decode all arrays of a data container received with :py:func:`encode_container` (in place)"""
+    for k in ARRAY_KEYS:
+        if k in data and isinstance(data[k], dict) and data[k].get('__ndarray__'):
+            data[k] = decode_array(data[k])
+    return data
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+# coding=utf-8
+""" """
+
+"""
+Build or update the multi-resolution tile pyramids for the quicklooks.
+Should run after ListCollector.py, e.g. in the same cronjob.
+
+"""
+
+import sys
+sys.path.append('../')
+import pyLARDA
+import pyLARDA.TilePyramid as TilePyramid
+from pathlib import Path
+import argparse
+
+import logging
+log = logging.getLogger('pyLARDA')
+log.setLevel(logging.INFO)
+log.addHandler(logging.StreamHandler())
+
+ROOT_DIR = Path(__file__).absolute().parents[1]
+
+parser = argparse.ArgumentParser(
+    description='''
+    Example `python3 TileCollector.py -c lacros_dacapo -p MIRA:Zg MIRA:VELg`.
+    Without -p the list ``tile_params`` from the campaigns.toml is used.'''
+)
+parser.add_argument('-c', '--campaign', nargs='+',
+                    help='just run for a defined campaign(s)')
+parser.add_argument('-p', '--param', nargs='+',
+                    help='system:param pairs to build the pyramid for')
+parser.add_argument('--levels', nargs='+', type=int,
+                    help='time resolutions of the levels in seconds, default {}'.format(TilePyramid.DEFAULT_LEVELS))
+parser.add_argument('--rebuild', action='store_true',
+                    help='ignore the existing tiles and rebuild from scratch')
+args = parser.parse_args()
+
+camp = pyLARDA.LARDA_campaign(ROOT_DIR / Path("../larda-cfg/"), "campaigns.toml")
+camp_list = camp.get_campaign_list()
+
+if args.campaign:
+    assert set(args.campaign).issubset(camp_list), 'campaign not in list'
+    camp_list = args.campaign
+
+for cname in camp_list:
+    camp.assign_campaign(cname)
+    if args.param:
+        params = args.param
+    elif 'tile_params' in camp.info_dict:
+        params = camp.info_dict['tile_params']
+    else:
+        print(f'no tile_params for {cname}')
+        continue
+    params = [p.split(':') for p in params]
+
+    larda = pyLARDA.LARDA().connect(cname, build_lists=False)
+    tile_dir = TilePyramid.get_tile_dir(larda.camp.info_dict, cname)
+    for system, param in params:
+        rebuilt = TilePyramid.build_pyramid(
+            larda, system, param, tile_dir, levels=args.levels, rebuild=args.rebuild)
+        print(cname, system, param, {res: len(idxs) for res, idxs in rebuilt.items()})
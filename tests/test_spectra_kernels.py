@@ -0,0 +1,514 @@
+"""the compiled spectra kernels against the per-spectrum functions and the loops they replaced
+
+run with ``python -m pytest tests``
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pyLARDA.SpectraProcessing as SpectraProcessing
+import pyLARDA.spec2mom_limrad94 as spec2mom
+import pyLARDA.helpers as h
+
+
+def random_spectra(seed, n_ts=6, n_rg=12, n_vel=64):
+    """noise with gaussian peaks, noise-only spectra and single-bin peaks, in linear units"""
+    rng = np.random.default_rng(seed)
+    spectra = rng.exponential(1e-3, (n_ts, n_rg, n_vel))
+    vel = np.arange(n_vel)
+    for iT in range(n_ts):
+        for iR in range(n_rg):
+            kind = rng.integers(3)
+            if kind == 1:
+                center, width = rng.uniform(0, n_vel), rng.uniform(1, 6)
+                spectra[iT, iR] += rng.uniform(1e-2, 1.) * np.exp(-0.5 * ((vel - center) / width) ** 2)
+            elif kind == 2:
+                spectra[iT, iR, rng.integers(n_vel)] += rng.uniform(1e-2, 1.)
+    return spectra
+
+
+# --- HS74 noise estimation -----------------------------------------------------------------
+
+def test_noise_cube_matches_per_spectrum():
+    spectra = random_spectra(0)
+    n_ts, n_rg, _ = spectra.shape
+    rg_offsets = np.array([0, 5, n_rg])
+    no_av = np.array([2., 20.])
+    skip = np.zeros((n_ts, n_rg), dtype=bool)
+    skip[1, 3] = skip[4, 5] = True
+
+    mean, threshold, variance, numnoise, signal, bounds = spec2mom.estimate_noise_hs74_cube(
+        spectra, no_av, rg_offsets, skip, std_div=6.0)
+
+    for iT in range(n_ts):
+        for iR in range(n_rg):
+            if skip[iT, iR]:
+                assert numnoise[iT, iR] == 0 and list(bounds[iT, iR]) == [-111, -111]
+                continue
+            # the first gate of the second chirp (iR == 5) uses the no_av of its own chirp
+            m, t, v, n, sig, left, right = spec2mom.estimate_noise_hs74_fast(
+                spectra[iT, iR], no_av[int(iR >= rg_offsets[1])], 6.0, 1)
+            np.testing.assert_allclose([mean[iT, iR], threshold[iT, iR], variance[iT, iR]], [m, t, v], rtol=1e-6)
+            assert (numnoise[iT, iR], signal[iT, iR], bounds[iT, iR, 0], bounds[iT, iR, 1]) == (n, sig, left, right)
+
+
+def test_noise_uses_no_av_of_own_chirp():
+    """the old bisect lookup took the no_av of the previous chirp at the first gate of a chirp"""
+    spectra = random_spectra(1)
+    n_ts, n_rg, n_vel = spectra.shape
+    spectra[0, 2, :] = -999.
+    rg_offsets = [0, 5, n_rg]
+    no_av = [1., 50.]
+
+    noise = SpectraProcessing.noise_estimation_uncompressed_data(
+        {'var': spectra}, n_std=6.0, rg_offsets=rg_offsets, no_av=no_av)
+
+    assert noise['numnoise'][0, 2] == 0 and noise['signal'][0, 2]
+    for iT in range(n_ts):
+        for iR in range(n_rg):
+            if iT == 0 and iR == 2:
+                continue
+            m, t, v, n = SpectraProcessing.estimate_noise_hs74(
+                spectra[iT, iR], navg=no_av[int(iR >= rg_offsets[1])], std_div=6.0)
+            np.testing.assert_allclose([noise['mean'][iT, iR], noise['threshold'][iT, iR], noise['variance'][iT, iR]],
+                                       [m, t, v], rtol=1e-6)
+            assert noise['numnoise'][iT, iR] == n
+            assert noise['signal'][iT, iR] == (n < n_vel)
+
+    # the test is only meaningful if no_av changes the result at the chirp boundary
+    previous_chirp = [SpectraProcessing.estimate_noise_hs74(spectra[iT, 5], navg=no_av[0], std_div=6.0)[3]
+                      for iT in range(n_ts)]
+    assert np.any(noise['numnoise'][:, 5] != previous_chirp)
+
+
+# --- radar moments -------------------------------------------------------------------------
+
+def test_radar_moments_cube_matches_loop():
+    spectra = random_spectra(2)
+    n_ts, n_rg, n_vel = spectra.shape
+    spectra[2, 7, :] = 0.  # masked
+    rg_offsets = [0, 5, n_rg]
+    vel = [np.linspace(-8., 8., n_vel), np.linspace(-4., 4., n_vel)]
+    DoppRes = [v[1] - v[0] for v in vel]
+    edges = np.array([[SpectraProcessing.find_peak_edges(spectra[iT, iR], threshold=2e-3)[1] for iR in range(n_rg)]
+                      for iT in range(n_ts)])
+    edges[2, 7] = [0, 0]
+    skip = np.zeros((n_ts, n_rg), dtype=bool)
+    skip[0, 0] = skip[3, 11] = True
+
+    moments = SpectraProcessing.radar_moments_cube(
+        spectra, edges, np.array(vel), np.array(DoppRes), np.array(rg_offsets), skip)
+
+    # the chirp x range x time loop of spectra2moments
+    expected = np.full((5, n_ts, n_rg), np.nan)
+    for iC in range(len(vel)):
+        for iR in range(rg_offsets[iC], rg_offsets[iC + 1]):
+            for iT in range(n_ts):
+                if skip[iT, iR]: continue
+                lb, rb = edges[iT, iR, :]
+                expected[:, iT, iR] = SpectraProcessing.radar_moment_calculation(spectra[iT, iR, lb:rb], vel[iC][lb:rb], DoppRes[iC])
+
+    assert np.array_equal(moments, expected, equal_nan=True)
+    # single-bin peaks, the empty peak of the masked pixel and the skipped pixels are part of the comparison
+    assert np.any(edges[:, :, 1] - edges[:, :, 0] == 1)
+    assert moments[0, 2, 7] == 0.
+    assert np.isnan(moments[:, 0, 0]).all()
+
+
+def moments_loop(chirps, include_noise=False, main_peak=False):
+    """the range x time loop of spectra_to_moments_rpgfmcw94 before moments_cube"""
+    n_ts = chirps[0]['ts'].size
+    moments = np.full((5, sum(c['rg'].size for c in chirps), n_ts), np.nan)
+    iR_tot = 0
+    for c in chirps:
+        for iR in range(c['rg'].size):
+            for iT in range(n_ts):
+                if include_noise:
+                    moments[:, iR_tot, iT] = spec2mom.moment_calculation(c['var'][iT, iR, :], c['vel'], c['DoppRes'])
+                elif c['signal'][iT, iR]:
+                    if main_peak:
+                        lb, rb = c['bounds'][iT, iR, :]
+                        moments[:, iR_tot, iT] = spec2mom.moment_calculation(
+                            c['var'][iT, iR, lb:rb].copy(), c['vel'][lb:rb], c['DoppRes'])
+                    else:
+                        spec_no_noise = c['var'][iT, iR, :].copy()
+                        spec_no_noise[c['var'][iT, iR, :] < c['threshold'][iT, iR]] = np.nan
+                        moments[:, iR_tot, iT] = spec2mom.moment_calculation(spec_no_noise, c['vel'], c['DoppRes'])
+            iR_tot += 1
+    return moments
+
+
+@pytest.mark.parametrize('mode', [{}, {'main_peak': True}, {'include_noise': True}])
+def test_spectra_to_moments_matches_loop(mode):
+    spectra = random_spectra(3)
+    n_ts, n_rg, n_vel = spectra.shape
+    spectra[4, :, :] = -999.  # fill values, skipped by the noise estimation
+    chirps = []
+    for iC, (r0, r1) in enumerate([(0, 5), (5, n_rg)]):
+        vel = np.linspace(-8., 8., n_vel) / (iC + 1)
+        chirps.append({'ts': np.arange(n_ts), 'rg': np.arange(r0, r1), 'var': spectra[:, r0:r1].copy(), 'no_av': 4.,
+                       'vel': vel, 'DoppRes': vel[1] - vel[0]})
+    for c, noise in zip(chirps, spec2mom.noise_estimation(chirps, n_std_deviations=6.0)):
+        c.update(noise)
+
+    moments = spec2mom.spectra_to_moments_rpgfmcw94(chirps, **mode)
+    expected = moments_loop(chirps, **mode)
+
+    for i, mom in enumerate(['Ze', 'VEL', 'sw', 'skew', 'kurt']):
+        ref = np.ma.masked_invalid(expected[i])
+        if mom == 'Ze':
+            ref = np.ma.masked_less_equal(ref, 0.0)
+        assert np.array_equal(np.ma.getmaskarray(moments[mom]), np.ma.getmaskarray(ref)), mom
+        assert np.array_equal(moments[mom].filled(np.nan), ref.filled(np.nan), equal_nan=True), mom
+
+
+# --- dealiasing ----------------------------------------------------------------------------
+
+def dealiasing_loop(spectra, vel_bins_per_chirp, noisefloor, rg_offsets, show_triple=False, vel_offsets=None, jump=None):
+    """the sequential dealiasing on the tripled spectra, before _dealiasing_kernel"""
+    (n_ts, n_rg, n_vel), n_ch = spectra.shape, len(rg_offsets) - 1
+    n_vel_new = 3 * n_vel
+    k = 2
+    if jump is None:
+        jump = n_vel // 2
+
+    _one_in_all = [-7.0, +7.0] if vel_offsets is None else vel_offsets
+    velocty_jump_tolerance = np.array([_one_in_all for _ in range(n_ch)])
+    rg_diffs = np.diff(rg_offsets)
+    Dopp_res = np.array([vel_bins_per_chirp[ic][1] - vel_bins_per_chirp[ic][0] for ic in range(n_ch)])
+    iDbinTol = [velocty_jump_tolerance[ires, :] // res for ires, res in enumerate(Dopp_res)]
+    iDbinTol = np.concatenate([np.array([iDbinTol[ic]] * rg_diffs[ic]) for ic in range(n_ch)]).astype(int)
+
+    Z_linear = np.concatenate([spectra for _ in range(3)], axis=2)
+    window_fcn = np.kaiser(n_vel_new, 4.0)
+    signal_boundaries = np.zeros((n_ts, n_rg, 2), dtype=int)
+    search_path = np.zeros((n_ts, n_rg, 2), dtype=int)
+    dealiased_spectra = np.full(Z_linear.shape, -999.0, dtype=np.float32)
+    dealiased_mask = np.full(Z_linear.shape, True, dtype=bool)
+    idx_peak_matrix = np.full((n_ts, n_rg), n_vel_new // 2, dtype=int)
+    all_clear = np.all(np.all(spectra <= 0.0, axis=2), axis=1)
+    noise = np.copy(noisefloor)
+    noise_mask = spectra.min(axis=2) > noise
+    noise[noise_mask] = spectra.min(axis=2)[noise_mask]
+
+    for iT in range(n_ts):
+        if all_clear[iT]: continue
+        idx_last_peak = n_vel_new // 2
+        for iR in range(n_rg - 1, -1, -1):
+            search_window = range(max(idx_last_peak + iDbinTol[iR, 0], 0), min(idx_last_peak + iDbinTol[iR, 1], n_vel_new))
+            Z_windowed = Z_linear[iT, iR, :] * np.roll(window_fcn, n_vel_new // 2 - idx_last_peak)
+            Z_windowed = Z_windowed[search_window]
+            idx_new_peak = np.argmax(Z_windowed) + search_window[0]
+
+            mean_idx_last_ts = int(np.mean(idx_peak_matrix[max(0, iT - k):min(iT + 1, n_ts), max(0, iR - 1):min(iR + k, n_rg)]))
+            if abs(idx_new_peak - mean_idx_last_ts) > jump:
+                idx_new_peak = mean_idx_last_ts
+                search_window = range(max(idx_new_peak + iDbinTol[iR, 0], 0), min(idx_new_peak + iDbinTol[iR, 1], n_vel_new))
+
+            search_path[iT, iR, :] = [search_window[0], search_window[-1]]
+
+            if search_window[0] < idx_new_peak < search_window[-1]:
+                _, _bnd = SpectraProcessing.find_peak_edges(Z_linear[iT, iR, :], threshold=noise[iT, iR], imaxima=idx_new_peak)
+                if _bnd[0] == _bnd[1] + 1:
+                    idx_peak_matrix[iT, iR] = idx_last_peak
+                    signal_boundaries[iT, iR, :] = [-1, -1]
+                else:
+                    signal_boundaries[iT, iR, :] = _bnd
+                    idx_peak_matrix[iT, iR] = idx_new_peak
+                    idx_last_peak = idx_new_peak
+                    _bnd_tmp = [None, None] if show_triple else _bnd
+                    dealiased_spectra[iT, iR, _bnd_tmp[0]:_bnd_tmp[1]] = Z_linear[iT, iR, _bnd_tmp[0]:_bnd_tmp[1]]
+                    dealiased_mask[iT, iR, _bnd_tmp[0]:_bnd_tmp[1]] = False
+            else:
+                signal_boundaries[iT, iR, :] = [-1, -1]
+                idx_peak_matrix[iT, iR] = idx_last_peak
+
+    signal_boundaries[(signal_boundaries <= 0) + (signal_boundaries >= n_vel_new)] = -1
+    return dealiased_spectra, dealiased_mask, signal_boundaries, search_path, idx_peak_matrix
+
+
+def aliased_spectra(n_ts=10, n_vel=64):
+    """two chirps, the fall velocity increases downwards and exceeds the Nyquist velocity from the top of the
+    lower chirp, the profiles 4 and 5 are clear sky (the time steps after them are an independent segment)"""
+    rng = np.random.default_rng(4)
+    rg_offsets = [0, 8, 16]
+    vel = [np.linspace(-4., 4., n_vel), np.linspace(-4.5, 4.5, n_vel)]
+    spectra = rng.exponential(1e-4, (n_ts, rg_offsets[-1], n_vel))
+    for iT in range(n_ts):
+        for iR in range(rg_offsets[-1]):
+            ic = int(iR >= rg_offsets[1])
+            v_nyq = vel[ic][-1]
+            v_true = max(-1.5 - 0.4 * (rg_offsets[-1] - 1 - iR), -6.) + 0.1 * np.sin(iT)
+            v_folded = (v_true + v_nyq) % (2 * v_nyq) - v_nyq
+            dist = np.abs(vel[ic] - v_folded)
+            dist = np.minimum(dist, 2 * v_nyq - dist)
+            spectra[iT, iR] += 0.5 * np.exp(-0.5 * (dist / 0.3) ** 2)
+    spectra[4:6] = 0.
+    return spectra, vel, rg_offsets, np.full(spectra.shape[:2], 5e-4)
+
+
+@pytest.mark.parametrize('options', [{}, {'show_triple': True}, {'jump': 20, 'vel_offsets': [-4., 5.]}])
+def test_dealiasing_matches_loop(options):
+    spectra, vel, rg_offsets, noise = aliased_spectra()
+    n_vel = spectra.shape[2]
+
+    dealiased, mask, _, bounds, search_path, peaks = SpectraProcessing.dealiasing(
+        spectra, vel, noise, rg_offsets, **options)
+    expected = dealiasing_loop(spectra, vel, noise, rg_offsets, **options)
+
+    for name, new, old in zip(['spectra', 'mask', 'bounds', 'search_path', 'peaks'],
+                              [dealiased, mask, bounds, search_path, peaks], expected):
+        assert np.array_equal(new, old), name
+    # some of the de-aliased signal lies outside of the original velocity range
+    if not options.get('show_triple', False):
+        assert np.any(~mask[:, :, :n_vel]) or np.any(~mask[:, :, 2 * n_vel:])
+
+
+def test_dealiasing_chunks():
+    """de-aliasing in two time chunks with the peaks of the first as previous_peaks gives the same result"""
+    spectra, vel, rg_offsets, noise = aliased_spectra()
+    full = SpectraProcessing.dealiasing(spectra, vel, noise, rg_offsets)
+
+    split = 3
+    first = SpectraProcessing.dealiasing(spectra[:split], vel, noise[:split], rg_offsets)
+    second = SpectraProcessing.dealiasing(spectra[split:], vel, noise[split:], rg_offsets, previous_peaks=first[5])
+
+    for i in [0, 1, 3, 4, 5]:
+        assert np.array_equal(np.concatenate([first[i], second[i]]), full[i]), i
+    # the look-back of the second chunk does not start from the default peaks
+    assert np.any(first[5][-2:] != 3 * spectra.shape[2] // 2)
+
+
+# --- peak edges ----------------------------------------------------------------------------
+
+def test_find_peak_edges_cube_matches_per_spectrum():
+    spectra = random_spectra(5)
+    n_ts, n_rg, n_vel = spectra.shape
+    # main peaks at the first and the last velocity bin
+    spectra[0, 0, 0] = spectra[0, 1, -1] = 5.
+    spectra[1, 0, :3] = spectra[1, 1, -3:] = 5.
+    threshold = np.full((n_ts, n_rg), 2e-3, dtype=np.float32)
+    threshold[2] = -1.  # minimum of the spectrum
+    threshold[3, :4] = 10.  # above the peak
+    skip = np.zeros((n_ts, n_rg), dtype=bool)
+    skip[5, 5] = True
+
+    edges = SpectraProcessing.find_peak_edges_cube(spectra, threshold, skip)
+
+    for iT in range(n_ts):
+        for iR in range(n_rg):
+            if skip[iT, iR]:
+                assert list(edges[iT, iR]) == [0, 0]
+                continue
+            _, bounds = SpectraProcessing.find_peak_edges(spectra[iT, iR], threshold=threshold[iT, iR])
+            assert list(edges[iT, iR]) == bounds, (iT, iR)
+    assert list(edges[0, 0]) == [0, 1] and list(edges[0, 1]) == [n_vel - 1, n_vel]
+
+
+# --- despeckle -----------------------------------------------------------------------------
+
+def despeckle_naive(mask, min_percentage, window, in_place=True):
+    """sum of the full box at every pixel, in place (order dependent) or on the input mask"""
+    source = mask if in_place else mask.copy()
+    min_bins = int(min_percentage / 100 * window ** mask.ndim)
+    shift = int(window / 2)
+    for start in np.ndindex(*[max(n - window, 0) for n in mask.shape]):
+        box = tuple(slice(i, i + window) for i in start)
+        if source[start] == 1 and np.sum(source[box]) > min_bins:
+            mask[tuple(i + shift for i in start)] = 1
+    return mask
+
+
+def speckled_mask(seed, shape, dtype):
+    rng = np.random.default_rng(seed)
+    mask = rng.random(shape) < 0.7
+    # fully masked edges
+    mask[0] = True
+    mask[(slice(None), -1)] = True
+    return mask.astype(dtype)
+
+
+@pytest.mark.parametrize('window, min_percentage', [(5, 80.), (3, 50.), (4, 80.), (7, 60.)])
+@pytest.mark.parametrize('dtype', [np.int64, np.bool_])
+def test_despeckle_matches_naive(window, min_percentage, dtype):
+    mask = speckled_mask(6, (40, 33), dtype)
+    expected = despeckle_naive(mask.copy(), min_percentage, window)
+    assert np.array_equal(spec2mom.despeckle(mask.copy(), min_percentage, window), expected)
+    assert np.array_equal(spec2mom.despeckle_box(mask, min_percentage, window),
+                          despeckle_naive(mask.copy(), min_percentage, window, in_place=False))
+
+
+@pytest.mark.parametrize('window, min_percentage', [(5, 80.), (3, 50.), (4, 70.)])
+def test_despeckle3d_matches_naive(window, min_percentage):
+    mask = speckled_mask(7, (14, 12, 16), np.int64)
+    expected = despeckle_naive(mask.copy(), min_percentage, window)
+    assert np.array_equal(spec2mom.despeckle3d(mask.copy(), min_percentage, window), expected)
+    assert np.array_equal(spec2mom.despeckle_box(mask, min_percentage, window),
+                          despeckle_naive(mask.copy(), min_percentage, window, in_place=False))
+
+
+def test_despeckle_small_masks():
+    mask = speckled_mask(8, (5, 12), np.int64)
+    assert np.array_equal(spec2mom.despeckle(mask.copy(), 80., 5), mask)
+    assert np.array_equal(spec2mom.despeckle_box(mask, 80., 5), mask)
+
+
+def test_despeckle2D():
+    spectra = random_spectra(9, n_ts=20, n_rg=16, n_vel=8)
+    spectra[speckled_mask(9, (20, 16), np.bool_)] = 0.
+    mask = SpectraProcessing.despeckle2D(spectra, min_perc=60., window=3)
+    expected = despeckle_naive(np.all(spectra <= 0., axis=2), 60., 3)
+    assert mask.shape == spectra.shape
+    assert all(np.array_equal(mask[:, :, i], expected) for i in range(spectra.shape[2]))
+
+
+# --- ghost echo filters --------------------------------------------------------------------
+
+def filter_ghost_1_loop(data, rg, vel, offset, dBZ_thresh=-20.0, reduce_by=1.5, ignore_chirp1=True):
+    """filter_ghost_1 with the per-chirp and per-bin loops"""
+    mask = data <= 0.0
+    dBZ_max = np.max(data[:, h.argnearest(rg, 0.0):h.argnearest(rg, 500.0), :], axis=2)
+    ts_to_mask = np.any(dBZ_max >= h.z2lin(0.0), axis=1)
+    signal_min = h.z2lin(dBZ_thresh)
+    n_vel = data.shape[2]
+    for iC in range(len(vel)):
+        if iC < 1 and ignore_chirp1:
+            continue
+        idx_max_vel_new = h.argnearest(vel[iC], vel[iC][-1] - reduce_by)
+        for iV in range(n_vel - idx_max_vel_new):
+            mask[ts_to_mask, offset[iC]:offset[iC + 1], iV] = data[ts_to_mask, offset[iC]:offset[iC + 1], iV] < signal_min
+        for iV in range(idx_max_vel_new, n_vel):
+            mask[ts_to_mask, offset[iC]:offset[iC + 1], iV] = data[ts_to_mask, offset[iC]:offset[iC + 1], iV] < signal_min
+    return mask
+
+
+def filter_ghost_2_loop(data, rg, SL, first_offset, dBZ_thresh=-5.0, reduce_by=10.0):
+    """filter_ghost_2 with the per-time and per-bin loops"""
+    mask = data <= 0.0
+    dBZ_max = np.max(data[:, h.argnearest(rg, 1500.0):h.argnearest(rg, 6000.0), :], axis=2)
+    ts_to_mask = np.any(dBZ_max >= h.z2lin(dBZ_thresh), axis=1)
+    sens_lim = SL * reduce_by
+    for iT, mask_iT in enumerate(ts_to_mask):
+        if mask_iT:
+            for iV in range(data.shape[2]):
+                mask[iT, :first_offset, iV] = data[iT, :first_offset, iV] < sens_lim[iT, :first_offset]
+    return mask
+
+
+def nyquist_ghosts_loop(data):
+    """the chirp 2/3 ghost echo filter of filter_ghost_echos_RPG94GHz_FMCW with the per-bin loops"""
+    for ichirp in [0, 1, 2]:
+        new_ny_vel = data[ichirp]['vel'].max() - 2.5
+        ic_Ze_max = h.z2lin(-22.5)
+        idx_left = np.argwhere(-new_ny_vel > data[ichirp]['vel']).max()
+        idx_right = np.argwhere(new_ny_vel < data[ichirp]['vel']).min()
+        Ze_lin_left = data[ichirp]['var'][:, :, :idx_left].copy()
+        Ze_lin_right = data[ichirp]['var'][:, :, idx_right:].copy()
+        idx_ts_nf0 = np.argwhere(data[ichirp]['var'][:, 0, 0] != -999.0)
+        if idx_ts_nf0.size > 0:
+            mask_left, mask_right = Ze_lin_left < ic_Ze_max, Ze_lin_right < ic_Ze_max
+            min_left, min_right = np.amin(Ze_lin_left, axis=2), np.amin(Ze_lin_right, axis=2)
+            for i_bin in range(mask_left.shape[2]):
+                Ze_lin_left[mask_left[:, :, i_bin], i_bin] = min_left[mask_left[:, :, i_bin]]
+            for i_bin in range(mask_right.shape[2]):
+                Ze_lin_right[mask_right[:, :, i_bin], i_bin] = min_right[mask_right[:, :, i_bin]]
+        else:
+            Ze_lin_left[Ze_lin_left < ic_Ze_max] = -999.0
+            Ze_lin_right[Ze_lin_right < ic_Ze_max] = -999.0
+        data[ichirp]['var'][:, :, :idx_left] = Ze_lin_left.copy()
+        data[ichirp]['var'][:, :, idx_right:] = Ze_lin_right.copy()
+
+
+def ghost_spectra(seed):
+    """three chirps with strong signals near the ground and between 1.5 and 6 km in some time steps"""
+    spectra = random_spectra(seed, n_ts=8, n_rg=30, n_vel=64) * 10.
+    rg = np.linspace(100., 9000., spectra.shape[1])
+    spectra[[1, 4], 1, 30] = 5.
+    spectra[[2, 4, 6], 10, 20] = 2.
+    offset = [0, 8, 20, 30]
+    vel = [np.linspace(-v, v, spectra.shape[2]) for v in [9., 6., 4.]]
+    return spectra, rg, offset, vel
+
+
+@pytest.mark.parametrize('ignore_chirp1', [True, False])
+def test_filter_ghost_1_matches_loop(ignore_chirp1):
+    spectra, rg, offset, vel = ghost_spectra(10)
+    mask = SpectraProcessing.filter_ghost_1(spectra, rg, vel, offset, ignore_chirp1=ignore_chirp1)
+    expected = filter_ghost_1_loop(spectra, rg, vel, offset, ignore_chirp1=ignore_chirp1)
+    assert np.array_equal(mask, expected)
+    assert np.any(mask != (spectra <= 0.))
+
+
+def test_filter_ghost_2_matches_loop():
+    spectra, rg, offset, vel = ghost_spectra(11)
+    SL = np.random.default_rng(11).uniform(1e-4, 3e-3, spectra.shape[:2])
+    mask = SpectraProcessing.filter_ghost_2(spectra, rg, SL, offset[1])
+    expected = filter_ghost_2_loop(spectra, rg, SL, offset[1])
+    assert np.array_equal(mask, expected)
+    assert np.any(mask != (spectra <= 0.))
+
+
+def test_remove_ghost_echos():
+    spectra, rg, offset, vel = ghost_spectra(12)
+    SL = np.random.default_rng(12).uniform(1e-4, 3e-3, spectra.shape[:2])
+    data = {'VHSpec': {'var': spectra.copy(), 'mask': spectra <= 0., 'rg': rg}, 'vel': vel, 'rg_offsets': offset,
+            'SLv': {'var': SL}}
+    SpectraProcessing._remove_ghost_echos(data, True, True)
+
+    expected = spectra.copy()
+    mask1 = filter_ghost_1_loop(expected, rg, vel, offset)
+    expected[mask1] = -999.
+    mask2 = filter_ghost_2_loop(expected, rg, SL, offset[1])
+    expected[mask2] = -999.
+    assert np.array_equal(data['ge1_mask'], mask1) and np.array_equal(data['ge2_mask'], mask2)
+    assert np.array_equal(data['VHSpec']['var'], expected)
+    assert np.array_equal(data['VHSpec']['mask'], (spectra <= 0.) | mask1 | mask2)
+
+
+@pytest.mark.parametrize('noise_removed', [False, True])
+def test_filter_nyquist_ghosts_matches_loop(noise_removed):
+    spectra, rg, offset, vel = ghost_spectra(13)
+    spectra *= 1e-2
+    if noise_removed:
+        spectra[:, 0, 0] = -999.
+    chirps = [{'var': spectra[:, offset[ic]:offset[ic + 1]].copy(), 'vel': vel[ic]} for ic in range(3)]
+    expected = [{'var': c['var'].copy(), 'vel': c['vel']} for c in chirps]
+
+    spec2mom.filter_nyquist_ghosts(chirps)
+    nyquist_ghosts_loop(expected)
+    for c, e in zip(chirps, expected):
+        assert np.array_equal(c['var'], e['var'])
+    assert any(np.any(c['var'] != spectra[:, offset[ic]:offset[ic + 1]]) for ic, c in enumerate(chirps))
+
+
+def test_filter_ghost_echos_chirp1_matches_loop():
+    rng = np.random.default_rng(14)
+    offset = [0, 8, 20, 30]
+    n_ts = 12
+    Ze = np.ma.masked_invalid(rng.uniform(1e-4, 2., (offset[-1], n_ts)))
+    Ze[offset[1]:offset[2], [2, 5, 6]] = 20.  # high reflectivity in chirp 2
+    SL = rng.uniform(1e-6, 1e-4, (n_ts, offset[1]))
+    inv_mask = rng.random((offset[-1], n_ts)) < 0.2
+    data = {mom: Ze.copy() for mom in ['Ze', 'VEL', 'sw', 'skew', 'kurt']}
+
+    new_mask = spec2mom.filter_ghost_echos_RPG94GHz_FMCW(data, C1=True, inv_mask=inv_mask.copy(), offset=offset, SL=SL)
+
+    # the loop over the time steps to mask
+    sens_lim = h.z2lin(h.lin2z(np.mean(SL, axis=0)) + 15.0)
+    ts_to_mask = np.argwhere(h.lin2z(np.ma.sum(Ze[offset[1]:offset[2], :], axis=0)) > 18.0)[:, 0]
+    m1 = inv_mask[:offset[1], :].copy()
+    for idx_ts in ts_to_mask:
+        m1[:, idx_ts] = Ze[:offset[1], idx_ts] < sens_lim
+    expected = inv_mask.copy()
+    expected[:offset[1], :] = m1
+
+    assert len(ts_to_mask) > 0
+    assert np.array_equal(new_mask, expected)
+    for mom in data:
+        assert np.array_equal(np.ma.getmaskarray(data[mom][:offset[1]]), m1)
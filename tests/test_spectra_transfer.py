@@ -0,0 +1,123 @@
+"""regression tests on the synthetic campaign of ``benchmarks/synthetic.py``
+
+run with ``python -m pytest tests``
+"""
+
+import os
+import sys
+import datetime
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import synthetic
+import pyLARDA
+import pyLARDA.SpectraProcessing as SpectraProcessing
+import pyLARDA.transfer as transfer
+import pyLARDA.helpers as h
+
+
+@pytest.fixture(scope='module')
+def setup(tmp_path_factory):
+    return synthetic.generate(str(tmp_path_factory.mktemp('synthetic')), scale=0.1, artefacts=True)
+
+
+@pytest.fixture(scope='module')
+def larda(setup):
+    return pyLARDA.LARDA(config_dir=setup['config_dir']).connect(setup['campaign'], build_lists=True)
+
+
+@pytest.fixture(scope='module')
+def time_span(setup):
+    return [setup['day'], setup['day'] + datetime.timedelta(hours=2)]
+
+
+# the state carried over the chunk borders: previous_peaks of the dealiasing, the ChunkedDespeckle halos
+OPTIONS = {
+    'default': {},
+    'dealiasing': {'dealiasing': True},
+    'despeckle': {'despeckle': True, 'despeckle2D': False},
+    'no_ghost_echo_1': {'ghost_echo_1': False},
+    'no_ghost_echo_2': {'ghost_echo_2': False},
+    'no_despeckle2D': {'despeckle2D': False},
+    'all': {'dealiasing': True, 'despeckle': True},
+}
+
+
+@pytest.fixture(scope='module')
+def moments(larda, time_span):
+    paraminfo = larda.connectors['LIMRAD94'].system_info['params']
+    cache = {}
+
+    def compute(name):
+        if name not in cache:
+            spectra = SpectraProcessing.load_spectra_rpgfmcw94(larda, time_span, **OPTIONS[name])
+            cache[name] = SpectraProcessing.spectra2moments(spectra, paraminfo, **OPTIONS[name])
+        return cache[name]
+    return compute
+
+
+@pytest.mark.parametrize('options', [k for k in OPTIONS if k != 'default'])
+def test_options_change_moments(moments, options):
+    # otherwise the chunked comparison proves nothing about the option
+    reference = moments('no_despeckle2D' if options == 'despeckle' else 'default')
+    assert not np.array_equal(moments(options)['Ze']['mask'], reference['Ze']['mask'])
+
+
+@pytest.mark.parametrize('options', OPTIONS.keys())
+@pytest.mark.parametrize('chunk_size', [1, 7, 1000])
+def test_spectra2moments_chunked(larda, time_span, moments, chunk_size, options):
+    expected = moments(options)
+    chunked = SpectraProcessing.spectra2moments_chunked(larda, time_span, chunk_size=chunk_size, **OPTIONS[options])
+    assert chunked.keys() == expected.keys()
+    for mom in expected:
+        for k in ['ts', 'rg', 'var', 'mask']:
+            assert np.array_equal(chunked[mom][k], expected[mom][k], equal_nan=True), f'{mom} {k}'
+
+
+def roundtrip(data, precision=None):
+    data = {**data, 'var': data['var'].copy()}
+    codec = transfer.available_codecs()[0]
+    return transfer.decode_container(transfer.encode_container(data, codec, precision=precision))
+
+
+def test_transfer_lossless(larda, time_span):
+    data = larda.read('MIRA', 'Zg', time_span, [0, 'max'])
+    decoded = roundtrip(data)
+    for k in ['ts', 'rg', 'var', 'mask']:
+        assert decoded[k].dtype == data[k].dtype
+        assert np.array_equal(decoded[k], data[k], equal_nan=True), k
+
+
+def test_transfer_float16(larda, time_span):
+    data = larda.read('MIRA', 'Zg', time_span, [0, 'max'])
+    decoded = roundtrip(data, precision='float16')
+    assert np.array_equal(decoded['ts'], data['ts'])
+    assert decoded['var'].dtype == data['var'].dtype
+    valid = ~data['mask'] & (data['var'] > 1e-4)
+    assert np.allclose(decoded['var'][valid], data['var'][valid], rtol=1e-3)
+
+
+def test_transfer_int16_log():
+    z_db = np.linspace(-50, 20, 1000)
+    var = h.z2lin(z_db)
+    var[:5] = [-999., 0., np.nan, -1., np.inf]
+    data = {'ts': np.arange(1000.), 'var': var, 'var_unit': 'Z', 'paraminfo': {'fill_value': -999.}}
+    assert transfer.logarithmic(data)
+    decoded = roundtrip(data, precision='int16')
+    assert decoded['var'][0] == -999.
+    assert decoded['var'][1] == 0. and decoded['var'][3] == 0.
+    assert np.isnan(decoded['var'][2]) and np.isnan(decoded['var'][4])
+    assert np.allclose(h.lin2z(decoded['var'][5:]), z_db[5:], atol=2e-3)
+
+
+def test_transfer_int16_linear():
+    var = np.linspace(-10, 10, 1000)
+    data = {'ts': np.arange(1000.), 'var': var, 'var_unit': 'm s-1'}
+    assert not transfer.logarithmic(data)
+    decoded = roundtrip(data, precision='int16')
+    assert np.allclose(decoded['var'], var, atol=20. / transfer.INT16_STEPS)